@@ -0,0 +1,170 @@
+"""
+性能基准 (通过 python backend/manage.py bench <名称> 运行)
+使用合成数据，不依赖数据库与模型
+"""
+import base64
+import gzip
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+CLASS_NAMES = ["plane", "ship", "storage-tank", "vehicle", "bridge", "harbor", "helicopter", "roundabout"]
+
+
+def _timeit(func, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def _fake_rows(n):
+    now = datetime.now()
+    rows = []
+    for i in range(n):
+        details = {c: random.randint(0, 30) for c in random.sample(CLASS_NAMES, 3)}
+        rows.append({
+            "id": i + 1,
+            "filename": f"scene_{i:06d}.tif",
+            "model_type": "YOLO11 (aerial/yolo11s.pt) [SAHI]",
+            "object_count": sum(details.values()),
+            "details": details,
+            "created_at": now - timedelta(seconds=n - i),
+        })
+    return rows
+
+
+def _serialization_payloads(rows):
+    records = _fake_rows(rows)
+    today = datetime.now().date()
+    summary = {
+        "kpis": {"total_tasks": rows, "total_objects": rows * 40, "avg_objects": 40.0,
+                 "latest_time": datetime.now(), "max_id": rows},
+        "daily": [{"date": str(today - timedelta(days=d)), "tasks": 100, "objects": 4000} for d in range(365)],
+        "modes": [{"model_type": f"mode-{i}", "count": 100} for i in range(20)],
+        "classes": [{"class_name": c, "count": 1000} for c in CLASS_NAMES],
+        "sync": {"cursor": rows, "lookback": 500, "seen_ids": list(range(max(0, rows - 500), rows))},
+    }
+    # 检测结果中的 base64 图像 (随机字节近似 JPEG 的不可压缩性)
+    detect = {
+        "message": "Success",
+        "image_base64": base64.b64encode(os.urandom(1_500_000)).decode("ascii"),
+        "total_objects": 120,
+        "details": {c: 15 for c in CLASS_NAMES},
+        "mode": "YOLO11 (aerial/yolo11s.pt) [SAHI]",
+    }
+    return {
+        "/history (50 条)": records[:50],
+        f"/analytics ({rows} 条)": records,
+        "/analytics/summary": summary,
+        "/detect/": detect,
+    }
+
+
+def bench_serialization(rows=20000, repeat=3):
+    """各接口响应的编码耗时与体积：FastAPI 默认 (ORM/jsonable_encoder + json) 对比 orjson / msgpack / 压缩"""
+    from fastapi.encoders import jsonable_encoder
+
+    from models import DetectionRecord
+    from services import serialization
+
+    def fastapi_default(content):
+        return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                          indent=None, separators=(",", ":")).encode("utf-8")
+
+    print(f"orjson: {'已安装' if serialization.orjson else '未安装 (回退 json)'}  "
+          f"msgpack: {'已安装' if serialization.msgpack else '未安装'}  "
+          f"brotli: {'已安装' if serialization.brotli else '未安装'}")
+    header = f"{'接口':<22}{'编码方式':<26}{'耗时 ms':>10}{'体积 KB':>12}"
+    print(header)
+    print("-" * len(header))
+
+    for endpoint, content in _serialization_payloads(rows).items():
+        baseline_input = content
+        if endpoint.startswith("/analytics (") or endpoint.startswith("/history"):
+            # 旧实现：逐个 ORM 对象交给 jsonable_encoder
+            baseline_input = [DetectionRecord(**r) for r in content]
+        cases = [("默认 jsonable_encoder+json", lambda: fastapi_default(baseline_input)),
+                 ("投影 + fast dumps", lambda: serialization.dumps(content))]
+        if serialization.msgpack:
+            cases.append(("投影 + msgpack", lambda: serialization.packb(content)))
+
+        fast_body = serialization.dumps(content)
+        for name, func in cases:
+            seconds, body = _timeit(func, repeat)
+            print(f"{endpoint:<22}{name:<26}{seconds * 1000:>10.2f}{len(body) / 1024:>12.1f}")
+
+        seconds, body = _timeit(lambda: gzip.compress(fast_body, compresslevel=5), repeat)
+        print(f"{endpoint:<22}{'fast dumps + gzip':<26}{seconds * 1000:>10.2f}{len(body) / 1024:>12.1f}")
+        if serialization.brotli:
+            seconds, body = _timeit(lambda: serialization.brotli.compress(fast_body, quality=4), repeat)
+            print(f"{endpoint:<22}{'fast dumps + br':<26}{seconds * 1000:>10.2f}{len(body) / 1024:>12.1f}")
+
+
+# 推理依赖：API 进程启动时不应导入
+ML_MODULES = ("torch", "ultralytics", "sahi", "cv2")
+
+_STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import backend.main as main
+elapsed = time.perf_counter() - started
+import psutil
+print(json.dumps({
+    "import_seconds": elapsed,
+    "rss_mb": psutil.Process().memory_info().rss / 1024 / 1024,
+    "routes": len(main.app.routes),
+    "ml_loaded": [m for m in %r if m in sys.modules],
+}))
+""" % (ML_MODULES,)
+
+
+def bench_startup(repeat=3, top=10):
+    """API 进程启动耗时：在子进程中导入 backend.main (使用临时 SQLite 库，不依赖 MySQL)，统计耗时、内存与最慢的导入"""
+    # 与 uvicorn backend.main:app 一样从项目根目录导入
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, RS_DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}", RS_DATA_DIR=tmp)
+
+        runs = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            out = subprocess.run([sys.executable, "-c", _STARTUP_PROBE], cwd=project_dir, env=env,
+                                 capture_output=True, text=True)
+            wall = time.perf_counter() - started
+            if out.returncode != 0:
+                print(out.stderr)
+                raise RuntimeError("导入 backend.main 失败")
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            result["wall_seconds"] = wall
+            runs.append(result)
+
+        best = min(runs, key=lambda r: r["wall_seconds"])
+        print(f"进程启动总耗时 (含解释器): {best['wall_seconds'] * 1000:.0f} ms")
+        print(f"import backend.main 耗时:  {best['import_seconds'] * 1000:.0f} ms")
+        print(f"启动后常驻内存 (RSS):      {best['rss_mb']:.0f} MB")
+        print(f"注册路由数:                {best['routes']}")
+        print(f"已加载的推理依赖:          {', '.join(best['ml_loaded']) or '无'}")
+
+        # -X importtime 输出每个模块自身的导入耗时 (微秒)，按顶层包汇总
+        out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import backend.main"], cwd=project_dir, env=env,
+                             capture_output=True, text=True)
+        packages = {}
+        for line in out.stderr.splitlines():
+            parts = line.split("|")
+            self_us = parts[0].rsplit(":", 1)[-1].strip()
+            if len(parts) != 3 or not self_us.isdigit():
+                continue
+            package = parts[2].strip().split(".")[0]
+            packages[package] = packages.get(package, 0) + int(self_us)
+        print(f"\n导入耗时最多的 {top} 个包 (ms):")
+        for package, us in sorted(packages.items(), key=lambda kv: -kv[1])[:top]:
+            print(f"  {package:<24}{us / 1000:>10.1f}")
@@ -6,7 +6,7 @@ DB_PASS = "root"  # 请修改为你的密码
 DB_HOST = "localhost"
 DB_PORT = "3306"
 DB_NAME = "yolo_detection"
-DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+DATABASE_URL = os.getenv("RS_DATABASE_URL", f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
 
 # 模型路径配置
 MODEL_PATHS = {
@@ -15,4 +15,100 @@ MODEL_PATHS = {
 }
 
 # 显卡配置
-DEVICE = 'cuda:0' # 如果没有显卡改为 'cpu'
\ No newline at end of file
+DEVICE = os.getenv("RS_DEVICE", 'cuda:0')  # CUDA 不可用时自动回退到 CPU (见 services/execution_plan.py)
+
+# 运行时数据目录 (任务队列等本地持久化文件)
+DATA_DIR = os.getenv("RS_DATA_DIR", "runtime")
+
+# CPU 执行计划 (python backend/manage.py calibrate-cpu 生成)：线程数、worker 数、batch 大小、CPU 绑核
+EXECUTION_PLAN_PATH = os.path.join(DATA_DIR, "execution_plan.json")
+
+# 异步任务队列配置
+JOB_DB_PATH = os.path.join(DATA_DIR, "jobs.sqlite3")
+JOB_INPUT_DIR = os.path.join(DATA_DIR, "job_inputs")
+JOB_WORKERS = int(os.getenv("RS_JOB_WORKERS", "1"))  # API 进程内启动的 worker 进程数，0 表示需单独运行 worker.py
+JOB_POLL_INTERVAL = 0.5      # worker 空闲时轮询队列的间隔 (秒)
+JOB_LEASE_SECONDS = 900      # 任务租约，worker 崩溃后超时的任务会重新入队
+JOB_MAX_ATTEMPTS = 3         # 单个任务最多执行次数
+JOB_RESULT_TTL_HOURS = 24    # 已完成任务的结果保留时长
+# 自动转异步：SAHI 请求预计切片数超过该值时，/detect/ 直接转为后台任务
+JOB_PROMOTE_SAHI_TILES = 24
+
+# 检测记录写入配置 (write-behind 批量写库)
+# sync: 每条同步提交; buffer: 内存缓冲批量提交 (崩溃最多丢失一个刷新周期); journal: 先写本地日志再缓冲 (进程崩溃后回放；日志由后台线程每个刷新周期 fsync 一次)
+RECORD_WRITE_MODE = os.getenv("RS_RECORD_WRITE_MODE", "journal")
+RECORD_FLUSH_SIZE = 200          # 缓冲达到该条数立即刷新
+RECORD_FLUSH_INTERVAL = 1.0      # 最长刷新间隔 (秒)
+RECORD_MAX_BUFFER = 20000        # 缓冲上限，超过后退化为同步写
+RECORD_JOURNAL_DIR = os.path.join(DATA_DIR, "record_journal")
+
+# 视频会话聚合配置
+VIDEO_SESSION_IDLE_TIMEOUT = 60  # 超过该时间 (秒) 未收到新帧的会话自动结束并落库
+# 进行中会话的聚合状态 (同一会话的帧可能落到不同的 worker 进程，各进程共享这个本地 SQLite)
+VIDEO_SESSION_STATE_PATH = os.path.join(DATA_DIR, "video_sessions.sqlite3")
+
+# 大屏增量同步：多进程批量写入时较小的 id 可能晚提交，客户端每次回看游标前这么多个 id 并按 id 去重
+SYNC_LOOKBACK_IDS = 500
+
+# 统计接口响应缓存：每个进程缓存的编码后响应总大小上限 (字节)
+ANALYTICS_CACHE_MAX_BYTES = int(os.getenv("RS_ANALYTICS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# 历史记录导出：服务端游标每次读取的行数 (也是 Arrow RecordBatch / Parquet row group 的大小)
+EXPORT_CHUNK_SIZE = 5000
+
+# 响应压缩：超过该大小 (字节) 的响应按 Accept-Encoding 使用 br / gzip 压缩
+RESPONSE_COMPRESS_MIN_BYTES = 4096
+
+# 检测记录保留策略 (python backend/manage.py retention)
+RETENTION_DAYS = int(os.getenv("RS_RETENTION_DAYS", "180"))  # 原始记录保留天数，更早的记录归档后从数据库删除
+ARCHIVE_DIR = os.path.join(DATA_DIR, "archive")               # 归档文件目录 (Parquet + zstd，按天分区)
+RETENTION_BATCH_SIZE = 1000      # 每个删除事务的记录数
+RETENTION_BATCH_PAUSE = 0.05     # 批次之间的间隔 (秒)，给在线写入让出锁
+
+# 认证用户缓存：Token 对应的用户信息缓存时长 (秒)。修改角色/删除用户时本进程立即失效，其他 worker 进程最多延迟这么久
+PRINCIPAL_CACHE_TTL = 30
+PRINCIPAL_CACHE_MAX = 10000
+PRINCIPAL_REVOCATION_CHECK = 1.0  # 每个进程检查共享撤销版本号的间隔 (秒)；管理员接口每次都检查
+
+# 密码哈希 (bcrypt)：轮数用 python backend/manage.py calibrate-bcrypt 在部署机器上按目标耗时测得
+# 修改轮数后，旧哈希会在用户下次登录成功时自动按新轮数重新计算
+BCRYPT_ROUNDS = int(os.getenv("RS_BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = 2    # bcrypt 专用线程数
+PASSWORD_HASH_QUEUE = 32     # 最多排队的哈希任务数，超过后登录/注册返回 503
+
+# 启动时在后台线程预先导入推理依赖 (torch / ultralytics / sahi)。只跑认证、管理、统计接口的进程保持关闭，秒级启动
+PRELOAD_INFERENCE = os.getenv("RS_PRELOAD_INFERENCE", "0") == "1"
+
+# prefork 部署 (python backend/serve.py)：主进程预加载这些模型 ("场景/文件名")，fork 出的 HTTP worker 共享权重
+PRELOAD_MODELS = [m for m in os.getenv("RS_PRELOAD_MODELS", "").split(",") if m]
+
+# 推理调度 (/detect/ 同步请求)：每个进程同时推理的请求数、单个模型同时推理的请求数、最多排队数
+INFERENCE_MAX_CONCURRENCY = int(os.getenv("RS_INFERENCE_CONCURRENCY", "2"))
+INFERENCE_MODEL_CONCURRENCY = 1
+INFERENCE_QUEUE_MAX = 32         # 排满后返回 429 + Retry-After
+INFERENCE_AGING_SECONDS = 10     # 每等待这么久优先级提升一级，避免批量请求被饿死
+VIDEO_FRAME_MAX_WAIT = 0.5       # 视频帧排队超过该时间 (秒) 直接丢弃，客户端继续发送下一帧
+
+# 推理配额 (按用户)：rate 为每秒恢复的 "推理秒"，burst 为桶容量，weight 为排队时的公平份额权重
+# 默认值可在管理后台按角色修改；未登录的请求按客户端 IP 计为 anonymous
+QUOTA_DB_PATH = os.path.join(DATA_DIR, "usage.sqlite3")
+ROLE_QUOTA_DEFAULTS = {
+    "admin": {"weight": 4.0, "rate": 1.0, "burst": 60.0},
+    "user": {"weight": 2.0, "rate": 0.5, "burst": 30.0},
+    "anonymous": {"weight": 1.0, "rate": 0.25, "burst": 10.0},
+}
+QUOTA_POLICY_REFRESH = 5     # 各进程重新读取角色策略的间隔 (秒)
+USAGE_FLUSH_INTERVAL = 5     # 用量统计写入间隔 (秒)
+
+# SAHI 切片并行推理 (仅 CPU 推理时生效)：单个大图请求的切片分发到这么多个常驻推理进程，0 表示关闭
+SAHI_TILE_WORKERS = int(os.getenv("RS_SAHI_TILE_WORKERS", "0"))
+
+# 同步检测请求的最长推理时间 (秒)，与前端请求超时一致；超时或客户端断开后推理在下一组切片前停止，不再写库
+INFERENCE_TIMEOUT = float(os.getenv("RS_INFERENCE_TIMEOUT", "30"))
+
+# 权重目录轮询间隔 (秒)：已加载的模型文件被替换后在后台加载、预热新版本再原子替换，文件被删除时移出缓存；0 表示关闭
+WEIGHTS_POLL_INTERVAL = float(os.getenv("RS_WEIGHTS_POLL_INTERVAL", "2"))
+
+# 模型注册表 (权重文件的摘要、类别名、输入尺寸、参数量、实测延迟)；模型列表读索引，权重目录按该间隔 (秒) 重新扫描
+MODEL_REGISTRY_PATH = os.path.join(DATA_DIR, "model_registry.sqlite3")
+MODEL_REGISTRY_RESCAN = 30
@@ -5,9 +5,21 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from fastapi import FastAPI
 from database import engine
 from models import Base
+from migrations import run_migrations
 from contextlib import asynccontextmanager
+import threading
+from config import JOB_WORKERS, PRELOAD_INFERENCE
+from services.execution_plan import execution_plan
+# 在任何模块导入 torch 之前应用 CPU 执行计划 (线程数)
+execution_plan.apply_process()
 # 导入你的路由
-from routers import detection, analytics, admin, auth
+from routers import detection, analytics, admin, auth, jobs, metrics, video, export
+from services.record_writer import record_writer
+from services.video_sessions import video_sessions
+from services.serialization import FastJSONResponse
+from services.tile_pool import tile_pool
+from services.model_registry import model_registry
+from worker import start_workers, stop_workers
 
 # --- 配置路径常量 ---
 WEIGHTS_DIR = {
@@ -17,6 +29,11 @@ WEIGHTS_DIR = {
 
 # 自动创建表结构
 Base.metadata.create_all(bind=engine)
+# 给已有的表补建索引等结构变更
+try:
+    run_migrations(engine)
+except Exception as e:
+    print(f"⚠️ 数据库迁移失败，请手动执行 python backend/manage.py migrate: {e}")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -27,17 +44,46 @@ async def lifespan(app: FastAPI):
         if not os.path.exists(path):
             os.makedirs(path)
             print(f"📂 创建模型目录: {path}")
+
+    # 建立 / 更新模型索引 (只计算新文件的摘要，不加载模型)
+    threading.Thread(target=model_registry.scan, name="model-registry-scan", daemon=True).start()
+
+    # 推理依赖默认在第一次检测时才导入；推理节点可以开启预加载
+    if PRELOAD_INFERENCE:
+        from services.engine import preload_runtime
+        threading.Thread(target=preload_runtime, name="preload-inference", daemon=True).start()
+
+    # 回放已退出进程遗留的检测记录日志 (不在请求路径上执行)
+    threading.Thread(target=record_writer.replay_orphans, name="record-journal-replay", daemon=True).start()
+
+    # 视频会话的空闲检查：汇总超时未结束的会话
+    video_sessions.start()
+
+    # 启动异步任务 worker 进程
+    job_workers, job_stop_event = start_workers(JOB_WORKERS)
+    if job_workers:
+        print(f"👷 已启动 {len(job_workers)} 个任务 worker")
     
     yield
     print("🛑 系统关闭中...")
+    stop_workers(job_workers, job_stop_event)
+    # 停止视频会话检查 (进行中的会话保存在共享状态中)，并把缓冲中的检测记录全部落库
+    video_sessions.stop()
+    record_writer.stop()
+    # 关闭 SAHI 切片推理进程池 (开启并使用过时才会存在)
+    tile_pool.shutdown()
 
-app = FastAPI(title="RS Detection System API", lifespan=lifespan)
+app = FastAPI(title="RS Detection System API", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # 注册路由
 app.include_router(auth.router)
 app.include_router(detection.router)
 app.include_router(analytics.router)
 app.include_router(admin.router)
+app.include_router(jobs.router)
+app.include_router(metrics.router)
+app.include_router(video.router)
+app.include_router(export.router)
 
 if __name__ == "__main__":
     import uvicorn
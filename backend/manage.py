@@ -0,0 +1,169 @@
+"""
+后端运维命令
+用法: python backend/manage.py <命令> [参数]
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import argparse
+
+from config import RETENTION_DAYS, RETENTION_BATCH_SIZE, BCRYPT_ROUNDS
+from database import engine, SessionLocal
+from models import Base
+
+
+def cmd_migrate(args):
+    """执行数据库结构迁移 (补建索引等)"""
+    from migrations import run_migrations
+
+    done = run_migrations(engine)
+    print(f"✅ 共执行 {len(done)} 个迁移" if done else "✅ 数据库结构已是最新")
+
+
+def cmd_backfill_rollups(args):
+    """为历史记录回填类别明细表与汇总表"""
+    from services.rollups import backfill
+
+    db = SessionLocal()
+    try:
+        print("📊 开始回填类别明细与汇总表...")
+        total = backfill(db, batch_size=args.batch_size)
+        print(f"✅ 回填完成，共处理 {total} 条记录")
+    finally:
+        db.close()
+
+
+def cmd_retention(args):
+    """归档并删除超过保留期的原始记录"""
+    from services.retention import run_retention, compact_archive
+
+    db = SessionLocal()
+    try:
+        print(f"🗄️ 归档 {args.days} 天之前的检测记录...")
+        total = run_retention(db, args.days, batch_size=args.batch_size, dry_run=args.dry_run)
+        if not args.dry_run:
+            print(f"✅ 归档完成，共移出 {total} 条记录")
+            if args.compact:
+                compact_archive()
+    finally:
+        db.close()
+
+
+def cmd_compact_archive(args):
+    """合并归档分区内的小文件"""
+    from services.retention import compact_archive
+
+    print(f"✅ 共合并 {compact_archive()} 个分区")
+
+
+def cmd_calibrate_bcrypt(args):
+    """测量当前机器的 bcrypt 耗时，给出满足目标耗时的轮数"""
+    from services.auth import calibrate_bcrypt_rounds
+
+    print(f"⏱️ 测量 bcrypt 耗时 (目标 {args.target_ms} ms)...")
+    best, timings = calibrate_bcrypt_rounds(target_ms=args.target_ms)
+    for rounds, ms in timings.items():
+        print(f"  rounds={rounds}: {ms} ms")
+    print(f"✅ 推荐设置环境变量 RS_BCRYPT_ROUNDS={best} (当前 {BCRYPT_ROUNDS})，旧哈希会在用户下次登录时自动更新")
+
+
+def cmd_calibrate_cpu(args):
+    """实测已安装的模型，生成 CPU 执行计划 (线程数、worker 数、batch 大小、绑核)"""
+    import glob
+    from config import EXECUTION_PLAN_PATH
+    from services.execution_plan import calibrate_cpu, save_plan
+
+    models = [m for m in args.models.split(",") if m] if args.models else sorted(glob.glob("weights/*/*.pt"))
+    models = [m if os.path.exists(m) else os.path.join("weights", m) for m in models]
+    missing = [m for m in models if not os.path.exists(m)]
+    if not models or missing:
+        print(f"❌ 没有可用于标定的模型: {missing or 'weights/*/*.pt 为空'}")
+        return
+
+    print(f"⏱️ 标定 CPU 执行计划，模型: {', '.join(models)}")
+    plan = calibrate_cpu(models, iterations=args.iterations, max_latency_ms=args.max_latency_ms)
+    print(f"✅ tuned_device={plan['tuned_device']} workers={plan['workers']} threads={plan['threads_per_worker']} "
+          f"batch={plan['batch_size']} affinity={plan['affinity']}")
+    if args.dry_run:
+        return
+    save_plan(plan)
+    print(f"💾 已写入 {EXECUTION_PLAN_PATH}，重启后端后生效 (python backend/serve.py 默认按计划启动 worker)")
+
+
+def cmd_scan_models(args):
+    """扫描权重目录，加载每个模型补全注册表元数据 (类别名、输入尺寸、参数量、实测延迟)"""
+    from services.model_registry import model_registry
+    from services.execution_plan import execution_plan
+
+    model_registry.scan()
+    for entry in model_registry.entries():
+        if entry["inspected_at"] is not None and entry["latency_ms"] is not None and not args.force:
+            continue
+        print(f"🔍 {entry['category']}/{entry['name']} ...")
+        info = model_registry.inspect(entry["category"], entry["name"], device=execution_plan.device)
+        print(f"  {info['arch']} ({info['task']}) imgsz={info['imgsz']} params={info['params']:,} "
+              f"classes={len(info['classes'])} latency={info['latency_ms']} ms")
+    print(f"✅ 模型索引共 {len(model_registry.entries())} 个模型")
+
+
+def cmd_bench(args):
+    """运行性能基准"""
+    import benchmarks
+
+    if args.name == "serialization":
+        benchmarks.bench_serialization(rows=args.rows, repeat=args.repeat)
+    elif args.name == "startup":
+        benchmarks.bench_startup(repeat=args.repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RS Detection 后端运维命令")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("migrate", help="执行数据库结构迁移")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("backfill-rollups", help="回填类别明细与汇总表")
+    p.add_argument("--batch-size", type=int, default=1000, help="每个事务处理的记录数")
+    p.set_defaults(func=cmd_backfill_rollups)
+
+    p = sub.add_parser("retention", help="归档并删除超过保留期的原始记录")
+    p.add_argument("--days", type=int, default=RETENTION_DAYS, help="保留天数")
+    p.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE, help="每个删除事务的记录数")
+    p.add_argument("--dry-run", action="store_true", help="只统计待归档的记录数")
+    p.add_argument("--compact", action="store_true", help="归档后合并分区内的小文件")
+    p.set_defaults(func=cmd_retention)
+
+    p = sub.add_parser("compact-archive", help="合并归档分区内的小文件")
+    p.set_defaults(func=cmd_compact_archive)
+
+    p = sub.add_parser("calibrate-bcrypt", help="按目标耗时测算 bcrypt 轮数")
+    p.add_argument("--target-ms", type=float, default=250, help="单次哈希的目标耗时 (毫秒)")
+    p.set_defaults(func=cmd_calibrate_bcrypt)
+
+    p = sub.add_parser("calibrate-cpu", help="实测模型推理，生成 CPU 执行计划")
+    p.add_argument("--models", default="", help="逗号分隔的模型路径 (默认 weights/*/*.pt)")
+    p.add_argument("--iterations", type=int, default=10, help="每个组合的计时推理次数")
+    p.add_argument("--max-latency-ms", type=float, default=None, help="单次推理 p50 延迟上限，超过的组合不选")
+    p.add_argument("--dry-run", action="store_true", help="只输出结果，不写入执行计划")
+    p.set_defaults(func=cmd_calibrate_cpu)
+
+    p = sub.add_parser("scan-models", help="扫描权重目录，补全模型注册表元数据")
+    p.add_argument("--force", action="store_true", help="重新读取所有模型 (默认只处理缺少元数据的模型)")
+    p.set_defaults(func=cmd_scan_models)
+
+    p = sub.add_parser("bench", help="运行性能基准 (合成数据)")
+    p.add_argument("name", choices=["serialization", "startup"], help="基准名称")
+    p.add_argument("--rows", type=int, default=20000, help="合成记录条数")
+    p.add_argument("--repeat", type=int, default=3, help="重复次数 (取最好成绩)")
+    p.set_defaults(func=cmd_bench)
+
+    args = parser.parse_args()
+    # 确保新增的表已创建
+    Base.metadata.create_all(bind=engine)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+数据库结构迁移
+create_all 只会创建缺失的表，不会给已有的表补索引/字段；这类变更放在这里按顺序执行一次
+"""
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect, select
+
+from models import DetectionRecord
+
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _meta,
+    Column("name", String(100), primary_key=True),
+    Column("applied_at", DateTime, default=datetime.now),
+)
+
+
+def _create_missing_indexes(conn, model):
+    """按模型声明补建已有表上缺失的索引"""
+    table = model.__table__
+    existing = {ix["name"] for ix in inspect(conn).get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in existing:
+            print(f"🔧 创建索引 {table.name}.{index.name} ...")
+            index.create(conn)
+
+
+def m0001_records_history_indexes(conn):
+    """records 表历史查询复合索引 (created_at+id / model_type+created_at / filename)"""
+    _create_missing_indexes(conn, DetectionRecord)
+
+
+# 按顺序追加，已执行过的迁移不可修改
+MIGRATIONS = [
+    ("0001_records_history_indexes", m0001_records_history_indexes),
+]
+
+
+def pending_migrations(engine):
+    _meta.create_all(bind=engine)
+    with engine.connect() as conn:
+        applied = {row[0] for row in conn.execute(select(schema_migrations.c.name))}
+    return [(name, fn) for name, fn in MIGRATIONS if name not in applied]
+
+
+def run_migrations(engine):
+    """执行全部未执行的迁移，返回本次执行的迁移名"""
+    done = []
+    for name, fn in pending_migrations(engine):
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(schema_migrations.insert().values(name=name, applied_at=datetime.now()))
+        print(f"✅ 数据库迁移完成: {name}")
+        done.append(name)
+    return done
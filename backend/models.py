@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Date, JSON, Boolean, Float, ForeignKey, Index
 from sqlalchemy.orm import declarative_base
 from datetime import datetime
 
@@ -7,6 +7,12 @@ Base = declarative_base()
 # --- 原有的检测记录表 ---
 class DetectionRecord(Base):
     __tablename__ = "records"
+    # 历史查询用的复合索引 (已有数据库通过 migrations.py 补建)
+    __table_args__ = (
+        Index("ix_records_created_id", "created_at", "id"),
+        Index("ix_records_model_created", "model_type", "created_at"),
+        Index("ix_records_filename", "filename"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String(255))
     model_type = Column(String(100))
@@ -24,4 +30,74 @@ class User(Base):
     hashed_password = Column(String(100), nullable=False)
     # 角色: 'admin' 或 'user'
     role = Column(String(20), default="user")
-    created_at = Column(DateTime, default=datetime.now)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.now)
+
+# --- 视频会话汇总表 (每个视频流一行，替代逐帧记录) ---
+class VideoSession(Base):
+    __tablename__ = "video_sessions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String(64), unique=True, index=True, nullable=False)
+    filename = Column(String(255))
+    model_type = Column(String(100))
+    frame_count = Column(Integer)
+    duration = Column(Float)          # 视频时长 (秒)
+    max_objects = Column(Integer)     # 单帧最多目标数
+    avg_objects = Column(Float)       # 平均每帧目标数
+    class_max = Column(JSON)          # 各类别单帧最大值
+    class_avg = Column(JSON)          # 各类别每帧平均值
+    timeline = Column(JSON)           # 按秒聚合的各类别数量序列 (紧凑编码，见 services/video_sessions.py)
+    started_at = Column(DateTime)
+    ended_at = Column(DateTime, default=datetime.now)
+
+
+# --- 各类别检测数量明细表 (由 details JSON 拆分而来，写入记录时同步生成) ---
+class RecordClassCount(Base):
+    __tablename__ = "record_class_counts"
+    __table_args__ = (
+        Index("ix_rcc_class_created", "class_name", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    record_id = Column(Integer, ForeignKey("records.id", ondelete="CASCADE"), index=True, nullable=False)
+    class_name = Column(String(100), nullable=False)
+    count = Column(Integer, nullable=False)
+    # 冗余父表字段，类别维度的查询无需回表
+    model_type = Column(String(100))
+    created_at = Column(DateTime)
+
+# --- 按 天 × 检测模式 增量汇总 ---
+class DailyRollup(Base):
+    __tablename__ = "rollup_daily"
+
+    day = Column(Date, primary_key=True)
+    model_type = Column(String(100), primary_key=True)
+    tasks = Column(Integer, nullable=False, default=0)
+    objects = Column(Integer, nullable=False, default=0)
+    latest_at = Column(DateTime)
+
+# --- 按 天 × 检测模式 × 类别 增量汇总 ---
+class DailyClassRollup(Base):
+    __tablename__ = "rollup_daily_class"
+
+    day = Column(Date, primary_key=True)
+    model_type = Column(String(100), primary_key=True)
+    class_name = Column(String(100), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+# --- 汇总表回填进度 ---
+class RollupState(Base):
+    __tablename__ = "rollup_state"
+
+    name = Column(String(50), primary_key=True)
+    # 实时写入汇总的第一条记录 id，更早的记录需要回填
+    live_since_id = Column(Integer, nullable=False)
+    # 已回填到的记录 id
+    backfilled_upto = Column(Integer, nullable=False, default=0)
+
+# --- 数据版本号 (每次写入检测记录时递增，用于统计接口缓存失效与 ETag) ---
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
@@ -2,15 +2,19 @@
 
 import os
 import shutil
+import uuid
 from pathlib import Path  # 导入 pathlib 用于跨平台路径操作
 from fastapi import APIRouter, UploadFile, File, Depends, Form, HTTPException, status
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
 # 👇 修复后的导入
 from backend.database import get_db 
 from .auth import get_current_admin  # 用于全局权限依赖
 from backend.services import user_service 
-from backend.models import User
+from services.principal_cache import Principal
+from services.quotas import quota_manager, ANONYMOUS_ROLE
+from services.model_registry import model_registry, MODEL_CATEGORIES
 
 PROJECT_ROOT = Path(__file__).parent.parent.parent 
 WEIGHTS_BASE_DIR = PROJECT_ROOT / "weights"
@@ -19,6 +23,30 @@ if not WEIGHTS_BASE_DIR.exists():
     WEIGHTS_BASE_DIR.mkdir(parents=True, exist_ok=True)
 
 
+def _stage_upload(src, file_path):
+    """
+    原子保存上传的权重：先写同目录下的临时文件并 fsync，再 rename 覆盖
+    推理进程读到的要么是旧文件、要么是完整的新文件 (临时文件以 . 开头、不以 .pt 结尾，不会被列出或加载)
+    """
+    tmp_path = file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "wb") as buffer:
+            shutil.copyfileobj(src, buffer)
+            buffer.flush()
+            os.fsync(buffer.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    # rename 本身也要落盘
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(file_path.parent, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
 router = APIRouter(
     prefix="/admin", 
     tags=["Admin Management"],
@@ -50,6 +78,10 @@ def delete_model_endpoint(
     try:
         # 使用 unlink() 更符合 pathlib 的风格
         file_path.unlink() 
+        # 本进程立即移出缓存，其他进程由权重目录监视在下次轮询时移出
+        from services.engine import detector
+        detector.evict(category, filename)
+        model_registry.remove(category, filename)
         
         return {"message": f"模型 {filename} (场景: {category}) 删除成功。"}
         
@@ -62,31 +94,31 @@ def delete_model_endpoint(
 
 @router.get("/models")
 def get_models():
-    """获取分类后的模型列表 (Admin Only)"""
-    models_info = {"aerial": [], "sar": []}
-    for category in models_info.keys():
-        dir_path = WEIGHTS_BASE_DIR / category # 使用 Path 对象
-        if dir_path.exists():
-            # 过滤出 .pt 文件
-            models_info[category] = [f.name for f in dir_path.glob("*.pt")]
-    return {"models": models_info}
+    """获取分类后的模型列表及元数据 (摘要、类别名、输入尺寸、参数量、实测延迟) (Admin Only)"""
+    return model_registry.listing()
 
 @router.post("/upload_model")
 async def upload_model(file: UploadFile = File(...), category: str = Form(...)):
     """上传模型到指定分类文件夹 (Admin Only)"""
-    if category not in ["aerial", "sar"]:
+    if category not in MODEL_CATEGORIES:
         raise HTTPException(status_code=400, detail="Invalid category.")
         
     save_dir = WEIGHTS_BASE_DIR / category
     if not save_dir.exists(): save_dir.mkdir(parents=True, exist_ok=True)
     
-    file_path = save_dir / file.filename
+    filename = os.path.basename(file.filename or "")
+    if not filename:
+        raise HTTPException(status_code=400, detail="Invalid filename.")
+    file_path = save_dir / filename
     
     try:
-        with open(file_path, "wb") as buffer: 
-            shutil.copyfileobj(file.file, buffer)
+        # 覆盖已有模型时，已加载该模型的进程在后台加载新版本后原子替换 (见 services/weights_watcher.py)
+        await run_in_threadpool(_stage_upload, file.file, file_path)
+        # 登记文件摘要后立即返回，类别名 / 参数量 / 延迟等由任务 worker 加载模型后补全
+        await run_in_threadpool(model_registry.scan)
+        await run_in_threadpool(model_registry.request_inspection, category, filename)
             
-        return {"filename": file.filename, "category": category, "message": "上传成功"}
+        return {"filename": filename, "category": category, "message": "上传成功"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"文件保存失败: {str(e)}")
 
@@ -103,7 +135,7 @@ async def update_role(
     username: str, 
     role: str, 
     db: Session = Depends(get_db), 
-    current_admin: User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
     """修改指定用户的角色 (Admin Only)"""
     if username == current_admin.username: 
@@ -120,7 +152,7 @@ async def update_role(
 async def delete_user(
     username: str, 
     db: Session = Depends(get_db),
-    current_admin: User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
     """删除指定用户 (Admin Only)"""
     if username == current_admin.username:
@@ -129,4 +161,27 @@ async def delete_user(
     if user_service.delete_user_by_username(db, username):
         return {"msg": f"用户 {username} 已被删除"}
         
-    raise HTTPException(status_code=404, detail="用户未找到")
\ No newline at end of file
+    raise HTTPException(status_code=404, detail="用户未找到")
+
+@router.get("/quotas")
+def get_quota_policies():
+    """各角色的推理配额策略 (Admin Only)"""
+    return quota_manager.policies()
+
+@router.put("/quotas/{role}")
+def update_quota_policy(role: str, weight: float, rate: float, burst: float):
+    """
+    修改角色的推理配额 (Admin Only)
+    weight: 排队时的公平份额权重; rate: 每秒恢复的推理秒数; burst: 最多可累积的推理秒数
+    """
+    if role not in ["user", "admin", ANONYMOUS_ROLE]:
+        raise HTTPException(status_code=400, detail="角色无效")
+    try:
+        return quota_manager.set_policy(role, weight, rate, burst)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+@router.get("/usage")
+def get_usage(days: int = 7):
+    """最近 N 天各用户的推理用量：请求数、被限流次数、推理秒数、上传/返回字节数 (Admin Only)"""
+    return quota_manager.usage(max(1, min(days, 366)))
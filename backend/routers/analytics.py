@@ -1,16 +1,89 @@
-from fastapi import APIRouter, Depends
+from datetime import date, datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
 from database import get_db
-from models import DetectionRecord
+from services import analytics_service
+from services.response_cache import analytics_cache
+from services.serialization import encode_response
 
 router = APIRouter()
 
+
+def analytics_filters(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    category: Optional[str] = None,
+):
+    """聚合接口通用过滤参数：日期范围 (闭区间) 与场景分类 aerial / sar"""
+    return {"start_date": start_date, "end_date": end_date, "category": category}
+
 @router.get("/history")
-def get_history_limit(db: Session = Depends(get_db)):
-    """返回最近 10 条"""
-    return db.query(DetectionRecord).order_by(DetectionRecord.id.desc()).limit(10).all()
+def get_history(
+    request: Request,
+    cursor: Optional[int] = None,
+    limit: int = Query(10, ge=1, le=500),
+    fields: Optional[str] = Query(None, description="逗号分隔的返回列，如 id,created_at,model_type,object_count"),
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    model_type: Optional[str] = None,
+    filename: Optional[str] = None,
+    min_count: Optional[int] = None,
+    filters: dict = Depends(analytics_filters),
+    db: Session = Depends(get_db)
+):
+    """历史记录分页查询，默认返回最近 10 条；用返回的 next_cursor 继续翻页"""
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else analytics_service.DEFAULT_HISTORY_FIELDS
+    try:
+        page = analytics_service.query_history(
+            db, cursor=cursor, limit=limit, fields=field_list,
+            start_time=start_time, end_time=end_time, model_type=model_type,
+            filename=filename, min_count=min_count, **filters
+        )
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    return encode_response(request, page)
 
 @router.get("/analytics")
-def get_analytics_all(db: Session = Depends(get_db)):
-    """返回所有数据用于大屏分析"""
-    return db.query(DetectionRecord).all()
\ No newline at end of file
+def get_analytics_all(request: Request, db: Session = Depends(get_db)):
+    """返回所有数据用于大屏分析 (数据量大时请改用 /analytics/summary 等聚合接口，全量导出请用 /export/records)"""
+    # 全表结果只做 ETag / 304，不放进内存缓存
+    return analytics_cache.respond(request, db, lambda: analytics_service.get_all_records(db), store=False)
+
+# --- 聚合接口：结果按数据版本号缓存，支持 ETag / If-None-Match ---
+
+@router.get("/analytics/summary")
+def get_analytics_summary(request: Request, filters: dict = Depends(analytics_filters), db: Session = Depends(get_db)):
+    """大屏所需的全部聚合结果 (KPI + 每日趋势 + 模式分布 + 类别总量)"""
+    return analytics_cache.respond(request, db, lambda: analytics_service.get_summary(db, **filters), filters)
+
+@router.get("/analytics/kpis")
+def get_analytics_kpis(request: Request, filters: dict = Depends(analytics_filters), db: Session = Depends(get_db)):
+    """核心指标"""
+    return analytics_cache.respond(request, db, lambda: analytics_service.get_kpis(db, **filters), filters)
+
+@router.get("/analytics/daily")
+def get_analytics_daily(request: Request, filters: dict = Depends(analytics_filters), db: Session = Depends(get_db)):
+    """每日任务数与目标数"""
+    return analytics_cache.respond(request, db, lambda: analytics_service.get_daily_totals(db, **filters), filters)
+
+@router.get("/analytics/modes")
+def get_analytics_modes(request: Request, filters: dict = Depends(analytics_filters), db: Session = Depends(get_db)):
+    """检测模式分布"""
+    return analytics_cache.respond(request, db, lambda: analytics_service.get_mode_distribution(db, **filters), filters)
+
+@router.get("/analytics/classes")
+def get_analytics_classes(request: Request, filters: dict = Depends(analytics_filters), db: Session = Depends(get_db)):
+    """各类别目标总量"""
+    return analytics_cache.respond(request, db, lambda: analytics_service.get_class_totals(db, **filters), filters)
+
+@router.get("/analytics/records")
+def get_analytics_records(
+    request: Request,
+    since_id: int = 0,
+    limit: int = Query(500, ge=1, le=5000),
+    filters: dict = Depends(analytics_filters),
+    db: Session = Depends(get_db)
+):
+    """增量同步：返回 id > since_id 的记录，配合 next_cursor 翻页"""
+    return encode_response(request, analytics_service.get_records_since(db, since_id, limit, **filters))
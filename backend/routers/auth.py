@@ -1,12 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from starlette.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import timedelta
+from typing import Optional
 from jose import JWTError, jwt
 
 from database import get_db
 from models import User
-from services.auth import verify_password, get_password_hash, create_access_token, SECRET_KEY, ALGORITHM
+from services.auth import create_access_token, password_hasher, HashPoolSaturated, SECRET_KEY, ALGORITHM
+from services.principal_cache import Principal, principal_cache
 
 router = APIRouter(tags=["Authentication"])
 
@@ -15,7 +18,8 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # --- 依赖注入：获取当前登录用户 ---
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def _authenticate(token: str, db: Session, strict: bool = False):
+    """校验 Token 并返回 Principal；strict=True 时先检查共享的撤销版本号 (管理员接口)"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -30,46 +34,90 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    # 查数据库
+    # 先查进程内缓存 (其他进程修改过用户时先清空)，未命中再查数据库
+    principal_cache.sync(db, force=strict)
+    principal, epoch = principal_cache.get(username)
+    if principal is not None:
+        return principal
     user = db.query(User).filter(User.username == username).first()
     if user is None:
         raise credentials_exception
-    return user
+    principal = Principal.from_user(user)
+    principal_cache.put(principal, epoch)
+    return principal
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    return await _authenticate(token, db)
+
+# --- 依赖注入：可选登录 (未携带 Token 时返回 None，携带了无效 Token 仍返回 401) ---
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+async def get_optional_user(token: Optional[str] = Depends(optional_oauth2_scheme), db: Session = Depends(get_db)):
+    if not token:
+        return None
+    return await get_current_user(token, db)
 
 # --- 依赖注入：仅限管理员 ---
-async def get_current_admin(current_user: User = Depends(get_current_user)):
+async def get_current_admin(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    # 角色敏感的检查：每次都确认没有被其他进程撤销 / 降级
+    current_user = await _authenticate(token, db, strict=True)
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="权限不足：需要管理员权限")
     return current_user
 
+def _hash_pool_busy():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="登录请求过多，请稍后重试",
+        headers={"Retry-After": "1"},
+    )
+
 # --- 1. 注册接口 ---
 @router.post("/register")
-def register(username: str, password: str, role: str = "user", db: Session = Depends(get_db)):
+async def register(username: str, password: str, role: str = "user", db: Session = Depends(get_db)):
     # 检查用户名是否存在
-    if db.query(User).filter(User.username == username).first():
+    if await run_in_threadpool(lambda: db.query(User).filter(User.username == username).first()):
         raise HTTPException(status_code=400, detail="Username already registered")
-    
+
+    # bcrypt 在专用线程池中计算，不占用默认线程池
+    try:
+        hashed_password = await password_hasher.hash(password)
+    except HashPoolSaturated:
+        raise _hash_pool_busy()
+
     # 创建用户
     new_user = User(
         username=username,
-        hashed_password=get_password_hash(password),
+        hashed_password=hashed_password,
         role=role # 注意：实际生产中不能让用户随便传 role，这里为了演示方便
     )
     db.add(new_user)
-    db.commit()
+    await run_in_threadpool(db.commit)
     return {"message": "User created successfully"}
 
 # --- 2. 登录接口 (获取 Token) ---
 @router.post("/token")
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     # 查用户
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = await run_in_threadpool(lambda: db.query(User).filter(User.username == form_data.username).first())
+    valid, new_hash = False, None
+    if user:
+        try:
+            valid, new_hash = await password_hasher.verify_and_update(form_data.password, user.hashed_password)
+        except HashPoolSaturated:
+            raise _hash_pool_busy()
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    # 哈希轮数已调整：借这次登录的明文密码按新轮数重新计算
+    if new_hash:
+        user.hashed_password = new_hash
+        await run_in_threadpool(db.commit)
     
     # 生成 Token
     access_token_expires = timedelta(minutes=60 * 24)
@@ -79,5 +127,5 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
     )
     return {"access_token": access_token, "token_type": "bearer", "role": user.role}
 @router.get("/users/me")
-async def read_users_me(current_user: dict = Depends(get_current_user)):
-    return current_user
\ No newline at end of file
+async def read_users_me(current_user: Principal = Depends(get_current_user)):
+    return current_user.to_dict()
\ No newline at end of file
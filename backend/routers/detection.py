@@ -1,78 +1,247 @@
-from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import get_db
-from models import DetectionRecord
-from services.engine import detector
-from services.image_utils import apply_enhancement, image_to_base64
-from PIL import Image
-import io
-import numpy as np
-import cv2
+from typing import Optional
+import asyncio
+import time
+from fastapi import APIRouter, Depends, Request, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from services.detection_service import process_detection, process_detection_stream, should_promote
+from services.scheduler import scheduler, classify_priority, SchedulerFull, FrameDropped
+from services.quotas import quota_manager, QuotaExceeded, caller_identity
+from services.principal_cache import Principal
+from services.record_writer import record_writer
+from services.video_sessions import video_sessions
+from services.serialization import encode_response, sse_event
+from services.metrics import metrics
+from services.cancellation import CancelToken, InferenceCancelled, watch_disconnect
+from services.coalescer import coalescer, request_key
+from services.model_registry import model_registry
+from config import INFERENCE_TIMEOUT
+from routers.jobs import enqueue_detection
+from routers.auth import get_optional_user
 
 router = APIRouter()
 
+
+@router.get("/models")
+def list_models():
+    """可用的模型列表及元数据 (所有用户，检测页面的模型选择使用)"""
+    listing = model_registry.listing()
+    for entries in listing["details"].values():
+        for entry in entries:
+            entry.pop("sha256", None)
+    return listing
+
+
 @router.post("/detect/")
 async def detect_endpoint(
-    file: UploadFile = File(...), 
+    request: Request,
+    file: UploadFile = File(...),
     model_name: str = Form(...),
     category: str = Form("aerial"),  # <--- 【修改 1】新增：接收 category 参数，默认 aerial
     conf: float = Form(...),
     use_sahi: str = Form("false"),
     enhance_type: str = Form("None"),
-    db: Session = Depends(get_db)
+    async_mode: str = Form("auto"),  # auto: 预计耗时过长时自动转后台任务; true: 强制异步; false: 强制同步
+    session_id: Optional[str] = Form(None),    # 视频会话 ID：同一会话的帧只做内存聚合，结束时写一行汇总
+    frame_time: Optional[float] = Form(None),  # 帧在视频中的时间戳 (秒)
+    priority: Optional[str] = Form(None),      # interactive / video / batch，默认按请求类型判断，非管理员只能降级
+    user: Optional[Principal] = Depends(get_optional_user),
 ):
+    user_key, role = caller_identity(request, user)
+    # 客户端断开或超时后取消推理：排队中的立即出队，推理中的在下一组切片前停止
+    cancel = CancelToken(INFERENCE_TIMEOUT)
+    watcher = timeout_handle = None
+
     try:
         # 1. 参数清洗
         sahi_flag = use_sahi.lower() == 'true'
-        
+        async_mode = async_mode.lower()
+
         # 2. 读取图片
         contents = await file.read()
-        pil_image = Image.open(io.BytesIO(contents)).convert("RGB")
-        
-        # 3. 图像增强
-        if enhance_type and enhance_type != "None":
-            img_bgr = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-            img_enhanced = apply_enhancement(img_bgr, enhance_type)
-            pil_image = Image.fromarray(cv2.cvtColor(img_enhanced, cv2.COLOR_BGR2RGB))
-            mode_suffix = f" + {enhance_type}"
+        quota_manager.record(user_key, role, requests=1, bytes_in=len(contents))
+
+        # 3. 检查用户配额 (同步与后台任务共用)
+        policy = quota_manager.admit(user_key, role)
+
+        # 大图 SAHI 等耗时请求转为后台任务，返回 202 + job_id
+        if async_mode == "true" or (async_mode == "auto" and should_promote(contents, sahi_flag)):
+            return await enqueue_detection(
+                contents, file.filename, model_name, category, conf, sahi_flag, enhance_type, user_key, role
+            )
+
+        # 4. 排队等待推理名额，在线程池中执行增强 + 推理 (不阻塞事件循环)
+        priority = classify_priority(priority, sahi_flag, session_id, role == "admin")
+        watcher = asyncio.create_task(watch_disconnect(request, cancel))
+        timeout_handle = asyncio.get_running_loop().call_later(INFERENCE_TIMEOUT, cancel.cancel, "timeout")
+
+        async def execute(flight_cancel):
+            async with scheduler.slot(f"{category}/{model_name}", priority, session_id, user_key, policy["weight"],
+                                      flight_cancel):
+                started = time.perf_counter()
+                try:
+                    return await run_in_threadpool(
+                        process_detection,
+                        contents,
+                        file.filename,
+                        model_name,
+                        category,  # <--- 必须传这个，告诉引擎去哪个文件夹找模型
+                        conf,
+                        sahi_flag,
+                        enhance_type,
+                        flight_cancel
+                    )
+                finally:
+                    elapsed = time.perf_counter() - started
+                    quota_manager.charge(user_key, role, elapsed)
+                    quota_manager.record(user_key, role, inference_seconds=elapsed)
+                    if flight_cancel.cancelled:
+                        # 取消前已经消耗的推理时间 (无人接收的结果)
+                        metrics.observe("inference.wasted_seconds", elapsed)
+
+        if session_id:
+            # 视频帧各不相同，且需要按会话丢弃过期帧，不参与合并
+            result, record = await execute(cancel)
         else:
-            mode_suffix = ""
-
-        # 4. 调用引擎推理
-        # 【修改 2】将 category 传给 detector
-        final_img, count, stats, mode_base = detector.run_inference(
-            pil_image, 
-            model_name, 
-            category,  # <--- 必须传这个，告诉引擎去哪个文件夹找模型
-            conf, 
-            sahi_flag
+            # 同一用户相同图片 + 相同参数的并发请求只推理一次 (推理耗时计入该用户)；
+            # 不跨用户合并，否则其他用户的请求不经扣费就拿到结果
+            key = request_key(contents, user_key, category, model_name, conf, sahi_flag, enhance_type)
+            result, record = await coalescer.run(key, execute, cancel)
+            record = {**record, "filename": file.filename}
+
+        # 5. 数据库存储 (写入缓冲队列，由后台线程批量提交)
+        if session_id:
+            await run_in_threadpool(
+                video_sessions.add_frame,
+                session_id, record["filename"], record["model_type"], record["details"], frame_time
+            )
+        else:
+            # journal 模式追加日志、缓冲区满时同步写库，都不在事件循环线程执行
+            await run_in_threadpool(record_writer.submit, record)
+
+        # 6. 返回结果 (base64 图像较大，直接用 orjson 编码)
+        response = encode_response(request, result, compressible=False)
+        quota_manager.record(user_key, role, bytes_out=len(response.body))
+        return response
+
+    except QuotaExceeded as exceeded:
+        raise HTTPException(
+            status_code=429, detail="推理配额已用完，请稍后重试",
+            headers={"Retry-After": str(exceeded.retry_after)},
         )
-        
-        final_mode = mode_base + mode_suffix
-
-        # 5. 数据库存储
-        new_record = DetectionRecord(
-            filename=file.filename,
-            model_type=final_mode,
-            object_count=count,
-            details=stats,
-            # 如果你的数据库表支持 category 字段，建议最好也存进去
-            # category=category 
+    except SchedulerFull as full:
+        raise HTTPException(
+            status_code=429, detail="推理队列已满，请稍后重试",
+            headers={"Retry-After": str(full.retry_after)},
         )
-        db.add(new_record)
-        db.commit()
-
-        # 6. 返回结果
-        return {
-            "message": "Success",
-            "image_base64": image_to_base64(final_img),
-            "total_objects": count,
-            "details": stats,
-            "mode": final_mode
-        }
-
+    except FrameDropped:
+        # 视频帧已过期，客户端直接发送下一帧
+        raise HTTPException(status_code=429, detail="视频帧排队超时，已丢弃", headers={"Retry-After": "0"})
+    except InferenceCancelled as cancelled:
+        # 客户端已断开时响应不会被接收；超时返回 504
+        if cancelled.reason == "timeout":
+            raise HTTPException(status_code=504, detail=f"推理超过 {INFERENCE_TIMEOUT:g} 秒，已取消")
+        raise HTTPException(status_code=499, detail="客户端已断开，推理已取消")
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         print(f"Server Error: {e}")
-        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if timeout_handle is not None:
+            timeout_handle.cancel()
+
+
+@router.post("/detect/stream")
+async def detect_stream_endpoint(
+    request: Request,
+    file: UploadFile = File(...),
+    model_name: str = Form(...),
+    category: str = Form("aerial"),
+    conf: float = Form(...),
+    enhance_type: str = Form("None"),
+    priority: Optional[str] = Form(None),
+    user: Optional[Principal] = Depends(get_optional_user),
+):
+    """
+    渐进式 SAHI 检测 (Server-Sent Events)
+    事件依次为 start (图像尺寸) -> preview (整图快速推理的检测框) -> tile (每组切片的检测框与进度，多次)
+    -> result (合并后的最终结果，与 /detect/ 响应相同)；出错时为 error
+    预计耗时过长的大图与 /detect/ 一样转为后台任务，返回 202 + job_id (不建立事件流)
+    """
+    user_key, role = caller_identity(request, user)
+    contents = await file.read()
+    quota_manager.record(user_key, role, requests=1, bytes_in=len(contents))
+
+    # 流开始之前完成准入检查，超限时仍然返回 429
+    try:
+        policy = quota_manager.admit(user_key, role)
+    except QuotaExceeded as exceeded:
+        raise HTTPException(status_code=429, detail="推理配额已用完，请稍后重试",
+                            headers={"Retry-After": str(exceeded.retry_after)})
+    if should_promote(contents, True):
+        return await enqueue_detection(
+            contents, file.filename, model_name, category, conf, True, enhance_type, user_key, role
+        )
+    if scheduler.is_full():
+        metrics.inc("scheduler.rejected.stream")
+        raise HTTPException(status_code=429, detail="推理队列已满，请稍后重试",
+                            headers={"Retry-After": str(scheduler.retry_after())})
+
+    # 与 /detect/ 的 SAHI 请求一样按 batch 排队，单张普通图片优先
+    priority = classify_priority(priority, True, None, role == "admin")
+    model_key = f"{category}/{model_name}"
+
+    async def events():
+        sent = 0
+        started = None
+        # 与 /detect/ 相同的截止时间：超时后排队中的请求出队，推理在下一组切片前停止
+        cancel = CancelToken(INFERENCE_TIMEOUT)
+        timeout_handle = asyncio.get_running_loop().call_later(INFERENCE_TIMEOUT, cancel.cancel, "timeout")
+        stream = process_detection_stream(contents, file.filename, model_name, category, conf, enhance_type, cancel)
+        try:
+            async with scheduler.slot(model_key, priority, None, user_key, policy["weight"], cancel):
+                started = time.perf_counter()
+                async for event, data in iterate_in_threadpool(stream):
+                    if event == "result":
+                        data, record = data
+                        await run_in_threadpool(record_writer.submit, record)
+                    chunk = sse_event(event, data)
+                    sent += len(chunk)
+                    yield chunk
+        except SchedulerFull as full:
+            yield sse_event("error", {"status": 429, "detail": "推理队列已满，请稍后重试", "retry_after": full.retry_after})
+        except InferenceCancelled:
+            yield sse_event("error", {"status": 504, "detail": f"推理超过 {INFERENCE_TIMEOUT:g} 秒，已取消"})
+        except (GeneratorExit, asyncio.CancelledError):
+            # 客户端断开时 StreamingResponse 关闭 / 取消本生成器：通知推理线程在下一组切片前停止
+            cancel.cancel("disconnect")
+            raise
+        except ValueError as ve:
+            yield sse_event("error", {"status": 400, "detail": str(ve)})
+        except Exception as e:
+            print(f"Server Error: {e}")
+            yield sse_event("error", {"status": 500, "detail": f"Internal Server Error: {str(e)}"})
+        finally:
+            timeout_handle.cancel()
+            try:
+                stream.close()
+            except ValueError:
+                # 生成器仍在线程池中执行，检查到取消后自行结束
+                pass
+            if started is not None:
+                elapsed = time.perf_counter() - started
+                quota_manager.charge(user_key, role, elapsed)
+                quota_manager.record(user_key, role, inference_seconds=elapsed)
+                if cancel.cancelled:
+                    metrics.observe("inference.wasted_seconds", elapsed)
+            quota_manager.record(user_key, role, bytes_out=sent)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # 关闭代理缓冲，事件到达即转发
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+from database import get_db
+from routers.analytics import analytics_filters
+from services import export_service
+
+router = APIRouter(prefix="/export", tags=["Export"])
+
+
+@router.get("/records")
+def export_records(
+    format: str = Query("ndjson", pattern="^(ndjson|arrow|parquet)$", description="ndjson / arrow (IPC 流) / parquet"),
+    include_archive: bool = Query(False, description="同时导出已归档 (超过保留期被移出数据库) 的记录"),
+    filters: dict = Depends(analytics_filters),
+    db: Session = Depends(get_db),
+):
+    """
+    流式导出检测记录 (内存占用与表大小无关)
+    - ndjson: 每行一条记录，details 为原始 JSON
+    - arrow / parquet: details 展开为 details.<类别名> 整数列
+    """
+    media_type, ext = export_service.FORMATS[format]
+    if (format != "ndjson" or include_archive) and not export_service.columnar_available():
+        raise HTTPException(status_code=501, detail="服务器未安装 pyarrow，仅支持导出数据库中记录的 ndjson")
+    if format == "ndjson":
+        body = export_service.stream_ndjson(export_service.iter_export_chunks(include_archive, **filters))
+    else:
+        # 列集合在开始输出前确定：只导出快照时已存在的记录，避免新记录的类别被丢弃
+        classes, upto_id = export_service.columnar_snapshot(db, **filters)
+        chunks = export_service.iter_export_chunks(include_archive, upto_id=upto_id, **filters)
+        if format == "arrow":
+            body = export_service.stream_arrow(chunks, classes)
+        else:
+            body = export_service.stream_parquet(chunks, classes)
+
+    filename = f"records-{datetime.now():%Y%m%d-%H%M%S}.{ext}"
+    return StreamingResponse(body, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    })
@@ -0,0 +1,82 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, Request, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from services.job_queue import job_queue, STATUS_DONE, STATUS_FAILED
+from services.principal_cache import Principal
+from services.quotas import quota_manager, QuotaExceeded, caller_identity
+from services.serialization import encode_response
+from routers.auth import get_optional_user
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+
+async def enqueue_detection(contents, filename, model_name, category, conf, sahi_flag, enhance_type,
+                            user_key, role):
+    """将检测请求写入任务队列，返回 202 响应 (调用方需已通过配额检查，worker 执行后按实际耗时扣除)"""
+    params = {
+        "model_name": model_name,
+        "category": category,
+        "conf": conf,
+        "use_sahi": sahi_flag,
+        "enhance_type": enhance_type,
+    }
+    job_id = await run_in_threadpool(job_queue.submit, params, contents, filename, user_key, role)
+    return JSONResponse(status_code=202, content={
+        "message": "Accepted",
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "result_url": f"/jobs/{job_id}/result",
+    })
+
+
+@router.post("/", status_code=202)
+async def submit_job(
+    request: Request,
+    file: UploadFile = File(...),
+    model_name: str = Form(...),
+    category: str = Form("aerial"),
+    conf: float = Form(...),
+    use_sahi: str = Form("false"),
+    enhance_type: str = Form("None"),
+    user: Optional[Principal] = Depends(get_optional_user),
+):
+    """提交异步检测任务，立即返回 job_id"""
+    user_key, role = caller_identity(request, user)
+    contents = await file.read()
+    quota_manager.record(user_key, role, requests=1, bytes_in=len(contents))
+    try:
+        quota_manager.admit(user_key, role)
+    except QuotaExceeded as exceeded:
+        raise HTTPException(
+            status_code=429, detail="推理配额已用完，请稍后重试",
+            headers={"Retry-After": str(exceeded.retry_after)},
+        )
+    return await enqueue_detection(
+        contents, file.filename, model_name, category, conf,
+        use_sahi.lower() == 'true', enhance_type, user_key, role
+    )
+
+
+@router.get("/{job_id}")
+def get_job_status(job_id: str):
+    """轮询任务状态"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return job
+
+
+@router.get("/{job_id}/result")
+def get_job_result(job_id: str, request: Request):
+    """获取任务结果；未完成时返回 202"""
+    job = job_queue.get(job_id, with_result=True)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    if job["status"] == STATUS_DONE:
+        return encode_response(request, job["result"], compressible=False)
+    if job["status"] == STATUS_FAILED:
+        raise HTTPException(status_code=500, detail=f"任务执行失败: {job['error']}")
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": job["status"]})
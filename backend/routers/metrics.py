@@ -0,0 +1,28 @@
+import os
+from fastapi import APIRouter
+from services.metrics import metrics
+
+router = APIRouter(tags=["Metrics"])
+
+@router.get("/metrics")
+def get_metrics():
+    """当前进程的运行指标 (多 worker 部署时每个进程独立统计)"""
+    snapshot = metrics.snapshot()
+    snapshot["pid"] = os.getpid()
+    snapshot["memory"] = process_memory()
+    return snapshot
+
+
+def process_memory():
+    """当前进程内存 (MB)：USS 为独占部分，prefork 部署时与其他 worker 共享的模型权重不计入"""
+    try:
+        import psutil
+
+        info = psutil.Process().memory_full_info()
+    except Exception:
+        return {}
+    return {
+        "rss_mb": round(info.rss / 2 ** 20, 1),
+        "uss_mb": round(info.uss / 2 ** 20, 1),
+        "pss_mb": round(getattr(info, "pss", 0) / 2 ** 20, 1),
+    }
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from database import get_db
+from models import VideoSession
+from services.video_sessions import video_sessions, decode_series
+
+router = APIRouter(prefix="/video/sessions", tags=["Video Sessions"])
+
+@router.post("/{session_id}/end")
+def end_video_session(session_id: str):
+    """结束视频会话，立即写入汇总"""
+    summary = video_sessions.end(session_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="会话不存在或已结束")
+    return summary
+
+@router.get("/{session_id}")
+def get_video_session(session_id: str, expand: bool = False, db: Session = Depends(get_db)):
+    """查询已结束的视频会话汇总；expand=true 时解码逐秒序列"""
+    session = db.query(VideoSession).filter(VideoSession.session_id == session_id).first()
+    if session is None:
+        raise HTTPException(status_code=404, detail="会话不存在或尚未结束")
+    timeline = session.timeline or {}
+    if expand and timeline.get("classes"):
+        timeline = dict(timeline, classes={k: decode_series(v) for k, v in timeline["classes"].items()})
+    return {
+        "session_id": session.session_id,
+        "filename": session.filename,
+        "model_type": session.model_type,
+        "frame_count": session.frame_count,
+        "duration": session.duration,
+        "max_objects": session.max_objects,
+        "avg_objects": session.avg_objects,
+        "class_max": session.class_max,
+        "class_avg": session.class_avg,
+        "timeline": timeline,
+        "started_at": session.started_at,
+        "ended_at": session.ended_at,
+    }
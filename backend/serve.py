@@ -0,0 +1,206 @@
+"""
+生产环境 prefork 启动器
+主进程先导入应用并预加载模型，再 fork 出多个 uvicorn worker 共享同一个监听 socket；
+模型权重在 fork 后以 copy-on-write 方式共享，worker 数量增加时内存不再按模型大小成倍增长
+
+用法 (在项目根目录执行): python backend/serve.py --workers 4 --models aerial/yolo11s.pt,sar/ssdd.pt
+"""
+import sys
+import os
+
+# 与 uvicorn backend.main:app 一样，从项目根目录导入 backend 包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import gc
+import signal
+import socket
+import time
+
+# 后台任务 worker 由主进程统一启动，HTTP worker 的 lifespan 中不再各自启动
+_job_workers_env = os.environ.get("RS_JOB_WORKERS")
+os.environ["RS_JOB_WORKERS"] = "0"
+
+
+def configure_torch(threads):
+    """
+    fork 前的 torch 设置
+    - 每个 worker 的线程数 = 核数 / worker 数，避免多个进程各开满线程互相争抢
+    - 主进程不做任何推理，OpenMP 线程池不会在 fork 前初始化 (fork 后的子进程里使用已初始化的线程池可能死锁)
+    """
+    os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+    os.environ.setdefault("MKL_NUM_THREADS", str(threads))
+    import torch
+
+    torch.set_num_threads(threads)
+    torch.set_grad_enabled(False)
+
+
+def preload_models(models):
+    """在主进程加载模型；CUDA 上下文不能跨 fork，GPU 部署时跳过预加载"""
+    from services.engine import detector
+
+    if str(detector.device).startswith("cuda"):
+        print(f"⚠️ DEVICE={detector.device}: CUDA 上下文无法在 fork 后共享，模型改为由各 worker 按需加载")
+        return
+    for spec in models:
+        category, _, model_name = spec.partition("/")
+        started = time.perf_counter()
+        detector.preload_model(category, model_name)
+        print(f"📦 已预加载模型 {spec} ({time.perf_counter() - started:.1f}s)")
+
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, log_level, index):
+    """子进程：按执行计划绑核，丢弃继承自主进程的数据库连接，然后在共享 socket 上运行 uvicorn"""
+    import uvicorn
+    from database import engine
+    from services.execution_plan import execution_plan
+
+    execution_plan.apply_process(index)
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1):
+        signal.signal(sig, signal.SIG_DFL)
+    # 连接池里的连接属于主进程，子进程不能复用 (close=False: 不关闭主进程仍在使用的连接)
+    engine.dispose(close=False)
+    gc.enable()
+
+    config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn_worker(app, sock, log_level, index):
+    """fork 第 index 个 HTTP worker，返回 (pid, (启动时间, index))"""
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app, sock, log_level, index)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            code = 1
+        finally:
+            # 不执行主进程注册的 atexit 回调
+            os._exit(code)
+    return pid, (time.time(), index)
+
+
+def memory_report(pids):
+    """各进程的 RSS / USS (独占) / PSS (按共享比例分摊)，单位 MB"""
+    import psutil
+
+    print(f"{'进程':<16}{'pid':>8}{'RSS':>10}{'USS':>10}{'PSS':>10}{'共享':>10}")
+    total_uss = 0.0
+    for role, pid in pids:
+        try:
+            info = psutil.Process(pid).memory_full_info()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        rss, uss = info.rss / 2 ** 20, info.uss / 2 ** 20
+        pss = getattr(info, "pss", 0) / 2 ** 20
+        total_uss += uss
+        print(f"{role:<16}{pid:>8}{rss:>10.0f}{uss:>10.0f}{pss:>10.0f}{rss - uss:>10.0f}")
+    print(f"USS 合计: {total_uss:.0f} MB (新增一个 worker 约增加其 USS)")
+
+
+def main():
+    from config import PRELOAD_MODELS
+    from services.execution_plan import execution_plan
+
+    parser = argparse.ArgumentParser(description="RS Detection prefork 启动器")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=execution_plan.workers or 2,
+                        help="HTTP worker 进程数 (默认取执行计划)")
+    parser.add_argument("--threads", type=int, default=execution_plan.threads or 0,
+                        help="每个 worker 的 torch 线程数 (默认取执行计划，没有计划时为 核数/worker 数)")
+    parser.add_argument("--models", default=",".join(PRELOAD_MODELS), help="预加载的模型，逗号分隔的 场景/文件名")
+    parser.add_argument("--job-workers", type=int, default=int(_job_workers_env or 1), help="后台任务 worker 进程数")
+    parser.add_argument("--report-after", type=float, default=15, help="启动后多少秒输出一次内存报告 (0 表示不输出)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    models = [m for m in args.models.split(",") if m]
+
+    # gc 在 fork 前冻结：已有对象移出 gc 跟踪，子进程的垃圾回收不会写这些对象的头部而触发页复制
+    gc.disable()
+    if models:
+        configure_torch(threads)
+    import uvicorn  # noqa: F401  在主进程导入，子进程共享
+    from backend.main import app
+    from worker import start_workers, stop_workers, restart_exited
+    preload_models(models)
+
+    sock = bind_socket(args.host, args.port)
+    job_workers, job_stop_event = start_workers(args.job_workers)
+    gc.freeze()
+
+    workers = dict(spawn_worker(app, sock, args.log_level, i) for i in range(args.workers))
+    print(f"🚀 已启动 {len(workers)} 个 HTTP worker (http://{args.host}:{args.port})，每个 {threads} 个 torch 线程")
+
+    state = {"stopping": False, "report": False}
+
+    def _stop(*_):
+        state["stopping"] = True
+
+    def _report(*_):
+        state["report"] = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    # kill -USR1 <主进程 pid> 随时输出内存报告
+    signal.signal(signal.SIGUSR1, _report)
+    report_at = time.time() + args.report_after if args.report_after > 0 else None
+
+    while not state["stopping"]:
+        time.sleep(0.5)
+        # 回收退出的 HTTP worker 并补齐：只等待自己 fork 的 pid，
+        # 任务 worker (multiprocessing 启动) 也是子进程，由 multiprocessing 回收并读取退出码
+        for pid in list(workers):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done, status = pid, -1
+            if done == 0:
+                continue
+            started_at, index = workers.pop(pid)
+            if not state["stopping"]:
+                print(f"⚠️ worker {pid} 已退出 (status={status})，重新启动")
+                if time.time() - started_at < 5:
+                    # 启动即退出 (配置错误等)，放慢重启频率
+                    time.sleep(5)
+                pid, info = spawn_worker(app, sock, args.log_level, index)
+                workers[pid] = info
+        if not state["stopping"]:
+            restart_exited(job_workers, job_stop_event)
+        if state["report"] or (report_at and time.time() >= report_at):
+            state["report"], report_at = False, None
+            memory_report([("master", os.getpid())]
+                          + [("http-worker", pid) for pid in workers]
+                          + [("job-worker", p.pid) for p in job_workers])
+
+    print("🛑 正在关闭 worker...")
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in list(workers):
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    stop_workers(job_workers, job_stop_event)
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
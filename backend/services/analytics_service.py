@@ -0,0 +1,242 @@
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from config import SYNC_LOOKBACK_IDS
+from models import DetectionRecord, RecordClassCount, DailyRollup, DailyClassRollup, RollupState
+from services.rollups import rollups_ready, STATE_NAME
+
+
+def category_filter(column, category: str):
+    """model_type 中包含 "(category/" 的条件 (转义 LIKE 通配符，category 按字面匹配)"""
+    escaped = category.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return column.like(f"%({escaped}/%", escape="\\")
+
+
+def apply_filters(query, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                  category: Optional[str] = None, table=DetectionRecord):
+    """
+    原始记录表的通用过滤条件
+    :param start_date/end_date: 日期范围 (闭区间)
+    :param category: 场景分类 aerial / sar，对应 model_type 中的 "(category/模型名)"
+    :param table: 带 created_at / model_type 列的表 (默认为记录表，也用于冗余了这两列的类别明细表)
+    """
+    if start_date:
+        query = query.filter(table.created_at >= datetime.combine(start_date, time.min))
+    if end_date:
+        query = query.filter(table.created_at < datetime.combine(end_date + timedelta(days=1), time.min))
+    if category:
+        query = query.filter(category_filter(table.model_type, category))
+    return query
+
+
+def apply_rollup_filters(query, table, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                         category: Optional[str] = None):
+    """汇总表的过滤条件 (与 apply_filters 语义一致)"""
+    if start_date:
+        query = query.filter(table.day >= start_date)
+    if end_date:
+        query = query.filter(table.day <= end_date)
+    if category:
+        query = query.filter(category_filter(table.model_type, category))
+    return query
+
+
+def get_kpis(db: Session, **filters):
+    """核心指标：任务数、目标总数、平均密度、最近活动时间"""
+    if rollups_ready(db):
+        total_tasks, total_objects, latest_time = apply_rollup_filters(
+            db.query(
+                func.coalesce(func.sum(DailyRollup.tasks), 0),
+                func.coalesce(func.sum(DailyRollup.objects), 0),
+                func.max(DailyRollup.latest_at),
+            ),
+            DailyRollup, **filters
+        ).one()
+        # 主键上的 MAX 只读索引一端
+        max_id = db.query(func.max(DetectionRecord.id)).scalar()
+    else:
+        total_tasks, total_objects, latest_time, max_id = apply_filters(
+            db.query(
+                func.count(DetectionRecord.id),
+                func.coalesce(func.sum(DetectionRecord.object_count), 0),
+                func.max(DetectionRecord.created_at),
+                func.max(DetectionRecord.id),
+            ),
+            **filters
+        ).one()
+    total_tasks = int(total_tasks or 0)
+    total_objects = int(total_objects or 0)
+    return {
+        "total_tasks": total_tasks,
+        "total_objects": total_objects,
+        "avg_objects": round(total_objects / total_tasks, 2) if total_tasks else 0,
+        "latest_time": latest_time,
+        "max_id": max_id or 0,
+    }
+
+
+def get_daily_totals(db: Session, **filters):
+    """按天统计任务数和目标数"""
+    if rollups_ready(db):
+        rows = apply_rollup_filters(
+            db.query(DailyRollup.day, func.sum(DailyRollup.tasks), func.sum(DailyRollup.objects)),
+            DailyRollup, **filters
+        ).group_by(DailyRollup.day).order_by(DailyRollup.day).all()
+    else:
+        day = func.date(DetectionRecord.created_at)
+        rows = apply_filters(
+            db.query(
+                day.label("day"),
+                func.count(DetectionRecord.id),
+                func.coalesce(func.sum(DetectionRecord.object_count), 0),
+            ),
+            **filters
+        ).group_by(day).order_by(day).all()
+    return [{"date": str(d), "tasks": int(n), "objects": int(objs or 0)} for d, n, objs in rows]
+
+
+def get_mode_distribution(db: Session, **filters):
+    """各检测模式 (model_type) 的使用次数"""
+    if rollups_ready(db):
+        rows = apply_rollup_filters(
+            db.query(DailyRollup.model_type, func.sum(DailyRollup.tasks)),
+            DailyRollup, **filters
+        ).group_by(DailyRollup.model_type).all()
+    else:
+        rows = apply_filters(
+            db.query(DetectionRecord.model_type, func.count(DetectionRecord.id)),
+            **filters
+        ).group_by(DetectionRecord.model_type).all()
+    return [{"model_type": m, "count": int(n)} for m, n in rows]
+
+
+def get_class_totals(db: Session, **filters):
+    """各类别目标累计数量"""
+    if rollups_ready(db):
+        total = func.sum(DailyClassRollup.count)
+        rows = apply_rollup_filters(
+            db.query(DailyClassRollup.class_name, total),
+            DailyClassRollup, **filters
+        ).group_by(DailyClassRollup.class_name).order_by(total.desc()).all()
+        return [{"class_name": k, "count": int(v)} for k, v in rows]
+
+    # 汇总表尚未回填完成：已有类别明细的记录 (实时写入的 + 已回填的) 在数据库中聚合，
+    # 只有尚未回填的区间才读取 details JSON 在服务端累加
+    totals = {}
+    query = apply_filters(db.query(DetectionRecord.details), **filters)
+    state = db.get(RollupState, STATE_NAME)
+    if state is not None:
+        rows = apply_filters(
+            db.query(RecordClassCount.class_name, func.sum(RecordClassCount.count)),
+            table=RecordClassCount, **filters
+        ).filter(
+            (RecordClassCount.record_id <= state.backfilled_upto)
+            | (RecordClassCount.record_id >= state.live_since_id)
+        ).group_by(RecordClassCount.class_name).all()
+        totals = {k: int(v) for k, v in rows}
+        query = query.filter(
+            DetectionRecord.id > state.backfilled_upto, DetectionRecord.id < state.live_since_id
+        )
+    for (details,) in query.yield_per(2000):
+        if details and isinstance(details, dict):
+            for k, v in details.items():
+                totals[k] = totals.get(k, 0) + v
+    return [{"class_name": k, "count": v} for k, v in sorted(totals.items(), key=lambda kv: -kv[1])]
+
+
+RECORD_COLUMNS = (
+    DetectionRecord.id, DetectionRecord.filename, DetectionRecord.model_type,
+    DetectionRecord.object_count, DetectionRecord.details, DetectionRecord.created_at,
+)
+
+
+def get_all_records(db: Session, **filters):
+    """全部记录 (按列投影为字典，不构造 ORM 对象)"""
+    query = apply_filters(db.query(*RECORD_COLUMNS), **filters).order_by(DetectionRecord.id)
+    return [dict(r._mapping) for r in query]
+
+
+def get_records_since(db: Session, since_id: int = 0, limit: int = 500, **filters):
+    """
+    按 id 增量拉取记录 (keyset 分页，走主键索引，耗时只与新增条数相关)
+    :return: {"items": [...], "next_cursor": 最后一条 id, "has_more": 是否还有下一页}
+    """
+    rows = apply_filters(
+        db.query(*RECORD_COLUMNS).filter(DetectionRecord.id > since_id),
+        **filters
+    ).order_by(DetectionRecord.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [dict(r._mapping) for r in rows],
+        "next_cursor": rows[-1].id if rows else since_id,
+        "has_more": has_more,
+    }
+
+
+# /history 允许投影的列 (details 为 JSON，体积最大，按需返回)
+HISTORY_FIELDS = {c.key: c for c in RECORD_COLUMNS}
+DEFAULT_HISTORY_FIELDS = ("id", "filename", "model_type", "object_count", "details", "created_at")
+
+
+def query_history(db: Session, cursor: Optional[int] = None, limit: int = 10, fields=DEFAULT_HISTORY_FIELDS,
+                  start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                  model_type: Optional[str] = None, filename: Optional[str] = None,
+                  min_count: Optional[int] = None, **filters):
+    """
+    历史记录分页查询 (按 id 倒序的 keyset 分页，翻页代价与页码无关)
+    :param cursor: 上一页返回的 next_cursor，只返回 id 更小的记录
+    :param fields: 需要返回的列，id 总会返回
+    :return: {"items": [...], "next_cursor": 下一页游标 (没有更多时为 None)}
+    """
+    unknown = set(fields) - set(HISTORY_FIELDS)
+    if unknown:
+        raise ValueError(f"不支持的字段: {', '.join(sorted(unknown))}")
+    columns = [DetectionRecord.id] + [HISTORY_FIELDS[f] for f in fields if f != "id"]
+
+    query = apply_filters(db.query(*columns), **filters)
+    if cursor is not None:
+        query = query.filter(DetectionRecord.id < cursor)
+    if start_time:
+        query = query.filter(DetectionRecord.created_at >= start_time)
+    if end_time:
+        query = query.filter(DetectionRecord.created_at < end_time)
+    if model_type:
+        query = query.filter(DetectionRecord.model_type == model_type)
+    if filename:
+        query = query.filter(DetectionRecord.filename == filename)
+    if min_count is not None:
+        query = query.filter(DetectionRecord.object_count >= min_count)
+
+    rows = query.order_by(DetectionRecord.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [dict(r._mapping) for r in rows],
+        "next_cursor": rows[-1].id if rows and has_more else None,
+    }
+
+
+def get_summary(db: Session, **filters):
+    """
+    大屏一次性需要的全部聚合结果
+    kpis.max_id 可作为 /analytics/records 的增量游标：同一事务内读取，
+    MySQL 默认的 REPEATABLE READ 保证聚合结果与游标来自同一快照
+    """
+    kpis = get_kpis(db, **filters)
+    cursor = kpis["max_id"]
+    # 回看窗口内已计入聚合的 id，客户端增量同步时据此去重
+    seen_ids = [r.id for r in apply_filters(
+        db.query(DetectionRecord.id).filter(DetectionRecord.id > cursor - SYNC_LOOKBACK_IDS),
+        **filters
+    )]
+    return {
+        "kpis": kpis,
+        "daily": get_daily_totals(db, **filters),
+        "modes": get_mode_distribution(db, **filters),
+        "classes": get_class_totals(db, **filters),
+        "sync": {"cursor": cursor, "lookback": SYNC_LOOKBACK_IDS, "seen_ids": seen_ids},
+    }
@@ -1,15 +1,22 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from typing import Optional
 
+from config import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE
+from services.metrics import metrics
+
 # 密钥配置 (生产环境应该放在环境变量里)
 SECRET_KEY = "YOUR_SUPER_SECRET_KEY_CHANGE_THIS"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # Token 有效期 24 小时
 
-# 密码哈希工具
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 密码哈希工具 (轮数与当前配置不同的旧哈希在登录成功时自动重新计算)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 def verify_password(plain_password, hashed_password):
     """验证密码是否正确"""
@@ -19,6 +26,92 @@ def get_password_hash(password):
     """生成密码哈希"""
     return pwd_context.hash(password)
 
+def verify_and_update_password(plain_password, hashed_password):
+    """验证密码；哈希参数过时时额外返回新哈希 (否则为 None)"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class HashPoolSaturated(Exception):
+    """密码哈希线程池排队已满"""
+
+
+class PasswordHasher:
+    """
+    bcrypt 专用的有界线程池
+    bcrypt 每次计算上百毫秒，放在默认线程池里会在登录高峰时挤占同步路由 (如 /history) 的线程；
+    这里单独限制并发与排队长度，排队已满时直接拒绝
+    """
+
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, max_queue=PASSWORD_HASH_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0  # 正在计算 + 排队中的任务数
+
+        metrics.gauge("auth.hash_pending", lambda: self._pending)
+        metrics.gauge("auth.hash_queue_depth", lambda: max(0, self._pending - self.workers))
+
+    def _run(self, func, args, submitted_at):
+        metrics.observe("auth.hash_wait_seconds", time.perf_counter() - submitted_at)
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            metrics.observe("auth.hash_seconds", time.perf_counter() - started)
+            with self._lock:
+                self._pending -= 1
+
+    async def submit(self, func, *args):
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                metrics.inc("auth.hash_rejected")
+                raise HashPoolSaturated()
+            self._pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        try:
+            future = self._executor.submit(self._run, func, args, time.perf_counter())
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return await asyncio.wrap_future(future)
+
+    async def verify_and_update(self, plain_password, hashed_password):
+        return await self.submit(verify_and_update_password, plain_password, hashed_password)
+
+    async def hash(self, password):
+        return await self.submit(get_password_hash, password)
+
+
+def calibrate_bcrypt_rounds(target_ms=250, min_rounds=10, max_rounds=15, samples=3):
+    """
+    在当前机器上测量各轮数的 bcrypt 耗时，返回不超过目标耗时的最大轮数与测量结果
+    :return: (推荐轮数, {轮数: 毫秒})
+    """
+    timings = {}
+    best = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        ctx = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+        cost = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            ctx.hash("calibration-password")
+            cost.append((time.perf_counter() - started) * 1000)
+        timings[rounds] = round(min(cost), 1)
+        if timings[rounds] <= target_ms:
+            best = rounds
+        else:
+            # 轮数每加 1 耗时翻倍，后面只会更慢
+            break
+    return best, timings
+
+
+# 创建全局单例
+password_hasher = PasswordHasher()
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """生成 JWT Token"""
     to_encode = data.copy()
@@ -0,0 +1,68 @@
+"""
+推理请求的协作式取消
+- 路由为每个请求创建 CancelToken：客户端断开或超过 INFERENCE_TIMEOUT 时取消
+- 排队中的请求在取消时立即移出调度队列；正在推理的请求在切片 / batch 之间检查令牌并提前结束，
+  不再为已经放弃的请求继续推理、写库
+"""
+import asyncio
+import threading
+import time
+
+from services.metrics import metrics
+
+
+class InferenceCancelled(Exception):
+    """推理已取消 (reason: disconnect / timeout)"""
+
+    def __init__(self, reason):
+        super().__init__(f"推理已取消: {reason}")
+        self.reason = reason
+
+
+class CancelToken:
+    def __init__(self, timeout=None):
+        self._event = threading.Event()
+        self._callbacks = []
+        self.reason = None
+        self.created_at = time.monotonic()
+        self.deadline = self.created_at + timeout if timeout else None
+
+    def on_cancel(self, callback):
+        """注册取消回调 (在事件循环线程中执行，用于把排队中的请求移出队列)"""
+        self._callbacks.append(callback)
+
+    def cancel(self, reason):
+        """取消请求；只应在事件循环线程中调用 (推理线程通过 check 感知)"""
+        if self._event.is_set():
+            return
+        self.reason = reason
+        self._event.set()
+        metrics.inc(f"inference.cancelled.{reason}")
+        for callback in self._callbacks:
+            callback()
+
+    @property
+    def cancelled(self):
+        if self._event.is_set():
+            return True
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def check(self):
+        """推理线程在切片 / batch 之间调用，已取消时抛出 InferenceCancelled"""
+        if self.cancelled:
+            raise InferenceCancelled(self.reason or "timeout")
+
+
+def check(token):
+    """token 为 None (后台任务等) 时不检查"""
+    if token is not None:
+        token.check()
+
+
+async def watch_disconnect(request, token, interval=0.5):
+    """请求处理期间轮询客户端连接，断开时取消令牌"""
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel("disconnect")
+            return
+        await asyncio.sleep(interval)
@@ -0,0 +1,81 @@
+"""
+相同检测请求的合并 (single-flight)
+- 同一用户图片内容、模型与推理参数完全相同的并发请求只执行一次推理，结果分发给所有等待的请求
+  (合并键包含用户，推理耗时只计入该用户的配额)
+- 合并后的推理使用独立的 CancelToken：某个请求断开 / 超时只让它自己退出等待，
+  所有请求都退出后才取消推理
+只在事件循环线程中使用
+"""
+import asyncio
+import hashlib
+
+from services.metrics import metrics
+from services.cancellation import CancelToken, InferenceCancelled
+
+
+def request_key(contents, *params):
+    """请求合并键：图片内容摘要 + 用户与推理参数"""
+    digest = hashlib.sha1(contents).hexdigest()
+    return "|".join([digest, *(str(p) for p in params)])
+
+
+class _Flight:
+    def __init__(self):
+        self.cancel = CancelToken()
+        self.waiters = 0
+        self.task = None
+
+
+class RequestCoalescer:
+    def __init__(self):
+        self._flights = {}
+
+    @property
+    def inflight(self):
+        return len(self._flights)
+
+    async def run(self, key, execute, cancel=None):
+        """
+        执行 execute(flight_cancel) 或加入已在执行的相同请求，返回其结果
+        :param execute: 协程函数，接收合并后推理使用的 CancelToken
+        :param cancel: 当前请求的 CancelToken，取消时抛出 InferenceCancelled
+        """
+        if cancel is not None:
+            cancel.check()
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.ensure_future(execute(flight.cancel))
+            flight.task.add_done_callback(lambda _: self._finish(key, flight))
+        else:
+            metrics.inc("inference.coalesced")
+        flight.waiters += 1
+
+        left = asyncio.get_running_loop().create_future()
+        if cancel is not None:
+            cancel.on_cancel(lambda: left.done() or left.set_exception(InferenceCancelled(cancel.reason)))
+        try:
+            await asyncio.wait({flight.task, left}, return_when=asyncio.FIRST_COMPLETED)
+            if flight.task.done():
+                return flight.task.result()
+            return left.result()
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # 最后一个等待的请求也退出了：取消推理，之后到达的相同请求重新执行
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.cancel.cancel(cancel.reason if cancel is not None and cancel.reason else "disconnect")
+            if not left.done():
+                left.cancel()
+
+    def _finish(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # 没有请求等待时异常无人读取，这里取出避免 "exception was never retrieved" 警告
+            flight.task.exception()
+
+
+# 创建全局单例
+coalescer = RequestCoalescer()
@@ -0,0 +1,113 @@
+import io
+import math
+from PIL import Image
+
+from config import JOB_PROMOTE_SAHI_TILES
+from services.cancellation import check
+
+# SAHI 切片参数 (与 engine.run_inference 保持一致)
+SLICE_SIZE = 640
+SLICE_OVERLAP = 0.2
+
+
+def estimate_tile_count(width, height):
+    """估算 SAHI 切片数量，用于判断请求是否耗时"""
+    step = int(SLICE_SIZE * (1 - SLICE_OVERLAP))
+
+    def _axis(length):
+        if length <= SLICE_SIZE:
+            return 1
+        return math.ceil((length - SLICE_SIZE) / step) + 1
+
+    return _axis(width) * _axis(height)
+
+
+def should_promote(image_bytes, use_sahi):
+    """预计耗时过长的请求 (大图 + SAHI) 自动转为后台任务"""
+    if not use_sahi:
+        return False
+    try:
+        # Image.open 只解析文件头，不会解码整张图
+        width, height = Image.open(io.BytesIO(image_bytes)).size
+    except Exception:
+        return False
+    return estimate_tile_count(width, height) > JOB_PROMOTE_SAHI_TILES
+
+
+def _prepare_image(contents, enhance_type):
+    """解码图片并按需增强，返回 (PIL 图像, 模式后缀)"""
+    import numpy as np
+    import cv2
+    from services.image_utils import apply_enhancement
+
+    # 1. 读取图片
+    pil_image = Image.open(io.BytesIO(contents)).convert("RGB")
+
+    # 2. 图像增强
+    if enhance_type and enhance_type != "None":
+        img_bgr = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+        img_enhanced = apply_enhancement(img_bgr, enhance_type)
+        pil_image = Image.fromarray(cv2.cvtColor(img_enhanced, cv2.COLOR_BGR2RGB))
+        return pil_image, f" + {enhance_type}"
+    return pil_image, ""
+
+
+def _build_result(filename, final_img, count, stats, mode_base, mode_suffix):
+    from services.image_utils import image_to_base64
+
+    final_mode = mode_base + mode_suffix
+    record = {
+        "filename": filename,
+        "model_type": final_mode,
+        "object_count": count,
+        "details": stats,
+    }
+    response = {
+        "message": "Success",
+        "image_base64": image_to_base64(final_img),
+        "total_objects": count,
+        "details": stats,
+        "mode": final_mode
+    }
+    return response, record
+
+
+def process_detection(contents, filename, model_name, category, conf, use_sahi, enhance_type="None", cancel=None):
+    """
+    完整检测流程：解码 -> 增强 -> 推理 -> 编码
+    :param cancel: CancelToken，请求取消后在下一个检查点抛出 InferenceCancelled (不产生记录)
+    :return: (response 字典, 数据库记录字段字典)
+    """
+    # 推理依赖在第一次检测时才导入 (见 services/engine.py)
+    from services.engine import detector
+
+    pil_image, mode_suffix = _prepare_image(contents, enhance_type)
+    check(cancel)
+
+    # 3. 调用引擎推理
+    final_img, count, stats, mode_base = detector.run_inference(
+        pil_image,
+        model_name,
+        category,
+        conf,
+        use_sahi,
+        cancel
+    )
+    # 结果编码 (base64) 之前再检查一次
+    check(cancel)
+    return _build_result(filename, final_img, count, stats, mode_base, mode_suffix)
+
+
+def process_detection_stream(contents, filename, model_name, category, conf, enhance_type="None", cancel=None):
+    """
+    渐进式 SAHI 检测 (生成器)：先产出 preview，再逐组产出 tile，
+    最后产出 ("result", (response 字典, 数据库记录字段字典))
+    """
+    from services.engine import detector
+
+    pil_image, mode_suffix = _prepare_image(contents, enhance_type)
+    yield "start", {"width": pil_image.width, "height": pil_image.height}
+    for event, data in detector.run_progressive(pil_image, model_name, category, conf, cancel):
+        if event == "result":
+            data = _build_result(filename, *data, mode_suffix)
+        yield event, data
@@ -1,18 +1,45 @@
-from ultralytics import YOLO
-from sahi import AutoDetectionModel
-from sahi.predict import get_sliced_prediction
-from sahi.utils.cv import visualize_object_predictions
+# ultralytics / sahi / torch / cv2 导入耗时数秒、占用数百 MB 内存，
+# 只在第一次加载模型时导入，认证、管理、统计等非推理接口的进程不会加载它们
 import numpy as np
-import cv2
 import os
-from config import DEVICE
+import threading
+from services.execution_plan import execution_plan
+from services.cancellation import check
+from services.metrics import metrics
+from services.weights_watcher import WeightsWatcher, file_signature
+from services.model_registry import model_registry
+from services.tile_pool import (
+    tile_pool, slice_boxes, crop_tiles, predict_tiles, to_object_predictions, merge_predictions
+)
+
+
+def preload_runtime():
+    """提前导入推理依赖 (推理 worker 启动后调用，避免第一个请求承担导入耗时)"""
+    execution_plan.configure_torch()
+    import cv2  # noqa: F401
+    from ultralytics import YOLO  # noqa: F401
+    from sahi.predict import get_sliced_prediction  # noqa: F401
+
 
 class DetectionEngine:
     def __init__(self):
-        self.device = DEVICE
         # 简单的内存缓存，防止每次请求都重新加载模型
         # Key: "category/model_name", Value: YOLO model object
         self.loaded_models = {} 
+        # Key: "category/model_name", Value: 实际加载的权重文件路径 (权重目录监视使用)
+        self.model_paths = {}
+        # preload_model 固定的模型 (prefork 主进程预加载、子进程共享)，显存保护清理缓存时保留
+        self.pinned_models = set()
+        # 每个模型一把加载锁：同一模型的并发首次请求只加载一次，其余请求等待加载完成后直接使用
+        self._load_locks = {}
+        self._cache_lock = threading.Lock()
+        # 监视已加载模型的权重文件，替换后热更新、删除后移出缓存
+        self._watcher = WeightsWatcher(self)
+
+    @property
+    def device(self):
+        """推理设备 (第一次使用时确定，CUDA 不可用时回退到 CPU)"""
+        return execution_plan.device
 
     def _get_or_load_model(self, category, model_name):
         """
@@ -32,53 +59,124 @@ class DetectionEngine:
 
         # 3. 检查缓存
         cache_key = f"{category}/{model_name}"
-        if cache_key in self.loaded_models:
-            return self.loaded_models[cache_key], model_path
+        model = self.loaded_models.get(cache_key)
+        if model is not None:
+            self._watcher.start()
+            return model, model_path
 
-        # 4. 显存管理 (简单策略：如果加载超过 3 个模型，就清空旧的，防止显存爆炸)
-        if len(self.loaded_models) >= 3:
-            print("⚠️ 显存保护：清空旧模型缓存...")
-            self.loaded_models.clear()
+        with self._load_lock(cache_key):
+            # 等锁期间其他请求可能已经加载完成
+            model = self.loaded_models.get(cache_key)
+            if model is not None:
+                metrics.inc("model.load_coalesced")
+                return model, model_path
 
-        # 5. 加载新模型
-        print(f"📥 正在加载模型到显存: {cache_key}...")
-        try:
-            model = YOLO(model_path)
-            self.loaded_models[cache_key] = model
+            # 4. 显存管理 (简单策略：如果加载超过 3 个模型，就清空旧的，防止显存爆炸)
+            # 正在推理的请求持有模型引用，不受清空影响
+            with self._cache_lock:
+                if len(self.loaded_models) >= 3:
+                    print("⚠️ 显存保护：清空旧模型缓存 (保留预加载的模型)...")
+                    for key in list(self.loaded_models):
+                        if key not in self.pinned_models:
+                            del self.loaded_models[key]
+                            self.model_paths.pop(key, None)
+
+            # 5. 加载新模型
+            print(f"📥 正在加载模型到显存: {cache_key}...")
+            execution_plan.configure_torch()
+            from ultralytics import YOLO
+            # 加载前读取文件签名：加载期间被替换的文件也会被权重目录监视发现
+            signature = file_signature(model_path)
+            try:
+                model = YOLO(model_path)
+            except Exception as e:
+                raise RuntimeError(f"模型加载失败: {e}")
+            with self._cache_lock:
+                self.loaded_models[cache_key] = model
+                self.model_paths[cache_key] = model_path
+                self._watcher.track(cache_key, signature)
+            metrics.inc("model.loads")
+            model_registry.observe(category, model_name, model)
+            self._watcher.start()
             return model, model_path
-        except Exception as e:
-            raise RuntimeError(f"模型加载失败: {e}")
 
-    def run_inference(self, pil_image, model_name, category, conf, use_sahi):
+    def _load_lock(self, cache_key):
+        with self._cache_lock:
+            return self._load_locks.setdefault(cache_key, threading.Lock())
+
+    def reload_model(self, category, model_name):
+        """
+        加载并预热新版本权重，完成后原子替换缓存中的旧模型
+        替换前进行中的请求持有旧模型引用，不受影响
+        """
+        cache_key = f"{category}/{model_name}"
+        model_path = self.model_paths.get(cache_key) or os.path.join("weights", category, model_name)
+        with self._load_lock(cache_key):
+            execution_plan.configure_torch()
+            from ultralytics import YOLO
+
+            signature = file_signature(model_path)
+            model = YOLO(model_path)
+            # 预热：第一次推理要初始化算子 / CUDA 上下文，不让替换后的第一个请求承担
+            model.predict(np.zeros((64, 64, 3), dtype=np.uint8), device=self.device, save=False, verbose=False)
+            with self._cache_lock:
+                self.loaded_models[cache_key] = model
+                self.model_paths[cache_key] = model_path
+                self._watcher.track(cache_key, signature)
+        model_registry.observe(category, model_name, model)
+        return model
+
+    def evict(self, category, model_name):
+        """移出缓存 (权重文件被删除时)；返回是否曾经加载"""
+        cache_key = f"{category}/{model_name}"
+        with self._cache_lock:
+            self.model_paths.pop(cache_key, None)
+            self.pinned_models.discard(cache_key)
+            return self.loaded_models.pop(cache_key, None) is not None
+
+    def preload_model(self, category, model_name):
+        """
+        预加载并固定模型 (prefork 部署时在主进程调用，子进程通过 copy-on-write 共享权重)
+        推理时 ultralytics 会原地融合 Conv+BN，这里提前融合，避免每个子进程各自改写 (复制) 权重页
+        """
+        model, _ = self._get_or_load_model(category, model_name)
+        with self._cache_lock:
+            self.pinned_models.add(f"{category}/{model_name}")
+        model.fuse()
+        model.model.eval()
+        for param in model.model.parameters():
+            param.requires_grad_(False)
+        return model
+
+    def run_inference(self, pil_image, model_name, category, conf, use_sahi, cancel=None):
         """
         统一推理入口
         :param category: 'aerial' 或 'sar'
+        :param cancel: CancelToken，SAHI 推理在每组切片之间检查，已取消时抛出 InferenceCancelled
         """
         # 1. 获取模型实例和路径
         yolo_model, model_path = self._get_or_load_model(category, model_name)
+        check(cancel)
         
         stats = {}
         final_image_bgr = None
         mode_used = "Unknown"
 
+        import cv2
+
         # 2. SAHI 切片推理逻辑
         if use_sahi:
-             # ultralytics 的 engine可以用 'yolov8' 兼容加载 RT-DETR
-             sahi_model = AutoDetectionModel.from_pretrained(
-                model_type='yolov8', 
-                model_path=model_path, #  使用动态获取的路径
-                confidence_threshold=conf,
-                device=self.device
-            )
-             
-             result = get_sliced_prediction(
-                pil_image, sahi_model, 
-                slice_height=640, slice_width=640,
-                overlap_height_ratio=0.2, overlap_width_ratio=0.2
-            )
+             from sahi.utils.cv import visualize_object_predictions
+
+             # 切片与合并参数与 sahi.get_sliced_prediction 默认值一致，
+             # 直接复用已缓存的模型按 batch 推理，每组切片之间可以取消
+             predictions = []
+             for _, _, _, tile_predictions in self._sliced_predictions(yolo_model, model_path, pil_image, conf, cancel):
+                 predictions.extend(tile_predictions)
+             object_prediction_list = merge_predictions(predictions)
+             check(cancel)
              
              # 统计结果
-             object_prediction_list = result.object_prediction_list
              for obj in object_prediction_list:
                 name = obj.category.name
                 stats[name] = stats.get(name, 0) + 1
@@ -107,5 +205,74 @@ class DetectionEngine:
 
         return final_image_bgr, len(stats), stats, mode_used
 
+    def _iter_tiles(self, yolo_model, model_path, image, conf, chunks, cancel=None):
+        """按完成顺序产出 (切片组, 类别名字典, 推理结果)；CPU 且开启进程池时并行执行"""
+        if tile_pool.enabled and self.device == "cpu":
+            yield from tile_pool.iter_chunks(image, model_path, conf, chunks, cancel)
+            return
+        for chunk in chunks:
+            check(cancel)
+            yield chunk, yolo_model.names, predict_tiles(yolo_model, crop_tiles(image, chunk), chunk, conf, self.device)
+
+    def _sliced_predictions(self, yolo_model, model_path, pil_image, conf, cancel=None):
+        """切片推理 (生成器)：每完成一组切片产出 (已完成组数, 总组数, 切片组, ObjectPrediction 列表)"""
+        image = np.asarray(pil_image, dtype=np.uint8)
+        height, width = image.shape[:2]
+        boxes = slice_boxes(width, height, slice_size=640, overlap=0.2)
+        batch_size = execution_plan.batch_size
+        chunks = [boxes[i:i + batch_size] for i in range(0, len(boxes), batch_size)]
+        tiles_iter = self._iter_tiles(yolo_model, model_path, image, conf, chunks, cancel)
+        for done, (chunk, names, tiles) in enumerate(tiles_iter, 1):
+            yield done, len(chunks), chunk, to_object_predictions(names, tiles, [height, width])
+
+    def run_progressive(self, pil_image, model_name, category, conf, cancel=None):
+        """
+        渐进式 SAHI 推理 (生成器)，依次产出:
+        - ("preview", 数据): 整图缩放到模型输入尺寸的一次推理，很快给出大目标
+        - ("tile", 数据): 每完成一组切片产出该组的检测框与进度
+        - ("result", (final_image_bgr, count, stats, mode_used)): 合并后的最终结果，与 run_inference 返回值相同
+        检测框坐标均为原图像素坐标
+        """
+        import cv2
+        from sahi.utils.cv import visualize_object_predictions
+
+        yolo_model, model_path = self._get_or_load_model(category, model_name)
+        image = np.asarray(pil_image, dtype=np.uint8)
+        check(cancel)
+
+        preview = yolo_model.predict(source=image, conf=conf, device=self.device, save=False, verbose=False)[0]
+        names = yolo_model.names
+        yield "preview", {
+            "detections": [
+                {"bbox": [round(v, 1) for v in box], "class_name": names[int(c)], "score": round(float(s), 3)}
+                for box, c, s in zip(preview.boxes.xyxy.cpu().tolist(), preview.boxes.cls.cpu().tolist(),
+                                     preview.boxes.conf.cpu().tolist())
+            ],
+        }
+
+        predictions = []
+        for done, total, chunk, tile_predictions in self._sliced_predictions(
+                yolo_model, model_path, pil_image, conf, cancel):
+            predictions.extend(tile_predictions)
+            yield "tile", {
+                "done": done,
+                "total": total,
+                "slices": chunk,
+                "detections": [
+                    {"bbox": [round(v, 1) for v in p.bbox.to_xyxy()], "class_name": p.category.name,
+                     "score": round(p.score.value, 3)}
+                    for p in tile_predictions
+                ],
+            }
+
+        merged = merge_predictions(predictions)
+        check(cancel)
+        stats = {}
+        for obj in merged:
+            stats[obj.category.name] = stats.get(obj.category.name, 0) + 1
+        vis_res = visualize_object_predictions(image, merged)
+        final_image_bgr = cv2.cvtColor(vis_res['image'], cv2.COLOR_RGB2BGR)
+        yield "result", (final_image_bgr, len(stats), stats, f"SAHI ({category}/{model_name})")
+
 # 创建全局单例
 detector = DetectionEngine()
\ No newline at end of file
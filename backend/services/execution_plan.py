@@ -0,0 +1,237 @@
+"""
+CPU 执行计划
+python backend/manage.py calibrate-cpu 在当前机器上实测已安装的模型，选出吞吐最高的
+(worker 数, 每个 worker 的 torch 线程数, batch 大小, CPU 绑核) 组合写入 execution_plan.json；
+后端启动时读取并应用，避免多个 worker 各自开满线程互相争抢 CPU
+标定全部在 CPU 上进行：batch 大小只在推理设备为 CPU 时生效，不会套用到 GPU 推理
+"""
+import json
+import os
+import socket
+import statistics
+import time
+
+from config import DEVICE, EXECUTION_PLAN_PATH
+
+
+def resolve_device(requested):
+    """请求 CUDA 但当前机器不可用时回退到 CPU"""
+    if str(requested).startswith("cuda"):
+        import torch
+
+        if not torch.cuda.is_available():
+            print(f"⚠️ CUDA 不可用，推理设备由 {requested} 回退为 cpu")
+            return "cpu"
+    return requested
+
+
+class ExecutionPlan:
+    def __init__(self, path=EXECUTION_PLAN_PATH):
+        self.path = path
+        self.data = self._load()
+        self._device = None
+        self._torch_configured = False
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 执行计划读取失败，使用默认配置: {e}")
+            return {}
+
+    @property
+    def workers(self):
+        return self.data.get("workers")
+
+    @property
+    def threads(self):
+        return self.data.get("threads_per_worker")
+
+    @property
+    def batch_size(self):
+        """SAHI 切片的推理 batch 大小 (CPU 上标定的结果，推理设备不是 CPU 时不使用)"""
+        if self.device != "cpu":
+            return 1
+        return self.data.get("batch_size", 1)
+
+    @property
+    def device(self):
+        """推理设备：显式设置的 RS_DEVICE > 执行计划 > config.DEVICE，CUDA 不可用时回退到 CPU"""
+        if self._device is None:
+            requested = DEVICE if "RS_DEVICE" in os.environ else self.data.get("device", DEVICE)
+            self._device = resolve_device(requested)
+        return self._device
+
+    def apply_process(self, worker_index=None):
+        """
+        在导入 torch 之前调用：设置 OpenMP / MKL 线程数 (已显式设置的环境变量优先)，
+        给出 worker 序号时把进程绑定到计划分配的 CPU 核
+        """
+        if self.threads:
+            os.environ.setdefault("OMP_NUM_THREADS", str(self.threads))
+            os.environ.setdefault("MKL_NUM_THREADS", str(self.threads))
+        affinity = self.data.get("affinity")
+        if affinity and worker_index is not None and hasattr(os, "sched_setaffinity"):
+            cores = affinity[worker_index % len(affinity)]
+            try:
+                os.sched_setaffinity(0, cores)
+            except OSError as e:
+                print(f"⚠️ CPU 绑核失败 {cores}: {e}")
+
+    def configure_torch(self):
+        """导入 torch 后调用一次：按计划设置 intra-op / inter-op 线程数"""
+        if self._torch_configured:
+            return
+        self._torch_configured = True
+        import torch
+
+        threads = self.threads or int(os.environ.get("OMP_NUM_THREADS", 0))
+        if threads:
+            torch.set_num_threads(threads)
+        interop = self.data.get("interop_threads")
+        if interop:
+            try:
+                torch.set_num_interop_threads(interop)
+            except RuntimeError:
+                # 已经执行过并行任务后不能再修改
+                pass
+
+
+# ---------- 标定 ----------
+
+def _bench_worker(model_path, threads, batch_size, cores, iterations, barrier, results):
+    """标定子进程：按给定线程数 / 绑核加载模型，预热后与其他子进程同时开始计时"""
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    import numpy as np
+    import torch
+    from ultralytics import YOLO
+
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    model = YOLO(model_path)
+    rng = np.random.default_rng(0)
+    batch = [rng.integers(0, 255, (640, 640, 3), dtype=np.uint8) for _ in range(batch_size)]
+    model.predict(batch, device="cpu", verbose=False)
+
+    barrier.wait()
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        model.predict(batch, device="cpu", verbose=False)
+        latencies.append(time.perf_counter() - started)
+    results.put(latencies)
+
+
+def _split_cores(cpus, workers):
+    """把可用的逻辑核按顺序平均分给各 worker"""
+    size = len(cpus) // workers
+    return [cpus[i * size:(i + 1) * size] for i in range(workers)]
+
+
+def _measure(model_path, workers, threads, batch_size, affinity, iterations):
+    import multiprocessing as mp
+
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=_bench_worker, daemon=True,
+                    args=(model_path, threads, batch_size, affinity[i], iterations, barrier, results))
+        for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    try:
+        latencies = [results.get(timeout=900) for _ in procs]
+    finally:
+        for p in procs:
+            p.join(10)
+            if p.is_alive():
+                p.terminate()
+    # 吞吐 = 所有 worker 处理的图片总数 / 最慢 worker 的耗时
+    wall = max(sum(lat) for lat in latencies)
+    return {
+        "throughput": round(workers * iterations * batch_size / wall, 2),
+        "p50_ms": round(statistics.median(x for lat in latencies for x in lat) * 1000, 1),
+    }
+
+
+def calibrate_cpu(model_paths, iterations=10, max_latency_ms=None, batch_options=(1, 2, 4, 8), log=print):
+    """
+    实测各 (worker 数, 线程数) 组合，再在最优组合上实测 batch 大小
+    多个模型时按各自最优吞吐归一化后求和打分；max_latency_ms 限制单个 batch 的 p50 延迟
+    :return: 执行计划字典
+    """
+    try:
+        import psutil
+
+        physical = psutil.cpu_count(logical=False)
+    except ImportError:
+        physical = None
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    physical = min(physical or len(cpus), len(cpus))
+
+    worker_options = [w for w in (1, 2, 3, 4, 6, 8, 12, 16) if w <= physical]
+    measured = []
+
+    def _run(workers, batch_size):
+        threads = max(1, physical // workers)
+        affinity = _split_cores(cpus, workers)
+        per_model = {}
+        for path in model_paths:
+            per_model[path] = _measure(path, workers, threads, batch_size, affinity, iterations)
+            log(f"  workers={workers} threads={threads} batch={batch_size} {os.path.basename(path)}: "
+                f"{per_model[path]['throughput']} img/s, p50 {per_model[path]['p50_ms']} ms")
+        entry = {"workers": workers, "threads_per_worker": threads, "batch_size": batch_size,
+                 "affinity": affinity, "models": per_model}
+        measured.append(entry)
+        return entry
+
+    def _best(entries):
+        best_tp = {path: max(e["models"][path]["throughput"] for e in entries) for path in model_paths}
+
+        def _score(e):
+            return sum(e["models"][p]["throughput"] / best_tp[p] for p in model_paths)
+
+        def _within_budget(e):
+            return max_latency_ms is None or all(m["p50_ms"] <= max_latency_ms for m in e["models"].values())
+
+        return max(entries, key=lambda e: (_within_budget(e), _score(e)))
+
+    log(f"🔍 可用 CPU: {len(cpus)} 个逻辑核 / {physical} 个物理核")
+    best = _best([_run(w, 1) for w in worker_options])
+    batched = [best] + [_run(best["workers"], b) for b in batch_options if b > 1]
+    best = _best(batched)
+
+    # 计划不写入推理设备 (设备仍由 RS_DEVICE / config.DEVICE 决定)，只记录标定所用的设备
+    return {
+        "tuned_device": "cpu",
+        "workers": best["workers"],
+        "threads_per_worker": best["threads_per_worker"],
+        "interop_threads": 1,
+        "batch_size": best["batch_size"],
+        "affinity": best["affinity"],
+        "host": socket.gethostname(),
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "measured": [{k: v for k, v in e.items() if k != "affinity"} for e in measured],
+    }
+
+
+def save_plan(plan, path=EXECUTION_PLAN_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# 创建全局单例
+execution_plan = ExecutionPlan()
@@ -0,0 +1,186 @@
+import io
+import json
+from datetime import date, datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from config import EXPORT_CHUNK_SIZE
+from database import SessionLocal
+from models import DetectionRecord, DailyClassRollup
+from services.analytics_service import apply_filters, apply_rollup_filters
+from services.retention import iter_archive_chunks
+from services.rollups import rollups_ready
+
+# 导出的基础列 (details 在列式格式中展开为 details.<类别名> 列)
+EXPORT_COLUMNS = (
+    DetectionRecord.id, DetectionRecord.filename, DetectionRecord.model_type,
+    DetectionRecord.object_count, DetectionRecord.created_at, DetectionRecord.details,
+)
+CLASS_COLUMN_PREFIX = "details."
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def class_names(db: Session, upto_id=None, **filters):
+    """
+    导出范围内出现过的全部类别名 (决定列式格式的列集合)
+    :param upto_id: 只扫描 id 不超过该值的记录 (汇总表未回填完成时)
+    """
+    if rollups_ready(db):
+        rows = apply_rollup_filters(
+            db.query(DailyClassRollup.class_name).distinct(), DailyClassRollup, **filters
+        ).all()
+        return sorted(name for (name,) in rows)
+
+    # 汇总表尚未回填完成：流式扫描 details 收集键名，内存只与类别数有关
+    names = set()
+    query = apply_filters(db.query(DetectionRecord.details), **filters)
+    if upto_id is not None:
+        query = query.filter(DetectionRecord.id <= upto_id)
+    for (details,) in query.yield_per(EXPORT_CHUNK_SIZE):
+        if details and isinstance(details, dict):
+            names.update(details)
+    return sorted(names)
+
+
+def columnar_snapshot(db: Session, **filters):
+    """
+    列式导出的列集合快照：先读当前最大 id，再读类别名
+    之后只导出 id 不超过该值的记录，导出期间新写入记录的类别不会缺列
+    :return: (类别名列表, 最大 id)
+    """
+    upto_id = db.query(func.max(DetectionRecord.id)).scalar() or 0
+    return class_names(db, upto_id=upto_id, **filters), upto_id
+
+
+def iter_record_chunks(chunk_size=EXPORT_CHUNK_SIZE, upto_id=None, **filters):
+    """
+    使用服务端游标按块读取记录 (按 id 升序)
+    独立打开会话：流式响应的生命周期长于请求依赖注入的会话
+    :param upto_id: 只读取 id 不超过该值的记录
+    """
+    db = SessionLocal()
+    try:
+        stmt = apply_filters(select(*EXPORT_COLUMNS).order_by(DetectionRecord.id), **filters)
+        if upto_id is not None:
+            stmt = stmt.where(DetectionRecord.id <= upto_id)
+        stmt = stmt.execution_options(stream_results=True, yield_per=chunk_size)
+        for partition in db.execute(stmt).partitions():
+            yield [dict(r._mapping) for r in partition]
+    finally:
+        db.close()
+
+
+def iter_export_chunks(include_archive=False, chunk_size=EXPORT_CHUNK_SIZE, upto_id=None, **filters):
+    """导出的数据源：可选先输出已归档的记录 (更早的数据)，再输出数据库中的记录"""
+    if include_archive:
+        yield from iter_archive_chunks(chunk_size, **filters)
+    yield from iter_record_chunks(chunk_size, upto_id, **filters)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+def stream_ndjson(chunks):
+    """每行一条记录，details 保持原始 JSON 对象"""
+    for rows in chunks:
+        yield "".join(
+            json.dumps(row, ensure_ascii=False, default=_json_default) + "\n" for row in rows
+        ).encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """pyarrow 的输出目标：写入的字节暂存在内存，由生成器逐块取走"""
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _arrow_schema(pa, classes):
+    fields = [
+        pa.field("id", pa.int64()),
+        pa.field("filename", pa.string()),
+        pa.field("model_type", pa.string()),
+        pa.field("object_count", pa.int64()),
+        pa.field("created_at", pa.timestamp("us")),
+    ]
+    fields += [pa.field(CLASS_COLUMN_PREFIX + name, pa.int64()) for name in classes]
+    return pa.schema(fields)
+
+
+def _to_record_batch(pa, schema, classes, rows):
+    """把一块记录转换为 RecordBatch，details 展开为类别列 (未出现的类别记 0)"""
+    columns = {
+        "id": [r["id"] for r in rows],
+        "filename": [r["filename"] for r in rows],
+        "model_type": [r["model_type"] for r in rows],
+        "object_count": [r["object_count"] for r in rows],
+        "created_at": [r["created_at"] for r in rows],
+    }
+    details = [r["details"] if isinstance(r["details"], dict) else {} for r in rows]
+    for name in classes:
+        columns[CLASS_COLUMN_PREFIX + name] = [d.get(name, 0) for d in details]
+    return pa.RecordBatch.from_pydict(columns, schema=schema)
+
+
+def stream_arrow(chunks, classes):
+    """Arrow IPC 流格式，每块记录一个 RecordBatch"""
+    import pyarrow as pa
+
+    schema = _arrow_schema(pa, classes)
+    sink = _ChunkSink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        yield sink.drain()
+        for rows in chunks:
+            writer.write_batch(_to_record_batch(pa, schema, classes, rows))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def stream_parquet(chunks, classes):
+    """Parquet (zstd 压缩)，每块记录一个 row group，文件尾在最后输出"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(pa, classes)
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for rows in chunks:
+            writer.write_batch(_to_record_batch(pa, schema, classes, rows))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def columnar_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
@@ -0,0 +1,207 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+from config import (
+    JOB_DB_PATH, JOB_INPUT_DIR, JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS, JOB_RESULT_TTL_HOURS
+)
+
+# 任务状态
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    filename TEXT,
+    input_path TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    lease_until REAL,
+    user_key TEXT,
+    role TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+"""
+
+
+class JobQueue:
+    """
+    基于 SQLite 的本地持久化任务队列
+    - 多进程安全：每次操作独立连接，领取任务使用 BEGIN IMMEDIATE 加写锁
+    - 崩溃恢复：running 状态的任务带租约，租约过期后可被其他 worker 重新领取
+    """
+
+    def __init__(self, db_path=JOB_DB_PATH, input_dir=JOB_INPUT_DIR):
+        self.db_path = db_path
+        self.input_dir = input_dir
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            os.makedirs(self.input_dir, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            if not self._initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                # 旧版本创建的队列库没有提交者字段 (推理耗时按提交者计入配额)
+                columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+                for column in ("user_key", "role"):
+                    if column not in columns:
+                        conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+                self._initialized = True
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, params: dict, image_bytes: bytes, filename: str,
+               user_key: Optional[str] = None, role: Optional[str] = None) -> str:
+        """写入输入文件并入队，返回 job_id (user_key / role 为提交者，执行后按推理耗时扣除其配额)"""
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            input_path = os.path.join(self.input_dir, f"{job_id}.bin")
+            # 先落盘输入文件再登记任务，保证队列里的任务一定有输入
+            with open(input_path, "wb") as f:
+                f.write(image_bytes)
+                f.flush()
+                os.fsync(f.fileno())
+            conn.execute(
+                "INSERT INTO jobs (id, status, params, filename, input_path, user_key, role, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, STATUS_QUEUED, json.dumps(params), filename, input_path, user_key, role, time.time())
+            )
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[dict]:
+        """领取一个待执行 (或租约已过期) 的任务"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    """
+                    SELECT * FROM jobs
+                    WHERE status = ? OR (status = ? AND lease_until < ?)
+                    ORDER BY created_at LIMIT 1
+                    """,
+                    (STATUS_QUEUED, STATUS_RUNNING, now)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+
+                if row["attempts"] >= JOB_MAX_ATTEMPTS:
+                    # 多次执行都没能完成 (通常是 worker 反复崩溃)，直接判定失败
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                        (STATUS_FAILED, "超过最大重试次数", now, row["id"])
+                    )
+                    conn.execute("COMMIT")
+                    return None
+
+                conn.execute(
+                    """
+                    UPDATE jobs SET status = ?, attempts = attempts + 1, worker_id = ?,
+                        lease_until = ?, started_at = ?
+                    WHERE id = ?
+                    """,
+                    (STATUS_RUNNING, worker_id, now + JOB_LEASE_SECONDS, now, row["id"])
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
+
+    def complete(self, job_id: str, result: dict):
+        """保存结果并删除输入文件"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT input_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_until = NULL, finished_at = ? WHERE id = ?",
+                (STATUS_DONE, json.dumps(result), time.time(), job_id)
+            )
+        if row:
+            self._remove_input(row["input_path"])
+
+    def fail(self, job_id: str, error: str, retry: bool = False):
+        """标记失败；retry=True 且未超过重试次数时重新入队"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT attempts, input_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            if retry and row["attempts"] < JOB_MAX_ATTEMPTS:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, lease_until = NULL WHERE id = ?",
+                    (STATUS_QUEUED, error, job_id)
+                )
+                return
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, finished_at = ? WHERE id = ?",
+                (STATUS_FAILED, error, time.time(), job_id)
+            )
+        self._remove_input(row["input_path"])
+
+    def get(self, job_id: str, with_result: bool = False) -> Optional[dict]:
+        """查询任务状态 (可选附带结果)"""
+        columns = "*" if with_result else \
+            "id, status, filename, error, attempts, created_at, started_at, finished_at"
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {columns} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            if job["status"] == STATUS_QUEUED:
+                job["position"] = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?",
+                    (STATUS_QUEUED, job["created_at"])
+                ).fetchone()[0]
+        if with_result:
+            job["params"] = json.loads(job["params"])
+            job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def load_input(self, job: dict) -> bytes:
+        with open(job["input_path"], "rb") as f:
+            return f.read()
+
+    def purge_expired(self) -> int:
+        """清理超过保留时长的已结束任务"""
+        cutoff = time.time() - JOB_RESULT_TTL_HOURS * 3600
+        with self._connect() as conn:
+            cur = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (STATUS_DONE, STATUS_FAILED, cutoff)
+            )
+            return cur.rowcount
+
+    @staticmethod
+    def _remove_input(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# 创建全局单例
+job_queue = JobQueue()
@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import deque
+
+
+class Histogram:
+    """保留最近 N 个样本的滑动窗口，用于计算分位数"""
+
+    def __init__(self, window=2048):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+            self.total += value
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self.count, self.total
+        if not samples:
+            return {"count": count, "avg": 0.0, "p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+
+        def _pct(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))], 4)
+
+        return {
+            "count": count,
+            "avg": round(total / count, 4),
+            "p50": _pct(0.50),
+            "p90": _pct(0.90),
+            "p99": _pct(0.99),
+            "max": round(samples[-1], 4),
+        }
+
+
+class MetricsRegistry:
+    """
+    进程内指标注册表
+    - counter: 单调递增计数
+    - gauge: 注册一个回调，读取时实时计算 (如队列深度)
+    - histogram: 耗时等分布类指标
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self.started_at = time.time()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name, func):
+        self._gauges[name] = func
+
+    def histogram(self, name) -> Histogram:
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram()
+            return self._histograms[name]
+
+    def observe(self, name, value):
+        self.histogram(name).observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = dict(self._histograms)
+
+        gauge_values = {}
+        for name, func in gauges.items():
+            try:
+                gauge_values[name] = func()
+            except Exception as e:
+                gauge_values[name] = f"error: {e}"
+
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "counters": counters,
+            "gauges": gauge_values,
+            "histograms": {name: h.snapshot() for name, h in histograms.items()},
+        }
+
+
+# 创建全局单例
+metrics = MetricsRegistry()
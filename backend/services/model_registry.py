@@ -0,0 +1,226 @@
+"""
+模型注册表 (权重文件的元数据索引)
+- 每个权重文件只在上传 / 第一次发现时计算一次 SHA-256 与大小，类别名、输入尺寸、结构、参数量、
+  实测延迟在加载模型时补全，保存在本地 SQLite，各进程共享
+- 模型列表直接读索引；权重目录按 MODEL_REGISTRY_RESCAN 间隔重新扫描 (只 stat，文件变化时才重新计算摘要)
+- 只做列表的进程不需要导入 torch：完整的元数据由任务 worker (上传后提交的 inspect_model 任务)、
+  推理时已加载的模型或 python backend/manage.py scan-models 补全
+"""
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from config import MODEL_REGISTRY_PATH, MODEL_REGISTRY_RESCAN
+from services.metrics import metrics
+from services.execution_plan import execution_plan
+from services.job_queue import job_queue
+
+MODEL_CATEGORIES = ("aerial", "sar")
+# 任务队列中读取模型元数据的任务 (params["task"])，由 worker.py 执行
+TASK_INSPECT_MODEL = "inspect_model"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    key TEXT PRIMARY KEY,
+    category TEXT NOT NULL,
+    name TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    classes TEXT,
+    imgsz INTEGER,
+    task TEXT,
+    arch TEXT,
+    params INTEGER,
+    latency_ms REAL,
+    discovered_at REAL NOT NULL,
+    inspected_at REAL
+);
+"""
+
+_METADATA_FIELDS = ("classes", "imgsz", "task", "arch", "params", "latency_ms")
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def describe_model(model):
+    """从已加载的 YOLO / RT-DETR 模型读取元数据 (不做推理)"""
+    net = model.model
+    args = getattr(net, "args", None) or {}
+    imgsz = model.overrides.get("imgsz") or args.get("imgsz") or 640
+    if isinstance(imgsz, (list, tuple)):
+        imgsz = max(imgsz)
+    yaml_cfg = getattr(net, "yaml", None) or {}
+    return {
+        "classes": [model.names[i] for i in sorted(model.names)],
+        "imgsz": int(imgsz),
+        "task": model.task,
+        "arch": os.path.splitext(os.path.basename(yaml_cfg.get("yaml_file", "")))[0] or type(net).__name__,
+        "params": sum(p.numel() for p in net.parameters()),
+    }
+
+
+def measure_latency(model, imgsz, device, iterations=3):
+    """单张图的推理延迟 (毫秒，预热一次后取中位数)"""
+    import statistics
+    import numpy as np
+
+    image = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    model.predict(image, device=device, verbose=False)
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        model.predict(image, device=device, verbose=False)
+        timings.append(time.perf_counter() - started)
+    return round(statistics.median(timings) * 1000, 1)
+
+
+class ModelRegistry:
+    def __init__(self, db_path=MODEL_REGISTRY_PATH, root="weights", rescan_interval=MODEL_REGISTRY_RESCAN):
+        self.db_path = db_path
+        self.root = root
+        self.rescan_interval = rescan_interval
+        self._initialized = False
+        self._lock = threading.Lock()
+        self._scanned_at = 0.0
+
+    @contextmanager
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            if not self._initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                self._initialized = True
+            yield conn
+        finally:
+            conn.close()
+
+    # ---------- 索引维护 ----------
+
+    def scan(self):
+        """
+        扫描权重目录：新文件 / 大小或 mtime 变化的文件重新计算摘要 (并清空旧的元数据)，已删除的文件移出索引
+        :return: 有变化的模型 key 列表
+        """
+        files = {}
+        for path in glob.glob(os.path.join(self.root, "*", "*.pt")):
+            category, name = os.path.basename(os.path.dirname(path)), os.path.basename(path)
+            files[f"{category}/{name}"] = (category, name, path)
+
+        with self._lock, self._connect() as conn:
+            known = {row["key"]: row for row in conn.execute("SELECT key, size, mtime_ns FROM models")}
+            changed = []
+            for key, (category, name, path) in files.items():
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                row = known.get(key)
+                if row is not None and row["size"] == st.st_size and row["mtime_ns"] == st.st_mtime_ns:
+                    continue
+                conn.execute(
+                    "INSERT OR REPLACE INTO models (key, category, name, sha256, size, mtime_ns, discovered_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, category, name, _file_hash(path), st.st_size, st.st_mtime_ns, time.time()),
+                )
+                changed.append(key)
+            removed = [key for key in known if key not in files]
+            conn.executemany("DELETE FROM models WHERE key = ?", [(key,) for key in removed])
+            self._scanned_at = time.monotonic()
+        if changed or removed:
+            metrics.inc("model_registry.indexed", len(changed))
+            print(f"🗂️ 模型索引已更新: 新增/变化 {len(changed)} 个，移除 {len(removed)} 个")
+        return changed
+
+    def remove(self, category, name):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM models WHERE key = ?", (f"{category}/{name}",))
+
+    def observe(self, category, name, model):
+        """推理进程加载模型后调用：索引中还没有元数据时从已加载的模型补全 (不测延迟)"""
+        key = f"{category}/{name}"
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT inspected_at FROM models WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.scan()
+            elif row["inspected_at"] is not None:
+                return
+            self._store(key, describe_model(model))
+        except Exception as e:
+            print(f"⚠️ 模型元数据记录失败 {key}: {e}")
+
+    def inspect(self, category, name, device=None, measure=True):
+        """
+        加载模型读取元数据，并在推理设备上实测单张图延迟 (任务 worker / scan-models 命令)
+        :param device: 默认为执行计划的推理设备
+        """
+        from ultralytics import YOLO
+
+        device = device or execution_plan.device
+        key = f"{category}/{name}"
+        model = YOLO(os.path.join(self.root, category, name))
+        info = describe_model(model)
+        if measure:
+            info["latency_ms"] = measure_latency(model, info["imgsz"], device)
+        self._store(key, info)
+        return info
+
+    def request_inspection(self, category, name):
+        """提交读取元数据的任务 (由任务 worker 加载模型，API 进程不导入 torch、不占用推理资源)"""
+        return job_queue.submit({"task": TASK_INSPECT_MODEL, "category": category, "name": name}, b"", name)
+
+    def _store(self, key, info):
+        fields = [f for f in _METADATA_FIELDS if f in info]
+        values = [json.dumps(info[f], ensure_ascii=False) if f == "classes" else info[f] for f in fields]
+        assignments = ", ".join(f"{f} = ?" for f in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE models SET {assignments}, inspected_at = ? WHERE key = ?",
+                (*values, time.time(), key),
+            )
+
+    # ---------- 查询 ----------
+
+    def entries(self):
+        """索引中的全部模型；距离上次扫描超过 rescan_interval 时先重新扫描权重目录"""
+        if time.monotonic() - self._scanned_at > self.rescan_interval:
+            self.scan()
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM models ORDER BY category, name").fetchall()
+        entries = []
+        for row in rows:
+            entry = dict(row)
+            entry["classes"] = json.loads(entry["classes"]) if entry["classes"] else None
+            entries.append(entry)
+        return entries
+
+    def listing(self):
+        """按场景分组：{"models": {场景: [文件名]}, "details": {场景: [元数据]}}"""
+        models = {category: [] for category in MODEL_CATEGORIES}
+        details = {category: [] for category in MODEL_CATEGORIES}
+        for entry in self.entries():
+            models.setdefault(entry["category"], []).append(entry["name"])
+            details.setdefault(entry["category"], []).append(
+                {k: v for k, v in entry.items() if k not in ("key", "category", "mtime_ns")}
+            )
+        return {"models": models, "details": details}
+
+
+# 创建全局单例
+model_registry = ModelRegistry()
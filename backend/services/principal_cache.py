@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+
+from config import PRINCIPAL_CACHE_TTL, PRINCIPAL_CACHE_MAX, PRINCIPAL_REVOCATION_CHECK
+from models import DataVersion
+from services.metrics import metrics
+
+# data_versions 表中的撤销版本号：修改角色 / 删除用户时在同一事务内递增，各进程据此清空缓存
+REVOCATION_VERSION = "principals"
+
+
+class Principal:
+    """已认证用户的只读快照 (不含密码哈希，可以跨请求、跨数据库会话复用)"""
+
+    __slots__ = ("id", "username", "role", "created_at")
+
+    def __init__(self, id, username, role, created_at):
+        self.id = id
+        self.username = username
+        self.role = role
+        self.created_at = created_at
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.role, user.created_at)
+
+    def to_dict(self):
+        return {"id": self.id, "username": self.username, "role": self.role, "created_at": self.created_at}
+
+
+class PrincipalCache:
+    """
+    按用户名缓存已认证用户，省去每个请求一次数据库查询
+    - Token 的签名与过期时间仍然每次校验，这里只缓存 "用户是否存在 + 当前角色"
+    - 修改角色 / 删除用户时在本进程内立即失效，并递增数据库中的撤销版本号；
+      其他进程 (prefork worker、任务 worker) 每 PRINCIPAL_REVOCATION_CHECK 秒检查一次版本号，
+      管理员接口每次都检查，变化时清空整个缓存
+    """
+
+    def __init__(self, ttl=PRINCIPAL_CACHE_TTL, max_entries=PRINCIPAL_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        # 每次失效递增：查询数据库期间发生过失效时，查到的结果可能已过时，不写入缓存
+        self._epoch = 0
+        self._revocation_version = None
+        self._revocation_checked_at = 0.0
+
+        metrics.gauge("auth.principal_cache.size", lambda: len(self._entries))
+        metrics.gauge("auth.principal_cache.hit_rate", self.hit_rate)
+
+    def get(self, username: str):
+        """
+        :return: (缓存的 Principal 或 None, 当前 epoch)，未命中时把 epoch 原样传给 put
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(username)
+                self._hits += 1
+                hit = True
+            else:
+                if entry is not None:
+                    del self._entries[username]
+                self._misses += 1
+                hit = False
+            epoch = self._epoch
+        metrics.inc("auth.principal_cache.hit" if hit else "auth.principal_cache.miss")
+        return (entry[1] if hit else None), epoch
+
+    def put(self, principal: Principal, epoch: int):
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            self._entries[principal.username] = (time.monotonic() + self.ttl, principal)
+            self._entries.move_to_end(principal.username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: str):
+        with self._lock:
+            self._entries.pop(username, None)
+            self._epoch += 1
+        metrics.inc("auth.principal_cache.invalidated")
+
+    def sync(self, db, force=False):
+        """检查共享的撤销版本号 (主键查询)，其他进程修改过用户时清空本进程缓存"""
+        now = time.monotonic()
+        if not force and now - self._revocation_checked_at < PRINCIPAL_REVOCATION_CHECK:
+            return
+        row = db.get(DataVersion, REVOCATION_VERSION, populate_existing=True)
+        version = row.version if row else 0
+        with self._lock:
+            self._revocation_checked_at = now
+            if version == self._revocation_version:
+                return
+            if self._revocation_version is not None:
+                self._entries.clear()
+                self._epoch += 1
+                metrics.inc("auth.principal_cache.revoked")
+            self._revocation_version = version
+
+    def hit_rate(self):
+        total = self._hits + self._misses
+        return round(self._hits / total, 4) if total else 0.0
+
+
+# 创建全局单例
+principal_cache = PrincipalCache()
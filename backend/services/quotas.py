@@ -0,0 +1,257 @@
+"""
+推理资源配额 (按用户公平分配)
+- 每个用户一个令牌桶，令牌单位是 "推理秒"：请求结束后按实际推理耗时扣除，桶空时返回 429
+- 角色权重用于调度器的加权公平排队 (WFQ)：排队时按用户轮转，权重高的角色分到更多名额
+- 角色策略 (权重 / 速率 / 突发量) 由管理员修改，保存在本地 SQLite，各进程定期重新读取
+- 用量统计 (请求数、推理秒数、上传/返回字节数) 在内存中累加，后台线程定期按天写入 SQLite
+- 后台任务在 worker 进程中执行，推理耗时写入共享的 debits 表，各进程刷新策略时从本地令牌桶中扣除
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from config import QUOTA_DB_PATH, ROLE_QUOTA_DEFAULTS, QUOTA_POLICY_REFRESH, USAGE_FLUSH_INTERVAL
+from services.metrics import metrics
+
+ANONYMOUS_ROLE = "anonymous"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS role_policies (
+    role TEXT PRIMARY KEY,
+    weight REAL NOT NULL,
+    rate REAL NOT NULL,
+    burst REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS usage (
+    day TEXT NOT NULL,
+    username TEXT NOT NULL,
+    role TEXT,
+    requests INTEGER NOT NULL DEFAULT 0,
+    rejected INTEGER NOT NULL DEFAULT 0,
+    inference_seconds REAL NOT NULL DEFAULT 0,
+    bytes_in INTEGER NOT NULL DEFAULT 0,
+    bytes_out INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, username)
+);
+CREATE TABLE IF NOT EXISTS debits (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    role TEXT,
+    seconds REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+_USAGE_FIELDS = ("requests", "rejected", "inference_seconds", "bytes_in", "bytes_out")
+
+
+def caller_identity(request, user):
+    """配额与用量按登录用户统计，未登录的请求按客户端 IP 统计，返回 (user_key, role)"""
+    if user is not None:
+        return user.username, user.role
+    return f"anonymous@{request.client.host if request.client else '-'}", ANONYMOUS_ROLE
+
+
+class QuotaExceeded(Exception):
+    """用户的推理配额已用完"""
+
+    def __init__(self, retry_after):
+        super().__init__("推理配额已用完")
+        self.retry_after = retry_after
+
+
+class QuotaManager:
+    def __init__(self, db_path=QUOTA_DB_PATH, defaults=ROLE_QUOTA_DEFAULTS):
+        self.db_path = db_path
+        self.defaults = defaults
+        self._initialized = False
+        self._lock = threading.Lock()
+        self._policies = {}
+        self._policies_loaded_at = 0.0
+        self._buckets = {}   # user_key -> [剩余令牌, 上次更新时间]
+        self._pending = {}   # (day, user_key) -> 用量增量
+        self._flusher = None
+        self._debit_cursor = None  # 已扣除到的 debits.id
+
+        metrics.gauge("quota.tracked_users", lambda: len(self._buckets))
+
+    @contextmanager
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            if not self._initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                self._initialized = True
+            yield conn
+        finally:
+            conn.close()
+
+    # ---------- 角色策略 ----------
+
+    def policies(self):
+        """所有角色的当前策略 (默认值 + 管理员修改过的值)"""
+        now = time.monotonic()
+        if now - self._policies_loaded_at > QUOTA_POLICY_REFRESH:
+            with self._connect() as conn:
+                rows = conn.execute("SELECT role, weight, rate, burst FROM role_policies").fetchall()
+                debits = self._pull_debits(conn)
+            merged = {role: dict(p) for role, p in self.defaults.items()}
+            for row in rows:
+                merged[row["role"]] = {"weight": row["weight"], "rate": row["rate"], "burst": row["burst"]}
+            self._policies, self._policies_loaded_at = merged, now
+            self._apply_debits(debits)
+        return self._policies
+
+    def _pull_debits(self, conn):
+        """其他进程 (任务 worker) 登记的推理耗时；第一次读取时只记录位置，不追溯历史"""
+        if self._debit_cursor is None:
+            self._debit_cursor = conn.execute("SELECT COALESCE(MAX(id), 0) FROM debits").fetchone()[0]
+            return []
+        rows = conn.execute(
+            "SELECT id, username, role, seconds FROM debits WHERE id > ? ORDER BY id", (self._debit_cursor,)
+        ).fetchall()
+        if rows:
+            self._debit_cursor = rows[-1]["id"]
+        return rows
+
+    def _apply_debits(self, debits):
+        if not debits:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for row in debits:
+                policy = self._policies.get(row["role"]) or self._policies["user"]
+                self._refill(row["username"], policy, now)[0] -= row["seconds"]
+
+    def policy(self, role):
+        policies = self.policies()
+        return policies.get(role) or policies["user"]
+
+    def set_policy(self, role, weight, rate, burst):
+        if weight <= 0 or rate <= 0 or burst <= 0:
+            raise ValueError("权重、速率和突发量必须大于 0")
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO role_policies (role, weight, rate, burst, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(role) DO UPDATE SET weight = excluded.weight, rate = excluded.rate, "
+                "burst = excluded.burst, updated_at = excluded.updated_at",
+                (role, weight, rate, burst, time.time()),
+            )
+        # 本进程立即生效，其他进程在 QUOTA_POLICY_REFRESH 秒内生效
+        self._policies_loaded_at = 0.0
+        return self.policy(role)
+
+    # ---------- 令牌桶 ----------
+
+    def _refill(self, user_key, policy, now):
+        bucket = self._buckets.get(user_key)
+        if bucket is None:
+            bucket = self._buckets[user_key] = [policy["burst"], now]
+        bucket[0] = min(policy["burst"], bucket[0] + (now - bucket[1]) * policy["rate"])
+        bucket[1] = now
+        return bucket
+
+    def admit(self, user_key, role):
+        """准入检查：桶内还有令牌即放行 (实际耗时在 charge 中扣除，允许透支一次)"""
+        policy = self.policy(role)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._refill(user_key, policy, now)
+            tokens = bucket[0]
+            if len(self._buckets) > 10000:
+                # 清理长时间没有请求的用户 (桶早已回满，等同于新用户)
+                self._buckets = {k: b for k, b in self._buckets.items() if now - b[1] < 600}
+        if tokens <= 0:
+            metrics.inc("quota.rejected")
+            self.record(user_key, role, rejected=1)
+            raise QuotaExceeded(max(1, int(-tokens / policy["rate"]) + 1))
+        return policy
+
+    def charge(self, user_key, role, seconds, shared=False):
+        """
+        按实际推理耗时扣除令牌
+        :param shared: 在任务 worker 等不接收请求的进程中执行的推理，登记到 debits 表，由接收请求的进程扣除
+        """
+        if shared:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO debits (username, role, seconds, created_at) VALUES (?, ?, ?, ?)",
+                    (user_key, role, seconds, time.time()),
+                )
+            return
+        policy = self.policy(role)
+        with self._lock:
+            self._refill(user_key, policy, time.monotonic())[0] -= seconds
+
+    # ---------- 用量统计 ----------
+
+    def record(self, user_key, role, **usage):
+        """累加用量 (requests / rejected / inference_seconds / bytes_in / bytes_out)"""
+        key = (date.today().isoformat(), user_key)
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = dict.fromkeys(_USAGE_FIELDS, 0)
+                entry["role"] = role
+            for field, value in usage.items():
+                entry[field] += value
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="usage-flusher", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(USAGE_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ 用量统计写入失败: {e}")
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for (day, user_key), entry in pending.items():
+                conn.execute(
+                    "INSERT INTO usage (day, username, role, requests, rejected, inference_seconds, bytes_in, bytes_out) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(day, username) DO UPDATE SET "
+                    "role = excluded.role, requests = requests + excluded.requests, "
+                    "rejected = rejected + excluded.rejected, "
+                    "inference_seconds = inference_seconds + excluded.inference_seconds, "
+                    "bytes_in = bytes_in + excluded.bytes_in, bytes_out = bytes_out + excluded.bytes_out",
+                    (day, user_key, entry["role"], *(entry[f] for f in _USAGE_FIELDS)),
+                )
+            # 各进程每 QUOTA_POLICY_REFRESH 秒读取一次，一天前的记录已不再需要
+            conn.execute("DELETE FROM debits WHERE created_at < ?", (time.time() - 86400,))
+            conn.execute("COMMIT")
+
+    def usage(self, days=7):
+        """最近 N 天每个用户的用量合计 (包含尚未写入的部分)，按推理秒数降序"""
+        self.flush()
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT username, MAX(role) AS role, SUM(requests) AS requests, SUM(rejected) AS rejected, "
+                "SUM(inference_seconds) AS inference_seconds, SUM(bytes_in) AS bytes_in, SUM(bytes_out) AS bytes_out "
+                "FROM usage WHERE day >= ? GROUP BY username ORDER BY inference_seconds DESC",
+                (since,),
+            ).fetchall()
+        result = [dict(r) for r in rows]
+        for r in result:
+            r["inference_seconds"] = round(r["inference_seconds"], 2)
+        return result
+
+
+# 创建全局单例
+quota_manager = QuotaManager()
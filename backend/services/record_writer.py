@@ -0,0 +1,294 @@
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+from config import (
+    RECORD_WRITE_MODE, RECORD_FLUSH_SIZE, RECORD_FLUSH_INTERVAL,
+    RECORD_MAX_BUFFER, RECORD_JOURNAL_DIR
+)
+from database import SessionLocal
+from models import DetectionRecord
+from services.metrics import metrics
+from services import rollups
+
+# 写入模式
+MODE_SYNC = "sync"        # 每条记录同步提交 (旧行为)
+MODE_BUFFER = "buffer"    # 内存缓冲批量提交，进程崩溃时最多丢失一个刷新周期的数据
+MODE_JOURNAL = "journal"  # 先追加写本地日志再缓冲，进程重启时回放未提交的日志
+# 日志分段按 "<pid>-<进程启动标识>-<序号>.jsonl" 命名：容器重启后新进程常拿到相同的 pid (例如 PID 1)，
+# 只凭 pid 会把崩溃进程的分段当成自己的 (不回放、继续追加、刷新后删除)
+
+
+class RecordWriter:
+    """
+    DetectionRecord 异步批量写入器 (write-behind)
+    请求线程只把记录放进内存队列，后台线程按数量或时间批量 INSERT
+    """
+
+    def __init__(self, mode=RECORD_WRITE_MODE, flush_size=RECORD_FLUSH_SIZE,
+                 flush_interval=RECORD_FLUSH_INTERVAL, max_buffer=RECORD_MAX_BUFFER,
+                 journal_dir=RECORD_JOURNAL_DIR):
+        self.mode = mode
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.journal_dir = journal_dir
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._owner_pid = None
+
+        # journal 模式：当前写入的日志分段，以及已写入但尚未提交到数据库的分段
+        self._journal_file = None
+        self._journal_seq = 0
+        self._journal_owner = None  # (pid, 启动标识)
+        self._pending_segments = []
+
+        metrics.gauge("record_writer.queue_depth", lambda: len(self._queue))
+
+    # ---------- 对外接口 ----------
+
+    def submit(self, record: dict):
+        """提交一条检测记录"""
+        record = dict(record)
+        record.setdefault("created_at", datetime.now())
+
+        if self.mode == MODE_SYNC:
+            self._write_batch([record])
+            return
+
+        self._ensure_started()
+        with self._lock:
+            if len(self._queue) >= self.max_buffer:
+                # 数据库长时间不可用时的背压：退化为同步写，避免内存无限增长
+                metrics.inc("record_writer.buffer_full")
+            else:
+                if self.mode == MODE_JOURNAL:
+                    self._journal_append(record)
+                self._queue.append(record)
+                metrics.inc("record_writer.submitted")
+                if len(self._queue) >= self.flush_size:
+                    self._wakeup.set()
+                return
+        self._write_batch([record])
+
+    def flush(self):
+        """立即把缓冲区内的记录全部写入数据库"""
+        with self._lock:
+            rows = list(self._queue)
+            self._queue.clear()
+            segments = self._rotate_journal()
+        if not rows:
+            self._drop_segments(segments)
+            return 0
+
+        try:
+            self._write_batch(rows)
+        except Exception as e:
+            print(f"⚠️ 检测记录批量写入失败，稍后重试: {e}")
+            metrics.inc("record_writer.flush_errors")
+            self._sync_segments(segments)
+            with self._lock:
+                # 放回队首，保持原有顺序
+                self._queue.extendleft(reversed(rows))
+                self._pending_segments = segments + self._pending_segments
+            return 0
+
+        self._drop_segments(segments)
+        return len(rows)
+
+    def stop(self):
+        """停止后台线程并刷新剩余记录 (进程退出前调用)"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+        self.flush()
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+
+    # ---------- 后台线程 ----------
+
+    def _ensure_started(self):
+        # fork 出来的子进程不会继承线程，需要重新启动
+        if self._thread is not None and self._owner_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._owner_pid == os.getpid():
+                return
+            self._owner_pid = os.getpid()
+            self._journal_file = None
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="record-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            # 组提交：submit 只把日志写入内核缓冲 (进程崩溃不会丢)，落盘在后台线程按周期统一 fsync
+            self._sync_journal()
+            if self._queue:
+                flushed = self.flush()
+                if not flushed and self._queue:
+                    # 写入失败，退避后再试
+                    self._stopped.wait(min(self.flush_interval * 4, 10))
+
+    def _write_batch(self, rows):
+        """一个事务内批量插入，并同步写入类别明细与汇总表"""
+        start = time.perf_counter()
+        db = SessionLocal()
+        try:
+            # MySQL 不支持 INSERT ... RETURNING，通过 ORM flush 拿到自增 id 供明细表引用
+            objs = [DetectionRecord(**row) for row in rows]
+            db.add_all(objs)
+            db.flush()
+            rollups.mark_live(db, min(o.id for o in objs))
+            rollups.apply_rollups(db, objs)
+            rollups.bump_version(db)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        metrics.observe("record_writer.flush_latency_seconds", time.perf_counter() - start)
+        metrics.observe("record_writer.flush_batch_size", len(rows))
+        metrics.inc("record_writer.flushed", len(rows))
+
+    # ---------- 本地日志 (journal 模式) ----------
+
+    def _owner(self):
+        """当前进程的 (pid, 启动标识)；fork 出的子进程重新生成"""
+        if self._journal_owner is None or self._journal_owner[0] != os.getpid():
+            self._journal_owner = (os.getpid(), uuid.uuid4().hex[:12])
+            self._journal_seq = 0
+        return self._journal_owner
+
+    def _journal_append(self, record):
+        if self._journal_file is None:
+            os.makedirs(self.journal_dir, exist_ok=True)
+            pid, token = self._owner()
+            self._journal_seq += 1
+            path = os.path.join(self.journal_dir, f"{pid}-{token}-{self._journal_seq}.jsonl")
+            self._journal_file = open(path, "x", encoding="utf-8")
+        row = dict(record, created_at=record["created_at"].isoformat())
+        self._journal_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self._journal_file.flush()
+
+    def _sync_journal(self):
+        """把当前日志分段落盘 (后台线程调用，不阻塞提交记录的请求)"""
+        with self._lock:
+            if self._journal_file is None:
+                return
+            fd = os.dup(self._journal_file.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _rotate_journal(self):
+        """切换日志分段，返回本次刷新覆盖的全部分段 (调用方需持有锁)"""
+        segments = self._pending_segments
+        self._pending_segments = []
+        if self._journal_file is not None:
+            segments.append(self._journal_file.name)
+            self._journal_file.close()
+            self._journal_file = None
+        return segments
+
+    @staticmethod
+    def _sync_segments(segments):
+        """写入失败、分段需要保留到下次重试时落盘"""
+        for path in segments:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    @staticmethod
+    def _drop_segments(segments):
+        for path in segments:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def replay_orphans(self):
+        """
+        回放已退出进程遗留的日志 (启动时调用一次；至少一次语义：崩溃发生在提交后、删除前时可能重复)
+        多个进程同时启动时，每个分段先用原子 rename 认领 (<分段>.replaying-<pid>-<启动标识>)，认领失败说明已被其他进程处理
+        """
+        if self.mode != MODE_JOURNAL:
+            return
+        me = self._owner()
+        candidates = []
+        for path in glob.glob(os.path.join(self.journal_dir, "*.jsonl")):
+            # 分段名去掉序号即所属进程
+            if _orphaned(os.path.basename(path)[:-len(".jsonl")].rsplit("-", 1)[0], me):
+                candidates.append((path, path))
+        # 回放到一半退出的进程认领的分段
+        for path in glob.glob(os.path.join(self.journal_dir, "*.jsonl.replaying-*")):
+            segment, _, claimer = path.rpartition(".replaying-")
+            if _orphaned(claimer, me):
+                candidates.append((path, segment))
+
+        for path, segment in sorted(candidates, key=lambda c: c[1]):
+            claimed = f"{segment}.replaying-{me[0]}-{me[1]}"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed, encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            for row in rows:
+                row["created_at"] = datetime.fromisoformat(row["created_at"])
+            if rows:
+                try:
+                    self._write_batch(rows)
+                except Exception as e:
+                    # 放回原名，下次启动时重试
+                    print(f"⚠️ 回放记录日志失败 {segment}: {e}")
+                    os.rename(claimed, segment)
+                    continue
+                print(f"♻️ 已回放 {len(rows)} 条未提交的检测记录: {segment}")
+            self._drop_segments([claimed])
+
+
+def _orphaned(owner, me):
+    """
+    判断分段所属进程 ("<pid>-<启动标识>"，旧版本只有 "<pid>") 是否已退出
+    pid 与当前进程相同但启动标识不同：是复用了该 pid 的已崩溃进程
+    """
+    pid, _, token = owner.partition("-")
+    if int(pid) == me[0]:
+        return token != me[1]
+    return not _pid_alive(int(pid))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# 创建全局单例
+record_writer = RecordWriter()
@@ -0,0 +1,96 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from fastapi import Request, Response
+from sqlalchemy.orm import Session
+
+from config import ANALYTICS_CACHE_MAX_BYTES
+from models import DataVersion
+from services.metrics import metrics
+from services.serialization import build_response, encode, negotiate_media_type
+
+
+class VersionedResponseCache:
+    """
+    按数据版本号失效的响应缓存
+    - 版本号存在数据库 data_versions 表，写入检测记录时在同一事务内递增，多进程共享
+    - 缓存键为 路径 + 接口实际接受的参数 (未知的查询参数不产生新条目)，版本号变化后旧条目自然失效
+    - 只缓存按 JSON / MessagePack 编码后的字节 (不保留结果对象)，命中时不再序列化；按总字节数淘汰最久未用的条目
+    - ETag = 版本号 + 缓存键与格式摘要，客户端带 If-None-Match 且版本未变时直接返回 304，不做任何计算
+    """
+
+    def __init__(self, name="records", max_bytes=ANALYTICS_CACHE_MAX_BYTES):
+        self.name = name
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (version, {media_type: body})
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        metrics.gauge("analytics_cache.bytes", lambda: self._bytes)
+
+    def current_version(self, db: Session) -> int:
+        row = db.get(DataVersion, self.name, populate_existing=True)
+        return row.version if row else 0
+
+    @staticmethod
+    def cache_key(request: Request, params=None) -> str:
+        items = sorted((k, v) for k, v in (params or {}).items() if v is not None)
+        return f"{request.url.path}?" + "&".join(f"{k}={v}" for k, v in items)
+
+    def etag(self, key: str, version: int, media_type: str) -> str:
+        digest = hashlib.sha1(f"{key}|{media_type}".encode("utf-8")).hexdigest()[:16]
+        return f'"{self.name}-{version}-{digest}"'
+
+    def respond(self, request: Request, db: Session, compute, params=None, store=True) -> Response:
+        """
+        带缓存地生成响应
+        :param compute: 无参函数，缓存未命中时调用，返回可 JSON 序列化的结果
+        :param params: 接口接受的参数 (构成缓存键)
+        :param store: 为 False 时只做 ETag / 304，不在内存中保留响应 (全表等大结果)
+        """
+        version = self.current_version(db)
+        key = self.cache_key(request, params)
+        media_type = negotiate_media_type(request)
+        etag = self.etag(key, version, media_type)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+        if etag in request.headers.get("if-none-match", ""):
+            metrics.inc("analytics_cache.not_modified")
+            return Response(status_code=304, headers=headers)
+
+        if store:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == version:
+                    self._entries.move_to_end(key)
+                    body = entry[1].get(media_type)
+                    if body is not None:
+                        metrics.inc("analytics_cache.hit")
+                        return build_response(request, body, media_type, headers=headers)
+
+        metrics.inc("analytics_cache.miss")
+        body = encode(compute(), media_type)
+        if store and len(body) <= self.max_bytes:
+            self._store(key, version, media_type, body)
+        return build_response(request, body, media_type, headers=headers)
+
+    def _store(self, key, version, media_type, body):
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[0] == version:
+                self._bytes -= len(current[1].get(media_type, b""))
+                current[1][media_type] = body
+            else:
+                if current is not None:
+                    self._bytes -= sum(len(b) for b in current[1].values())
+                self._entries[key] = (version, {media_type: body})
+            self._bytes += len(body)
+            self._entries.move_to_end(key)
+            while self._bytes > self.max_bytes:
+                _, (_, bodies) = self._entries.popitem(last=False)
+                self._bytes -= sum(len(b) for b in bodies.values())
+
+
+# 创建全局单例
+analytics_cache = VersionedResponseCache()
@@ -0,0 +1,203 @@
+"""
+检测记录保留策略
+超过保留期的原始记录：确认已计入汇总表 -> 归档为 Parquet (zstd) -> 按主键分批删除
+归档目录按天分区: <ARCHIVE_DIR>/records/dt=YYYY-MM-DD/part-<首条 id>.parquet
+统计接口使用汇总表，不受删除影响；原始明细可通过 /export/records?include_archive=true 读取
+"""
+import glob
+import json
+import os
+import time
+from datetime import date, datetime, time as dtime, timedelta
+
+from sqlalchemy import delete, func
+from sqlalchemy.orm import Session
+
+from config import ARCHIVE_DIR, RETENTION_BATCH_SIZE, RETENTION_BATCH_PAUSE
+from models import DetectionRecord, RecordClassCount
+from services import rollups
+
+RECORDS_ARCHIVE_DIR = os.path.join(ARCHIVE_DIR, "records")
+
+
+def _archive_schema(pa):
+    return pa.schema([
+        pa.field("id", pa.int64()),
+        pa.field("filename", pa.string()),
+        pa.field("model_type", pa.string()),
+        pa.field("object_count", pa.int64()),
+        pa.field("created_at", pa.timestamp("us")),
+        # 原始 details JSON 文本，导出时再按需展开
+        pa.field("details", pa.string()),
+    ])
+
+
+def partition_dir(day: date) -> str:
+    return os.path.join(RECORDS_ARCHIVE_DIR, f"dt={day.isoformat()}")
+
+
+def _write_parquet_atomic(table, path):
+    """先写临时文件并 fsync，再原子替换，避免留下写了一半的归档"""
+    import pyarrow.parquet as pq
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path, compression="zstd")
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _rows_to_table(pa, rows):
+    return pa.Table.from_pydict({
+        "id": [r.id for r in rows],
+        "filename": [r.filename for r in rows],
+        "model_type": [r.model_type for r in rows],
+        "object_count": [r.object_count for r in rows],
+        "created_at": [r.created_at for r in rows],
+        "details": [json.dumps(r.details, ensure_ascii=False) if r.details is not None else None for r in rows],
+    }, schema=_archive_schema(pa))
+
+
+def archive_day(db: Session, day: date, batch_size=RETENTION_BATCH_SIZE, pause=RETENTION_BATCH_PAUSE):
+    """
+    归档并删除某一天的全部原始记录
+    每批: 写归档文件 -> 同一事务删除类别明细与记录 -> 提交
+    中断后重跑时同一批次的首条 id 不变，归档文件会被覆盖而不会重复
+    :return: 本次归档的记录数
+    """
+    import pyarrow as pa
+
+    start = datetime.combine(day, dtime.min)
+    end = start + timedelta(days=1)
+    total = 0
+    while True:
+        rows = (
+            db.query(
+                DetectionRecord.id, DetectionRecord.filename, DetectionRecord.model_type,
+                DetectionRecord.object_count, DetectionRecord.created_at, DetectionRecord.details,
+            )
+            .filter(DetectionRecord.created_at >= start, DetectionRecord.created_at < end)
+            .order_by(DetectionRecord.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        _write_parquet_atomic(_rows_to_table(pa, rows), os.path.join(partition_dir(day), f"part-{rows[0].id}.parquet"))
+
+        ids = [r.id for r in rows]
+        db.execute(delete(RecordClassCount).where(RecordClassCount.record_id.in_(ids)))
+        db.execute(delete(DetectionRecord).where(DetectionRecord.id.in_(ids)))
+        rollups.bump_version(db)
+        db.commit()
+        total += len(ids)
+        # 每批之间让出数据库，避免长时间占用锁
+        if pause:
+            time.sleep(pause)
+    return total
+
+
+def run_retention(db: Session, days: int, batch_size=RETENTION_BATCH_SIZE, dry_run=False, log=print):
+    """
+    归档并删除 days 天之前的原始记录 (按天从旧到新处理)
+    :return: 归档的记录数
+    """
+    cutoff = datetime.combine(date.today() - timedelta(days=days), dtime.min)
+
+    # 删除前必须保证汇总表已覆盖这些记录，否则统计结果会丢失历史
+    if not rollups.rollups_ready(db):
+        log("📊 汇总表尚未回填完成，先执行回填...")
+        rollups.backfill(db, log=log)
+
+    total = 0
+    while True:
+        oldest = (
+            db.query(func.min(DetectionRecord.created_at))
+            .filter(DetectionRecord.created_at < cutoff)
+            .scalar()
+        )
+        db.commit()
+        if oldest is None:
+            break
+        day = oldest.date()
+        if dry_run:
+            count = db.query(func.count(DetectionRecord.id)).filter(DetectionRecord.created_at < cutoff).scalar()
+            log(f"  [dry-run] {cutoff:%Y-%m-%d} 之前共有 {count} 条记录待归档 (最早 {day})")
+            return count
+        archived = archive_day(db, day, batch_size=batch_size)
+        total += archived
+        log(f"  已归档 {day}: {archived} 条 (累计 {total} 条)")
+    return total
+
+
+def archived_days(start_date=None, end_date=None):
+    """已归档的日期分区 (升序)"""
+    days = []
+    for path in glob.glob(os.path.join(RECORDS_ARCHIVE_DIR, "dt=*")):
+        try:
+            day = date.fromisoformat(os.path.basename(path)[3:])
+        except ValueError:
+            continue
+        if (start_date and day < start_date) or (end_date and day > end_date):
+            continue
+        days.append(day)
+    return sorted(days)
+
+
+def _partition_files(day: date):
+    return sorted(
+        glob.glob(os.path.join(partition_dir(day), "*.parquet")),
+        key=lambda p: int(os.path.basename(p).split("-")[1].split(".")[0]),
+    )
+
+
+def compact_archive(log=print):
+    """把每个日期分区内的多个小文件合并为一个 (按 id 去重)"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    compacted = 0
+    for day in archived_days():
+        files = _partition_files(day)
+        if len(files) <= 1:
+            continue
+        table = pa.concat_tables([pq.read_table(f, schema=_archive_schema(pa)) for f in files])
+        table = table.take(pc.sort_indices(table, [("id", "ascending")]))
+        # 中断的合并可能留下重复行，按 id 去重
+        ids = table.column("id").to_pylist()
+        keep = [i for i in range(len(ids)) if i == 0 or ids[i] != ids[i - 1]]
+        table = table.take(pa.array(keep))
+
+        target = os.path.join(partition_dir(day), f"part-{ids[0]}.parquet")
+        _write_parquet_atomic(table, target)
+        for f in files:
+            if f != target:
+                os.remove(f)
+        compacted += 1
+        log(f"  已合并 {day}: {len(files)} 个文件 -> 1 个 ({table.num_rows} 条)")
+    return compacted
+
+
+def iter_archive_chunks(chunk_size, start_date=None, end_date=None, category=None):
+    """
+    按天读取归档记录，产出与 export_service.iter_record_chunks 相同结构的字典列表
+    同一分区内按 id 去重 (合并中断时可能存在重复行)
+    """
+    import pyarrow.parquet as pq
+
+    marker = f"({category}/" if category else None
+    for day in archived_days(start_date, end_date):
+        seen = set()
+        for path in _partition_files(day):
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+                rows = []
+                for r in batch.to_pylist():
+                    if r["id"] in seen or (marker and marker not in (r["model_type"] or "")):
+                        continue
+                    seen.add(r["id"])
+                    r["details"] = json.loads(r["details"]) if r["details"] else None
+                    rows.append(r)
+                if rows:
+                    yield rows
@@ -0,0 +1,159 @@
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from models import DetectionRecord, RecordClassCount, DailyRollup, DailyClassRollup, RollupState, DataVersion
+
+STATE_NAME = "records"
+
+# 回填完成后不会再回退，进程内缓存即可
+_ready_cache = {"ready": False}
+
+
+def _dialect_insert(db: Session, table):
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect, dialect_insert(table)
+
+
+def upsert_add(db: Session, table, rows, key_cols, add_cols, max_cols=()):
+    """
+    批量 upsert：主键冲突时 add_cols 累加、max_cols 取较大值
+    MySQL 使用 ON DUPLICATE KEY UPDATE，SQLite/PostgreSQL 使用 ON CONFLICT
+    """
+    if not rows:
+        return
+    dialect, stmt = _dialect_insert(db, table)
+    if dialect == "mysql":
+        new = stmt.inserted
+        greatest = func.greatest
+    else:
+        new = stmt.excluded
+        greatest = func.greatest if dialect == "postgresql" else func.max
+    update = {c: table.c[c] + new[c] for c in add_cols}
+    update.update({c: greatest(table.c[c], new[c]) for c in max_cols})
+    if dialect == "mysql":
+        stmt = stmt.on_duplicate_key_update(**update)
+    else:
+        stmt = stmt.on_conflict_do_update(index_elements=list(key_cols), set_=update)
+    db.execute(stmt, rows)
+
+
+def insert_ignore(db: Session, table, row):
+    """插入一行，主键已存在时忽略"""
+    dialect, stmt = _dialect_insert(db, table)
+    if dialect == "mysql":
+        stmt = stmt.prefix_with("IGNORE")
+    else:
+        stmt = stmt.on_conflict_do_nothing()
+    db.execute(stmt, row)
+
+
+def apply_rollups(db: Session, records):
+    """
+    在当前事务内为新写入的记录生成类别明细并累加汇总表
+    :param records: 已分配 id 的记录 (ORM 对象或具备同名属性的行)
+    """
+    class_rows = []
+    daily = {}
+    daily_class = {}
+    for r in records:
+        key = (r.created_at.date(), r.model_type or "")
+        agg = daily.setdefault(key, {"tasks": 0, "objects": 0, "latest_at": r.created_at})
+        agg["tasks"] += 1
+        agg["objects"] += r.object_count or 0
+        agg["latest_at"] = max(agg["latest_at"], r.created_at)
+
+        details = r.details if isinstance(r.details, dict) else {}
+        for name, cnt in details.items():
+            class_rows.append({
+                "record_id": r.id,
+                "class_name": name,
+                "count": cnt,
+                "model_type": r.model_type,
+                "created_at": r.created_at,
+            })
+            ckey = key + (name,)
+            daily_class[ckey] = daily_class.get(ckey, 0) + cnt
+
+    if class_rows:
+        db.execute(insert(RecordClassCount), class_rows)
+    upsert_add(
+        db, DailyRollup.__table__,
+        [{"day": d, "model_type": m, **agg} for (d, m), agg in daily.items()],
+        key_cols=("day", "model_type"), add_cols=("tasks", "objects"), max_cols=("latest_at",)
+    )
+    upsert_add(
+        db, DailyClassRollup.__table__,
+        [{"day": d, "model_type": m, "class_name": c, "count": n} for (d, m, c), n in daily_class.items()],
+        key_cols=("day", "model_type", "class_name"), add_cols=("count",)
+    )
+
+
+def bump_version(db: Session, name: str = STATE_NAME):
+    """在当前事务内递增数据版本号，使统计接口缓存失效"""
+    upsert_add(db, DataVersion.__table__, [{"name": name, "version": 1}], key_cols=("name",), add_cols=("version",))
+
+
+def mark_live(db: Session, first_id: int):
+    """记录实时汇总的起点 (只在第一次写入时生效)"""
+    if _ready_cache["ready"]:
+        return
+    insert_ignore(db, RollupState.__table__, {
+        "name": STATE_NAME, "live_since_id": first_id, "backfilled_upto": 0
+    })
+
+
+def rollups_ready(db: Session) -> bool:
+    """汇总表是否已覆盖全部历史记录 (未回填完成时聚合查询回退到原始表)"""
+    if _ready_cache["ready"]:
+        return True
+    state = db.get(RollupState, STATE_NAME)
+    if state is None:
+        # 还没有任何实时写入：没有历史记录时可以直接使用汇总表
+        ready = db.query(DetectionRecord.id).first() is None
+    else:
+        ready = state.backfilled_upto >= state.live_since_id - 1
+    _ready_cache["ready"] = ready and state is not None
+    return ready
+
+
+def backfill(db: Session, batch_size=1000, log=print):
+    """为汇总表上线前的历史记录回填类别明细与汇总 (可中断，重复执行会从上次进度继续)"""
+    state = db.get(RollupState, STATE_NAME)
+    if state is None:
+        max_id = db.query(func.max(DetectionRecord.id)).scalar() or 0
+        insert_ignore(db, RollupState.__table__, {
+            "name": STATE_NAME, "live_since_id": max_id + 1, "backfilled_upto": 0
+        })
+        db.commit()
+        state = db.get(RollupState, STATE_NAME)
+
+    total = 0
+    while state.backfilled_upto < state.live_since_id - 1:
+        rows = (
+            db.query(
+                DetectionRecord.id, DetectionRecord.model_type, DetectionRecord.created_at,
+                DetectionRecord.object_count, DetectionRecord.details
+            )
+            .filter(DetectionRecord.id > state.backfilled_upto, DetectionRecord.id < state.live_since_id)
+            .order_by(DetectionRecord.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            state.backfilled_upto = state.live_since_id - 1
+            db.commit()
+            break
+        apply_rollups(db, [r for r in rows if r.created_at is not None])
+        bump_version(db)
+        # 进度与汇总在同一事务内提交，中断后重跑不会重复累加
+        state.backfilled_upto = rows[-1].id
+        db.commit()
+        total += len(rows)
+        log(f"  已回填至 id={state.backfilled_upto} (累计 {total} 条)")
+    return total
@@ -0,0 +1,232 @@
+"""
+推理请求调度 (准入控制 + 优先级)
+- 优先级: interactive (单张图片) > video (视频帧) > batch (SAHI 等耗时请求)
+- 全局并发与单模型并发分别限制，空出的名额按优先级分配；等待过久的请求逐级提升优先级，批量请求不会被饿死
+- 排队数量有上限，排满时直接拒绝 (路由返回 429 + Retry-After)，而不是让请求无限堆积
+- 视频帧只关心最新画面：排队超过 VIDEO_FRAME_MAX_WAIT 或被同一会话的新帧取代时直接丢弃
+- 同一优先级内按用户做加权公平排队 (按虚拟结束时间排序，每个请求计 1 份)：
+  一个用户连续发送大量请求时，其他用户的请求插在它前面，而不是排在队尾
+调度状态只在事件循环线程中读写，不需要加锁；每个进程各自调度
+"""
+import asyncio
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+
+from config import (
+    INFERENCE_MAX_CONCURRENCY,
+    INFERENCE_MODEL_CONCURRENCY,
+    INFERENCE_QUEUE_MAX,
+    INFERENCE_AGING_SECONDS,
+    VIDEO_FRAME_MAX_WAIT,
+)
+from services.metrics import metrics
+from services.cancellation import InferenceCancelled
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_VIDEO = "video"
+PRIORITY_BATCH = "batch"
+PRIORITIES = {PRIORITY_INTERACTIVE: 0, PRIORITY_VIDEO: 1, PRIORITY_BATCH: 2}
+
+
+class SchedulerFull(Exception):
+    """排队已满"""
+
+    def __init__(self, retry_after):
+        super().__init__("推理队列已满")
+        self.retry_after = retry_after
+
+
+class FrameDropped(Exception):
+    """视频帧排队过久或已被同一会话的新帧取代"""
+
+
+class _Waiter:
+    __slots__ = ("priority", "rank", "seq", "start_tag", "finish_tag", "model_key", "session_id",
+                 "enqueued_at", "future", "timer")
+
+    def __init__(self, priority, seq, tags, model_key, session_id, future):
+        self.priority = priority
+        self.start_tag, self.finish_tag = tags
+        self.rank = PRIORITIES[priority]
+        self.seq = seq
+        self.model_key = model_key
+        self.session_id = session_id
+        self.enqueued_at = time.monotonic()
+        self.future = future
+        self.timer = None
+
+
+class InferenceScheduler:
+    def __init__(self, max_concurrency=INFERENCE_MAX_CONCURRENCY, model_concurrency=INFERENCE_MODEL_CONCURRENCY,
+                 max_queue=INFERENCE_QUEUE_MAX, aging_seconds=INFERENCE_AGING_SECONDS,
+                 frame_max_wait=VIDEO_FRAME_MAX_WAIT):
+        self.max_concurrency = max_concurrency
+        self.model_concurrency = model_concurrency
+        self.max_queue = max_queue
+        self.aging_seconds = aging_seconds
+        self.frame_max_wait = frame_max_wait
+        self._waiting = []
+        self._running = {}  # model_key -> 正在推理的请求数
+        self._active = 0
+        self._seq = itertools.count()
+        # 公平排队的虚拟时间，以及每个用户最后一个请求的结束标签
+        self._virtual_time = 0.0
+        self._last_finish = {}
+
+        metrics.gauge("scheduler.running", lambda: self._active)
+        for name in PRIORITIES:
+            metrics.gauge(f"scheduler.queued.{name}", lambda name=name: self.queued(name))
+
+    def queued(self, priority=None):
+        return sum(1 for w in self._waiting if priority is None or w.priority == priority)
+
+    def is_full(self):
+        """排队已满 (新请求需要排队时会被拒绝)"""
+        return len(self._waiting) >= self.max_queue
+
+    def _has_capacity(self, model_key):
+        return (self._active < self.max_concurrency
+                and self._running.get(model_key, 0) < self.model_concurrency)
+
+    def _start(self, model_key):
+        self._active += 1
+        self._running[model_key] = self._running.get(model_key, 0) + 1
+
+    def retry_after(self):
+        """按平均推理耗时估算排队清空所需的秒数"""
+        avg = metrics.histogram("scheduler.service_seconds").snapshot()["avg"] or 1.0
+        return max(1, math.ceil(avg * (len(self._waiting) + self._active) / self.max_concurrency))
+
+    def _tags(self, user_key, weight):
+        """为用户的新请求分配 (开始标签, 结束标签)"""
+        start = max(self._virtual_time, self._last_finish.get(user_key, 0.0))
+        finish = start + 1.0 / weight
+        if user_key is not None:
+            self._last_finish[user_key] = finish
+            if len(self._last_finish) > 10000:
+                # 结束标签落后于虚拟时间的用户与新用户没有区别
+                self._last_finish = {k: f for k, f in self._last_finish.items() if f > self._virtual_time}
+        return start, finish
+
+    async def acquire(self, model_key, priority=PRIORITY_INTERACTIVE, session_id=None, user_key=None, weight=1.0,
+                      cancel=None):
+        """
+        等待一个推理名额；排满时抛出 SchedulerFull，视频帧被丢弃时抛出 FrameDropped，
+        排队期间 cancel 令牌被取消时立即移出队列并抛出 InferenceCancelled
+        :param user_key: 公平排队的用户标识，weight 为该用户角色的权重
+        """
+        if cancel is not None:
+            cancel.check()
+        if priority == PRIORITY_VIDEO and session_id:
+            # 同一会话只保留最新的一帧
+            for w in [w for w in self._waiting if w.session_id == session_id]:
+                self._drop(w, "superseded")
+
+        if not self._waiting and self._has_capacity(model_key):
+            self._virtual_time = self._tags(user_key, weight)[0]
+            self._start(model_key)
+            metrics.observe(f"scheduler.queue_wait.{priority}", 0.0)
+            return
+
+        if self.is_full():
+            metrics.inc(f"scheduler.rejected.{priority}")
+            raise SchedulerFull(self.retry_after())
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, next(self._seq), self._tags(user_key, weight), model_key, session_id,
+                         loop.create_future())
+        self._waiting.append(waiter)
+        if priority == PRIORITY_VIDEO:
+            waiter.timer = loop.call_later(self.frame_max_wait, self._drop, waiter, "stale")
+        if cancel is not None:
+            cancel.on_cancel(lambda: self._abandon(waiter, cancel.reason))
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            # 客户端断开：还在排队就移出队列；名额已分配但未开始执行则归还
+            if waiter in self._waiting:
+                self._remove(waiter)
+            elif waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                self.release(model_key)
+            raise
+        metrics.observe(f"scheduler.queue_wait.{priority}", time.monotonic() - waiter.enqueued_at)
+
+    def release(self, model_key):
+        self._active -= 1
+        self._running[model_key] -= 1
+        if not self._running[model_key]:
+            del self._running[model_key]
+        self._dispatch()
+
+    def _remove(self, waiter):
+        self._waiting.remove(waiter)
+        if waiter.timer is not None:
+            waiter.timer.cancel()
+
+    def _drop(self, waiter, reason):
+        if waiter not in self._waiting:
+            return
+        self._remove(waiter)
+        metrics.inc(f"scheduler.dropped_frames.{reason}")
+        if not waiter.future.done():
+            waiter.future.set_exception(FrameDropped(reason))
+
+    def _abandon(self, waiter, reason):
+        """排队中的请求被取消 (客户端断开 / 超时)：立即让出排队位置"""
+        if waiter not in self._waiting:
+            return
+        self._remove(waiter)
+        metrics.inc(f"scheduler.abandoned.{waiter.priority}")
+        if not waiter.future.done():
+            waiter.future.set_exception(InferenceCancelled(reason))
+
+    def _dispatch(self):
+        """把空出的名额按 (老化后的优先级, 公平排队标签, 到达顺序) 分配给可以运行的请求"""
+        now = time.monotonic()
+        while self._waiting and self._active < self.max_concurrency:
+            runnable = [w for w in self._waiting if self._has_capacity(w.model_key)]
+            if not runnable:
+                return
+            waiter = min(runnable, key=lambda w: (
+                w.rank - int((now - w.enqueued_at) / self.aging_seconds), w.finish_tag, w.seq
+            ))
+            self._remove(waiter)
+            if waiter.future.done():
+                # 已被取消 (客户端断开)
+                continue
+            self._virtual_time = max(self._virtual_time, waiter.start_tag)
+            self._start(waiter.model_key)
+            waiter.future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, model_key, priority=PRIORITY_INTERACTIVE, session_id=None, user_key=None, weight=1.0,
+                   cancel=None):
+        """async with scheduler.slot(...): 在名额内执行推理，结束后自动归还"""
+        await self.acquire(model_key, priority, session_id, user_key, weight, cancel)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            metrics.observe("scheduler.service_seconds", time.perf_counter() - started)
+            self.release(model_key)
+
+
+def classify_priority(requested, use_sahi, session_id, privileged=False):
+    """
+    由服务端按请求类型分级：视频会话的帧为 video，SAHI 为 batch，其余为 interactive
+    客户端指定的优先级只能用来降级 (例如脚本批量提交的普通请求)，管理员 (privileged) 可以任意指定
+    """
+    if session_id:
+        default = PRIORITY_VIDEO
+    else:
+        default = PRIORITY_BATCH if use_sahi else PRIORITY_INTERACTIVE
+    if requested in PRIORITIES and (privileged or PRIORITIES[requested] >= PRIORITIES[default]):
+        return requested
+    return default
+
+
+# 创建全局单例
+scheduler = InferenceScheduler()
@@ -0,0 +1,123 @@
+import gzip
+import json
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+from config import RESPONSE_COMPRESS_MIN_BYTES
+from services.metrics import metrics
+
+# 可选依赖：未安装时分别回退到标准库 json / 只返回 JSON / 只使用 gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+def _default(value):
+    """orjson / json / msgpack 都不认识的类型"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, "item"):  # numpy 标量
+        return value.item()
+    if hasattr(value, "tolist"):  # numpy 数组
+        return value.tolist()
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+def dumps(content) -> bytes:
+    """序列化为 JSON 字节串 (优先使用 orjson)"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def packb(content) -> bytes:
+    """序列化为 MessagePack (日期等类型转为字符串，与 JSON 一致)"""
+    return msgpack.packb(content, default=_default, use_bin_type=True)
+
+
+ENCODERS = {JSON_MEDIA_TYPE: dumps, MSGPACK_MEDIA_TYPE: packb}
+
+
+class FastJSONResponse(JSONResponse):
+    """用 orjson 渲染的 JSONResponse，作为应用的默认响应类"""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def negotiate_media_type(request: Request) -> str:
+    """客户端在 Accept 中声明 application/msgpack 且服务端已安装 msgpack 时返回 MessagePack"""
+    if msgpack is not None and MSGPACK_MEDIA_TYPE in request.headers.get("accept", ""):
+        return MSGPACK_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+
+def encode(content, media_type: str = JSON_MEDIA_TYPE) -> bytes:
+    started = time.perf_counter()
+    body = ENCODERS[media_type](content)
+    metrics.observe("response.encode_seconds", time.perf_counter() - started)
+    return body
+
+
+def compress(request: Request, body: bytes):
+    """
+    按 Accept-Encoding 压缩较大的响应体
+    :return: (body, content-encoding 或 None)
+    """
+    if len(body) < RESPONSE_COMPRESS_MIN_BYTES:
+        return body, None
+    accepted = request.headers.get("accept-encoding", "")
+    if brotli is not None and "br" in accepted:
+        return brotli.compress(body, quality=4), "br"
+    if "gzip" in accepted:
+        return gzip.compress(body, compresslevel=5), "gzip"
+    return body, None
+
+
+def build_response(request: Request, body: bytes, media_type: str, status_code=200, headers=None,
+                   compressible=True) -> Response:
+    """
+    把已编码的响应体按需压缩后包装为 Response
+    :param compressible: 以 base64 图像为主的响应压缩率很低 (约 25%) 且耗时较长，传 False 跳过压缩
+    """
+    headers = dict(headers or {})
+    body, encoding = compress(request, body) if compressible else (body, None)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        metrics.inc(f"response.compressed.{encoding}")
+    headers["Vary"] = "Accept, Accept-Encoding"
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
+
+
+def encode_response(request: Request, content, status_code=200, headers=None, compressible=True) -> Response:
+    """
+    直接返回 Response，跳过 FastAPI 的 jsonable_encoder 逐对象遍历
+    content 只应包含 dict / list / 基本类型 / 日期 (ORM 对象请先投影为字典)
+    """
+    media_type = negotiate_media_type(request)
+    return build_response(request, encode(content, media_type), media_type, status_code, headers, compressible)
+
+
+def sse_event(event: str, content) -> bytes:
+    """编码一条 Server-Sent Events 消息 (data 为单行 JSON)"""
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + dumps(content) + b"\n\n"
@@ -0,0 +1,195 @@
+"""
+SAHI 切片的多进程并行推理 (CPU 节点)
+- 常驻的推理进程池，每个进程各自缓存已加载的模型，只占 核数/进程数 个 torch 线程
+- 原图放入共享内存，各进程按切片坐标直接读取，不在进程间复制整张图
+- 各切片 (以及 SAHI 默认的整图推理) 的检测框汇总到主进程，由 DetectionEngine 按 SAHI 默认的 GREEDYNMM / IOS 0.5 合并
+单个大图请求的耗时随核数下降；通过 RS_SAHI_TILE_WORKERS 开启 (默认关闭，GPU 推理时不使用)
+"""
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from config import SAHI_TILE_WORKERS
+from services.metrics import metrics
+from services.cancellation import check
+from services.execution_plan import execution_plan
+
+# 推理进程内缓存的模型 (key: 模型路径, value: (文件 mtime, 模型))
+_models = {}
+
+
+def _available_cpus():
+    """
+    本进程可用的 CPU 核数：serve.py 按执行计划把每个 HTTP worker 绑定到一部分核上，
+    切片推理进程继承这个绑定，只能在这些核上分配线程
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return execution_plan.threads or os.cpu_count() or 1
+
+
+def _init_tile_worker(threads):
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+    import torch
+
+    torch.set_num_threads(threads)
+    torch.set_grad_enabled(False)
+
+
+def slice_boxes(width, height, slice_size=640, overlap=0.2):
+    """切片坐标 [x0, y0, x1, y1]；与 get_sliced_prediction 默认行为一致，多个切片时额外加一次整图推理"""
+    from sahi.slicing import get_slice_bboxes
+
+    boxes = get_slice_bboxes(
+        image_height=height, image_width=width,
+        slice_height=slice_size, slice_width=slice_size,
+        overlap_height_ratio=overlap, overlap_width_ratio=overlap,
+    )
+    if len(boxes) > 1:
+        boxes.append([0, 0, width, height])
+    return boxes
+
+
+def crop_tiles(image, boxes):
+    """从 RGB 原图复制出切片 (RGB -> BGR，与 SAHI 调用 ultralytics 时一致)"""
+    return [image[y0:y1, x0:x1, ::-1].copy() for x0, y0, x1, y1 in boxes]
+
+
+def predict_tiles(model, crops, boxes, conf, device):
+    """
+    对若干切片做一次 batch 推理
+    :return: [(xyxy 列表 (已平移到原图坐标), 置信度列表, 类别 id 列表), ...]，与 boxes 一一对应
+    """
+    results = model.predict(crops, conf=conf, device=device, verbose=False)
+    out = []
+    for (x0, y0, _, _), result in zip(boxes, results):
+        xyxy = result.boxes.xyxy.cpu().numpy()
+        xyxy[:, [0, 2]] += x0
+        xyxy[:, [1, 3]] += y0
+        out.append((xyxy.tolist(), result.boxes.conf.cpu().tolist(), result.boxes.cls.cpu().int().tolist()))
+    return out
+
+
+def to_object_predictions(names, tiles, full_shape):
+    """切片推理结果 -> SAHI ObjectPrediction 列表"""
+    from sahi.prediction import ObjectPrediction
+
+    predictions = []
+    for xyxy, scores, class_ids in tiles:
+        for box, score, class_id in zip(xyxy, scores, class_ids):
+            predictions.append(ObjectPrediction(
+                bbox=box, category_id=class_id, category_name=names[class_id],
+                score=score, full_shape=full_shape,
+            ))
+    return predictions
+
+
+def merge_predictions(predictions):
+    """按 SAHI 默认的 GREEDYNMM / IOS 0.5 (按类别) 合并重叠切片上的重复框"""
+    from sahi.postprocess.combine import GreedyNMMPostprocess
+
+    return GreedyNMMPostprocess(match_threshold=0.5, match_metric="IOS", class_agnostic=False)(predictions)
+
+
+def _predict_shared(shm_name, shape, model_path, conf, boxes):
+    """
+    推理进程：从共享内存读取原图的若干切片，一次 batch 推理
+    :return: (类别名字典, predict_tiles 的结果)
+    """
+    from multiprocessing.shared_memory import SharedMemory
+
+    # 权重文件被替换 (热更新) 后重新加载
+    mtime = os.stat(model_path).st_mtime_ns
+    cached = _models.get(model_path)
+    if cached is None or cached[0] != mtime:
+        from ultralytics import YOLO
+
+        cached = _models[model_path] = (mtime, YOLO(model_path))
+    model = cached[1]
+
+    shm = SharedMemory(name=shm_name)
+    try:
+        # 切片复制出来之后即可释放共享内存
+        crops = crop_tiles(np.ndarray(shape, dtype=np.uint8, buffer=shm.buf), boxes)
+    finally:
+        shm.close()
+    return model.names, predict_tiles(model, crops, boxes, conf, "cpu")
+
+
+class TilePool:
+    def __init__(self, workers=SAHI_TILE_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                import multiprocessing as mp
+
+                # 进程数不超过可用核数，各进程平分这些核，避免多个 worker 的进程池在同一组核上超额订阅
+                cpus = _available_cpus()
+                workers = min(self.workers, cpus)
+                threads = max(1, cpus // workers)
+                # spawn：子进程不继承本进程的数据库连接与 torch 线程池
+                self._executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=mp.get_context("spawn"),
+                    initializer=_init_tile_worker,
+                    initargs=(threads,),
+                )
+                print(f"🧩 已启动 SAHI 切片推理进程池: {workers} 个进程 × {threads} 线程 (可用 {cpus} 核)")
+            return self._executor
+
+    def iter_chunks(self, image, model_path, conf, chunks, cancel=None):
+        """
+        把各组切片分发到推理进程，按完成顺序产出 (切片组, 类别名字典, 推理结果)
+        请求被取消或生成器提前关闭时取消尚未开始的切片，并释放共享内存
+        """
+        from multiprocessing.shared_memory import SharedMemory
+
+        started = time.perf_counter()
+        executor = self._get_executor()
+        shm = SharedMemory(create=True, size=image.nbytes)
+        futures = {}
+        try:
+            np.ndarray(image.shape, dtype=np.uint8, buffer=shm.buf)[:] = image
+            for chunk in chunks:
+                future = executor.submit(_predict_shared, shm.name, image.shape, model_path, conf, chunk)
+                futures[future] = chunk
+            for future in as_completed(futures):
+                check(cancel)
+                names, tiles = future.result()
+                yield futures[future], names, tiles
+        except BrokenProcessPool:
+            # 推理进程异常退出，下次请求时重建进程池
+            with self._lock:
+                self._executor = None
+            raise RuntimeError("SAHI 切片推理进程异常退出")
+        finally:
+            for future in futures:
+                future.cancel()
+            # 提前关闭时仍在执行的切片：已打开的映射在 unlink 后仍然有效，未打开的会失败，其结果本来也会被丢弃
+            shm.close()
+            shm.unlink()
+            metrics.inc("sahi.tile_pool.tiles", sum(len(c) for c in chunks))
+            metrics.observe("sahi.tile_pool.seconds", time.perf_counter() - started)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+
+# 创建全局单例
+tile_pool = TilePool()
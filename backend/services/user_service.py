@@ -5,6 +5,8 @@ from sqlalchemy.orm import Session
 from backend.models import User 
 from typing import List, Optional
 from datetime import datetime
+from services.principal_cache import principal_cache, REVOCATION_VERSION
+from services.rollups import bump_version
 
 # --- 辅助函数：格式化用户数据以便前端显示 ---
 def format_user_for_admin(user: User):
@@ -33,8 +35,12 @@ def update_user_role(db: Session, username: str, new_role: str) -> bool:
     if user:
         if new_role not in ["user", "admin"]: return False # 角色无效
         user.role = new_role
+        # 同一事务内递增撤销版本号，其他进程据此清空缓存
+        bump_version(db, REVOCATION_VERSION)
         db.commit()
         db.refresh(user)
+        # 让已登录的 Token 立即按新角色鉴权
+        principal_cache.invalidate(username)
         return True
     return False
 
@@ -43,6 +49,8 @@ def delete_user_by_username(db: Session, username: str) -> bool:
     user = get_user_by_username(db, username)
     if user:
         db.delete(user)
+        bump_version(db, REVOCATION_VERSION)
         db.commit()
+        principal_cache.invalidate(username)
         return True
     return False
\ No newline at end of file
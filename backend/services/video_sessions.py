@@ -0,0 +1,336 @@
+import base64
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from config import VIDEO_SESSION_IDLE_TIMEOUT, VIDEO_SESSION_STATE_PATH
+from database import SessionLocal
+from models import VideoSession
+from services.record_writer import record_writer
+
+
+# ---------- 时间序列紧凑编码 ----------
+# 每秒一个采样点，先做差分，再做 zigzag + varint 编码，最后转 base64
+# 遥感视频中目标数量变化平缓，差分后大多是 0/±1，每个采样点通常只占 1 字节
+
+def encode_series(values):
+    """整数序列 -> base64 字符串"""
+    out = bytearray()
+    prev = 0
+    for v in values:
+        delta = int(v) - prev
+        prev = int(v)
+        zz = (delta << 1) ^ (delta >> 63)  # zigzag
+        while True:
+            byte = zz & 0x7F
+            zz >>= 7
+            if zz:
+                out.append(byte | 0x80)
+            else:
+                out.append(byte)
+                break
+    return base64.b64encode(bytes(out)).decode("ascii")
+
+
+def decode_series(encoded):
+    """base64 字符串 -> 整数序列"""
+    values = []
+    prev = 0
+    shift = zz = 0
+    for byte in base64.b64decode(encoded):
+        zz |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        prev += (zz >> 1) ^ -(zz & 1)
+        values.append(prev)
+        shift = zz = 0
+    return values
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    filename TEXT,
+    model_type TEXT,
+    started_at REAL NOT NULL,
+    first_ts REAL NOT NULL,
+    last_ts REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    frames INTEGER NOT NULL DEFAULT 0,
+    objects_sum INTEGER NOT NULL DEFAULT 0,
+    max_objects INTEGER NOT NULL DEFAULT 0,
+    claimed_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_last_seen ON sessions (last_seen);
+CREATE TABLE IF NOT EXISTS session_classes (
+    session_id TEXT NOT NULL,
+    class_name TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    max_count INTEGER NOT NULL,
+    PRIMARY KEY (session_id, class_name)
+);
+CREATE TABLE IF NOT EXISTS session_seconds (
+    session_id TEXT NOT NULL,
+    second INTEGER NOT NULL,
+    class_name TEXT NOT NULL,
+    max_count INTEGER NOT NULL,
+    PRIMARY KEY (session_id, second, class_name)
+);
+"""
+
+# 正在汇总的会话被认领的时长 (秒)：认领的进程在此期间崩溃时，其他进程可以重新认领
+_CLAIM_SECONDS = 60
+
+
+class _SessionState:
+    """从共享状态读出的会话聚合结果"""
+
+    def __init__(self, row, classes, seconds):
+        self.session_id = row["session_id"]
+        self.filename = row["filename"]
+        self.model_type = row["model_type"]
+        self.started_at = datetime.fromtimestamp(row["started_at"])
+        self.first_ts = row["first_ts"]
+        self.last_ts = row["last_ts"]
+        self.frames = row["frames"]
+        self.objects_sum = row["objects_sum"]
+        self.max_objects = row["max_objects"]
+        self.class_sum = {r["class_name"]: r["total"] for r in classes}
+        self.class_max = {r["class_name"]: r["max_count"] for r in classes}
+        self.seconds = {}  # 秒 -> {类别: 该秒内单帧最大值}
+        for r in seconds:
+            self.seconds.setdefault(r["second"], {})[r["class_name"]] = r["max_count"]
+
+
+class VideoSessionAggregator:
+    """
+    视频会话聚合器
+    同一会话的帧累加到本机共享的 SQLite (多 worker 部署时同一会话的帧会落到不同进程)，
+    会话结束 (显式结束或空闲超时) 时在主数据库写入一行汇总，提交成功后才删除聚合状态
+    """
+
+    def __init__(self, db_path=VIDEO_SESSION_STATE_PATH, idle_timeout=VIDEO_SESSION_IDLE_TIMEOUT):
+        self.db_path = db_path
+        self.idle_timeout = idle_timeout
+        self._initialized = False
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._stopped = threading.Event()
+
+    @contextmanager
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            if not self._initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                self._initialized = True
+            yield conn
+        finally:
+            conn.close()
+
+    def add_frame(self, session_id, filename, model_type, stats, frame_time=None):
+        """累加一帧的检测结果 (一个写事务)"""
+        self._ensure_sweeper()
+        frame_total = sum(stats.values())
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT first_ts, last_ts, last_seen FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if frame_time is None:
+                    # 客户端未提供帧时间戳时，按服务端收到的时间计算
+                    frame_time = now - row["last_seen"] + row["last_ts"] if row else 0.0
+                if row is None:
+                    conn.execute(
+                        "INSERT INTO sessions (session_id, filename, model_type, started_at, first_ts, last_ts, "
+                        "last_seen) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (session_id, filename, model_type, now, frame_time, frame_time, now),
+                    )
+                    first_ts = frame_time
+                else:
+                    first_ts = row["first_ts"]
+                conn.execute(
+                    "UPDATE sessions SET last_ts = MAX(last_ts, ?), last_seen = ?, frames = frames + 1, "
+                    "objects_sum = objects_sum + ?, max_objects = MAX(max_objects, ?) WHERE session_id = ?",
+                    (frame_time, now, frame_total, frame_total, session_id),
+                )
+                second = max(0, int(frame_time - first_ts))
+                for name, cnt in stats.items():
+                    conn.execute(
+                        "INSERT INTO session_classes (session_id, class_name, total, max_count) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(session_id, class_name) DO UPDATE SET total = total + excluded.total, "
+                        "max_count = MAX(max_count, excluded.max_count)",
+                        (session_id, name, cnt, cnt),
+                    )
+                    conn.execute(
+                        "INSERT INTO session_seconds (session_id, second, class_name, max_count) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(session_id, second, class_name) DO UPDATE SET "
+                        "max_count = MAX(max_count, excluded.max_count)",
+                        (session_id, second, name, cnt),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def end(self, session_id):
+        """结束会话并持久化，返回汇总；会话不存在 (或正由其他进程汇总) 时返回 None"""
+        state = self._claim(session_id)
+        if state is None:
+            return None
+        return self._persist(state)
+
+    def stop(self):
+        """
+        停止空闲会话检查 (进程退出前调用)
+        进行中的会话可能还在其他 worker 接收帧，不在这里结束；全部进程退出后由下次启动的进程按空闲超时汇总
+        """
+        self._stopped.set()
+
+    def _claim(self, session_id):
+        """认领会话并读出聚合状态；其他进程已认领 (且未超时) 时返回 None"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                claimed = conn.execute(
+                    "UPDATE sessions SET claimed_at = ? WHERE session_id = ? "
+                    "AND (claimed_at IS NULL OR claimed_at < ?)",
+                    (now, session_id, now - _CLAIM_SECONDS),
+                ).rowcount
+                if not claimed:
+                    conn.execute("COMMIT")
+                    return None
+                row = conn.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+                classes = conn.execute(
+                    "SELECT class_name, total, max_count FROM session_classes WHERE session_id = ?", (session_id,)
+                ).fetchall()
+                seconds = conn.execute(
+                    "SELECT second, class_name, max_count FROM session_seconds WHERE session_id = ?", (session_id,)
+                ).fetchall()
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return _SessionState(row, classes, seconds)
+
+    def _release(self, session_id):
+        with self._connect() as conn:
+            conn.execute("UPDATE sessions SET claimed_at = NULL WHERE session_id = ?", (session_id,))
+
+    def _discard(self, session_id):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for table in ("sessions", "session_classes", "session_seconds"):
+                conn.execute(f"DELETE FROM {table} WHERE session_id = ?", (session_id,))
+            conn.execute("COMMIT")
+
+    def start(self):
+        """启动空闲会话检查 (进程启动时调用，汇总上次退出时遗留的会话)"""
+        self._ensure_sweeper()
+
+    def _ensure_sweeper(self):
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        with self._lock:
+            if self._sweeper is not None and self._sweeper.is_alive():
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="video-session-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self):
+        while not self._stopped.wait(min(self.idle_timeout, 10)):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"⚠️ 视频会话检查失败: {e}")
+
+    def sweep(self):
+        """汇总空闲超时的会话 (包括上次进程退出时遗留的会话)"""
+        deadline = time.time() - self.idle_timeout
+        with self._connect() as conn:
+            idle = [r["session_id"] for r in conn.execute(
+                "SELECT session_id FROM sessions WHERE last_seen < ?", (deadline,)
+            )]
+        for session_id in idle:
+            state = self._claim(session_id)
+            if state is None:
+                continue
+            try:
+                self._persist(state)
+            except Exception as e:
+                print(f"⚠️ 视频会话汇总写入失败 {session_id}: {e}")
+
+    @staticmethod
+    def summarize(state):
+        frames = max(state.frames, 1)
+        span = max(state.seconds) + 1 if state.seconds else 0
+        timeline = {
+            "interval": 1,
+            "length": span,
+            "classes": {
+                name: encode_series(state.seconds.get(sec, {}).get(name, 0) for sec in range(span))
+                for name in state.class_max
+            },
+        }
+        return {
+            "session_id": state.session_id,
+            "filename": state.filename,
+            "model_type": state.model_type,
+            "frame_count": state.frames,
+            "duration": round(state.last_ts - (state.first_ts or 0.0), 3),
+            "max_objects": state.max_objects,
+            "avg_objects": round(state.objects_sum / frames, 3),
+            "class_max": dict(state.class_max),
+            "class_avg": {k: round(v / frames, 3) for k, v in state.class_sum.items()},
+            "timeline": timeline,
+            "started_at": state.started_at,
+            "ended_at": datetime.now(),
+        }
+
+    def _persist(self, state):
+        """写入汇总；失败时释放认领，聚合状态保留，由空闲检查重试"""
+        summary = self.summarize(state)
+        db = SessionLocal()
+        try:
+            db.add(VideoSession(**summary))
+            db.commit()
+        except IntegrityError:
+            # 上次已写入汇总、但删除聚合状态前进程退出
+            db.rollback()
+            self._discard(state.session_id)
+            return summary
+        except Exception:
+            db.rollback()
+            self._release(state.session_id)
+            raise
+        finally:
+            db.close()
+        self._discard(state.session_id)
+
+        # records 表中每个会话只保留一行，details 为各类别单帧最大值，供大屏统计
+        record_writer.submit({
+            "filename": state.filename,
+            "model_type": f"{state.model_type} [Video]",
+            "object_count": summary["max_objects"],
+            "details": summary["class_max"],
+            "created_at": state.started_at,
+        })
+        print(f"🎞️ 视频会话已汇总: {state.session_id} ({state.frames} 帧)")
+        return summary
+
+
+# 创建全局单例
+video_sessions = VideoSessionAggregator()
@@ -0,0 +1,92 @@
+"""
+权重目录监视 (轮询)
+- 每个进程各自监视自己已加载的模型：文件被替换后在后台加载并预热新版本，完成后原子替换引擎缓存，
+  进行中的请求继续使用旧模型；文件被删除时直接移出缓存
+- 基准签名在模型进入缓存时记录 (加载前读取)，加载后第一次轮询之前替换的文件同样会被发现；
+  监视的是引擎实际加载的文件路径 (缓存 key 中的文件名可能带路径)
+- 文件签名 (mtime, 大小, inode) 连续两次轮询一致才加载，手动拷贝到一半的文件不会被读取
+  (管理后台上传本身是先写临时文件再 rename 的原子替换)
+"""
+import os
+import threading
+import time
+
+from config import WEIGHTS_POLL_INTERVAL
+from services.metrics import metrics
+
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class WeightsWatcher:
+    def __init__(self, engine, interval=WEIGHTS_POLL_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        self._known = {}    # 缓存中模型加载时的文件签名
+        self._pending = {}  # 已发现变化、等待确认写完的文件签名
+        self._pid = None
+
+    def start(self):
+        """
+        启动监视线程 (fork 出的子进程不继承线程，按进程判断)
+        子进程继承的签名与继承的模型缓存一致，不需要清空
+        """
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, name="weights-watcher", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"⚠️ 权重目录检查失败: {e}")
+
+    def track(self, cache_key, signature):
+        """模型进入缓存时记录加载前读取的文件签名 (之后的变化与它比较)"""
+        self._known[cache_key] = signature
+        self._pending.pop(cache_key, None)
+
+    def poll(self):
+        for cache_key, model_path in list(self.engine.model_paths.items()):
+            category, model_name = cache_key.split("/", 1)
+            sig = file_signature(model_path)
+            if sig is None:
+                self._pending.pop(cache_key, None)
+                self._known.pop(cache_key, None)
+                if self.engine.evict(category, model_name):
+                    print(f"🗑️ 模型文件已删除，移出缓存: {cache_key}")
+                continue
+            known = self._known.setdefault(cache_key, sig)
+            if sig == known:
+                self._pending.pop(cache_key, None)
+            elif self._pending.get(cache_key) != sig:
+                # 第一次看到新签名，下次轮询仍一致时再加载
+                self._pending[cache_key] = sig
+            else:
+                del self._pending[cache_key]
+                self._known[cache_key] = sig
+                self._reload(cache_key, category, model_name)
+        for cache_key in list(self._known):
+            if cache_key not in self.engine.model_paths:
+                del self._known[cache_key]
+                self._pending.pop(cache_key, None)
+
+    def _reload(self, cache_key, category, model_name):
+        started = time.perf_counter()
+        try:
+            self.engine.reload_model(category, model_name)
+        except Exception as e:
+            # 新文件无法加载时继续使用旧模型
+            metrics.inc("model.reload_failed")
+            print(f"❌ 模型热更新失败，继续使用旧版本 {cache_key}: {e}")
+            return
+        metrics.inc("model.reloads")
+        print(f"🔄 模型已热更新: {cache_key} ({time.perf_counter() - started:.1f}s)")
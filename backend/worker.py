@@ -0,0 +1,138 @@
+"""
+异步检测任务 worker
+单独运行: python backend/worker.py --workers 2
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import argparse
+import multiprocessing as mp
+import signal
+import socket
+import time
+
+from config import JOB_WORKERS, JOB_POLL_INTERVAL
+
+
+def worker_loop(worker_index, stop_event):
+    """worker 进程主循环：领取任务 -> 推理 -> 写库 -> 保存结果"""
+    # 推理相关模块只在 worker 进程内导入，导入前先应用 CPU 执行计划
+    from services.execution_plan import execution_plan
+    execution_plan.apply_process()
+    from services.job_queue import job_queue
+    from services.detection_service import process_detection
+    from services.record_writer import record_writer
+    from services.quotas import quota_manager
+    from services.model_registry import model_registry, TASK_INSPECT_MODEL
+    from services.engine import preload_runtime
+
+    # worker 只做推理，启动时就导入推理依赖
+    preload_runtime()
+
+    # 忽略 Ctrl+C，由主进程通过 stop_event 统一关闭
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{worker_index}"
+    print(f"👷 任务 worker 已启动: {worker_id}")
+
+    last_purge = 0.0
+    while not stop_event.is_set():
+        if time.time() - last_purge > 3600:
+            job_queue.purge_expired()
+            last_purge = time.time()
+
+        job = job_queue.claim(worker_id)
+        if job is None:
+            stop_event.wait(JOB_POLL_INTERVAL)
+            continue
+
+        params = job["params"]
+        if params.get("task") == TASK_INSPECT_MODEL:
+            # 上传模型后读取元数据并实测延迟 (结果写入模型注册表)
+            try:
+                info = model_registry.inspect(params["category"], params["name"], device=execution_plan.device)
+                job_queue.complete(job["id"], info)
+            except Exception as e:
+                print(f"⚠️ 模型元数据读取失败 {params['category']}/{params['name']}: {e}")
+                job_queue.fail(job["id"], str(e), retry=False)
+            continue
+
+        try:
+            contents = job_queue.load_input(job)
+            started = time.perf_counter()
+            try:
+                result, record = process_detection(contents, job["filename"], **params)
+            finally:
+                # 按实际推理耗时扣除提交者的配额 (由接收请求的进程从令牌桶中扣除)
+                if job["user_key"]:
+                    elapsed = time.perf_counter() - started
+                    quota_manager.charge(job["user_key"], job["role"], elapsed, shared=True)
+                    quota_manager.record(job["user_key"], job["role"], inference_seconds=elapsed)
+            record_writer.submit(record)
+            job_queue.complete(job["id"], result)
+        except ValueError as ve:
+            # 参数错误 (例如模型不存在)，重试没有意义
+            job_queue.fail(job["id"], str(ve), retry=False)
+        except Exception as e:
+            print(f"❌ 任务执行失败 {job['id']}: {e}")
+            job_queue.fail(job["id"], str(e), retry=True)
+
+    record_writer.stop()
+    quota_manager.flush()
+    print(f"🛑 任务 worker 已退出: {worker_id}")
+
+
+def start_workers(count=JOB_WORKERS):
+    """启动 worker 进程，返回 (进程列表, 停止事件)"""
+    # 使用 spawn，避免 fork 时继承父进程的数据库连接和 CUDA 上下文
+    ctx = mp.get_context("spawn")
+    stop_event = ctx.Event()
+    processes = [_spawn(ctx, i, stop_event) for i in range(count)]
+    return processes, stop_event
+
+
+def _spawn(ctx, index, stop_event):
+    p = ctx.Process(target=worker_loop, args=(index, stop_event), name=f"job-worker-{index}", daemon=True)
+    p.start()
+    p.started_at = time.time()
+    return p
+
+
+def restart_exited(processes, stop_event):
+    """重新启动已退出的 worker 进程 (原地替换列表中的进程)，返回重启的个数"""
+    restarted = 0
+    ctx = mp.get_context("spawn")
+    for i, p in enumerate(processes):
+        if p.is_alive() or stop_event.is_set():
+            continue
+        print(f"⚠️ 任务 worker {p.pid} 已退出 (exitcode={p.exitcode})，重新启动")
+        if time.time() - getattr(p, "started_at", 0) < 5:
+            # 启动即退出 (配置错误等)，放慢重启频率
+            time.sleep(5)
+        processes[i] = _spawn(ctx, i, stop_event)
+        restarted += 1
+    return restarted
+
+
+def stop_workers(processes, stop_event, timeout=10):
+    """通知 worker 退出并等待；超时未退出的进程强制终止 (任务租约过期后会被重新领取)"""
+    stop_event.set()
+    for p in processes:
+        p.join(timeout)
+        if p.is_alive():
+            p.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RS Detection 异步任务 worker")
+    parser.add_argument("--workers", type=int, default=max(JOB_WORKERS, 1), help="worker 进程数")
+    args = parser.parse_args()
+
+    procs, stop = start_workers(args.workers)
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        while not stop.is_set() and any(p.is_alive() for p in procs):
+            stop.wait(1)
+    except KeyboardInterrupt:
+        pass
+    stop_workers(procs, stop)
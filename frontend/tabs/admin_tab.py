@@ -4,7 +4,9 @@ import streamlit as st
 import requests
 import pandas as pd
 from utils.config import BACKEND_URL
-from utils.api_client import upload_new_model, get_remote_model_list, delete_remote_model
+from utils.api_client import (
+    upload_new_model, get_remote_model_list, get_remote_model_details, delete_remote_model, invalidate_model_list
+)
 
 # --- 1. API 调用辅助函数 (保持不变) ---
 def get_all_users():
@@ -44,6 +46,41 @@ def delete_user(username):
         return False, response.json().get('detail', '删除用户失败')
     except requests.exceptions.RequestException as e:
         return False, str(e)
+def get_usage(days):
+    token = st.session_state.get("token")
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        response = requests.get(f"{BACKEND_URL}/admin/usage", params={"days": days}, headers=headers, timeout=5)
+        if response.status_code == 200: return response.json()
+        st.error(f"获取用量失败: {response.status_code}")
+    except requests.exceptions.RequestException as e:
+        st.error(f"网络请求错误: {e}")
+    return None
+
+def get_quota_policies():
+    token = st.session_state.get("token")
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        response = requests.get(f"{BACKEND_URL}/admin/quotas", headers=headers, timeout=5)
+        if response.status_code == 200: return response.json()
+    except requests.exceptions.RequestException:
+        pass
+    return {}
+
+def update_quota_policy(role, weight, rate, burst):
+    token = st.session_state.get("token")
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        response = requests.put(
+            f"{BACKEND_URL}/admin/quotas/{role}",
+            params={"weight": weight, "rate": rate, "burst": burst},
+            headers=headers,
+            timeout=5
+        )
+        if response.status_code == 200: return True, "配额已更新"
+        return False, response.json().get('detail', '更新配额失败')
+    except requests.exceptions.RequestException as e:
+        return False, str(e)
 # --- 2. 核心模型操作回调函数 ---
 def set_delete_candidate(filename: str, category: str):
     """设置待删除的模型，触发确认对话框"""
@@ -147,6 +184,7 @@ def render_model_management():
                             st.error(f"❌ {msg}")
                             
             if st.button("🔄 刷新模型列表", key="model_refresh_btn", use_container_width=True, disabled=upload_disabled):
+                 invalidate_model_list()
                  if "model_dict" in st.session_state:
                      del st.session_state["model_dict"]
                  st.rerun()
@@ -158,6 +196,7 @@ def render_model_management():
             tab_aerial, tab_sar = st.tabs(["✈️ 航拍模型", "📡 SAR 模型"])
             
             current_models = get_remote_model_list()
+            model_details = get_remote_model_details()
             
             if not isinstance(current_models, dict):
                 st.warning("⚠️ 数据格式异常，无法解析模型列表")
@@ -171,10 +210,12 @@ def render_model_management():
                 if not model_list:
                     st.info(f"暂无 {category} 模型", icon="📂")
                     return
+                details_by_name = {d["name"]: d for d in model_details.get(category, [])}
 
                 # 列表头部
                 header_cols = st.columns([0.65, 0.25, 0.2])
                 header_cols[0].markdown("**模型文件名**")
+                header_cols[1].markdown("**类别 / 延迟**")
                 header_cols[2].markdown("**操作**")
                 st.markdown("---")
 
@@ -185,6 +226,12 @@ def render_model_management():
 
                     # 第一列：文件名
                     model_cols[0].code(model_name)
+                    # 第二列：注册表元数据 (后台读取完成前显示 -)
+                    info = details_by_name.get(model_name, {})
+                    summary = f"{len(info['classes'])} 类" if info.get("classes") else "-"
+                    if info.get("latency_ms") is not None:
+                        summary += f" · {info['latency_ms']} ms"
+                    model_cols[1].caption(summary, help=f"{info.get('arch') or ''} imgsz={info.get('imgsz')}")
                     # 第三列：删除按钮
                     model_cols[2].button(
                         "🗑️ 删除", 
@@ -287,7 +334,45 @@ def render_user_management():
             st.markdown("<hr style='margin:0.5rem 0; opacity:0.2'>", unsafe_allow_html=True)
 
 
-# --- 5. 总管理员 Tab 渲染函数 ---
+# --- 5. 推理资源用量与配额 ---
+def render_usage_management():
+    st.subheader("📈 推理资源用量与配额")
+    st.markdown("---")
+
+    days = st.selectbox("统计范围", [1, 7, 30], index=1, format_func=lambda d: f"最近 {d} 天", key="usage_days")
+    usage = get_usage(days)
+    with st.container(border=True):
+        st.markdown("#### 👤 各用户用量")
+        if usage:
+            df = pd.DataFrame(usage)
+            df["bytes_in"] = (df["bytes_in"] / 2 ** 20).round(2)
+            df["bytes_out"] = (df["bytes_out"] / 2 ** 20).round(2)
+            df = df.rename(columns={
+                "username": "用户", "role": "角色", "requests": "请求数", "rejected": "被限流",
+                "inference_seconds": "推理秒数", "bytes_in": "上传 (MB)", "bytes_out": "返回 (MB)",
+            })
+            st.dataframe(df, hide_index=True, use_container_width=True)
+        else:
+            st.info("暂无用量数据。")
+
+    with st.container(border=True):
+        st.markdown("#### ⚖️ 角色配额")
+        st.caption("权重：排队时的公平份额；速率：每秒恢复的推理秒数；突发量：最多可累积的推理秒数")
+        for role, policy in get_quota_policies().items():
+            cols = st.columns([0.2, 0.25, 0.25, 0.25, 0.15], vertical_alignment="bottom")
+            cols[0].markdown(f"**{role}**")
+            weight = cols[1].number_input("权重", min_value=0.1, value=float(policy["weight"]), step=0.5, key=f"quota_w_{role}")
+            rate = cols[2].number_input("速率", min_value=0.01, value=float(policy["rate"]), step=0.05, key=f"quota_r_{role}")
+            burst = cols[3].number_input("突发量", min_value=1.0, value=float(policy["burst"]), step=5.0, key=f"quota_b_{role}")
+            if cols[4].button("保存", key=f"quota_save_{role}", use_container_width=True):
+                success, msg = update_quota_policy(role, weight, rate, burst)
+                if success:
+                    st.toast(f"✅ {role} {msg}")
+                else:
+                    st.error(msg)
+
+
+# --- 6. 总管理员 Tab 渲染函数 ---
 def render_admin_tab():
     st.title("🛡️ 系统管理中心")
     st.markdown("欢迎来到管理员后台，请在左侧选择操作模块。")
@@ -301,7 +386,8 @@ def render_admin_tab():
             "选择管理模块",
             options=[
                 "模型管理", 
-                "用户管理"
+                "用户管理",
+                "资源用量"
             ],
             index=0,
             key="admin_main_nav",
@@ -315,4 +401,6 @@ def render_admin_tab():
         if admin_module == "模型管理":
             render_model_management()
         elif admin_module == "用户管理":
-            render_user_management()
\ No newline at end of file
+            render_user_management()
+        elif admin_module == "资源用量":
+            render_usage_management()
\ No newline at end of file
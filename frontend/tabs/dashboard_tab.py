@@ -1,61 +1,150 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 from utils.api_client import fetch_history_data
+from utils.dashboard_data import new_version, fold_rows, daily_trend_figure, mode_pie_figure, class_bar_figure
+from utils.config import DASHBOARD_SYNC_PAGE_SIZE, DASHBOARD_MAX_ROWS, HISTORY_PAGE_SIZE
+
+# 原始记录表只需要这些列，不传输 details JSON
+HISTORY_FIELDS = "id,created_at,filename,model_type,object_count"
 
 # --- Session State 缓存数据 ---
 if 'dashboard_data' not in st.session_state:
     st.session_state['dashboard_data'] = None
 
 # --- 数据加载函数 ---
-def load_data():
-    """从后端加载历史数据并缓存到 Session State"""
+def load_data(params=None):
+    """全量加载：从后端获取聚合统计与同步游标，缓存到 Session State (聚合在数据库中完成，只传输统计结果)"""
     with st.spinner("🚀 正在加载和分析历史数据..."):
-        success, result = fetch_history_data("/analytics")
-
-        if success:
-            raw_data = result
-            if len(raw_data) > 0:
-                df = pd.DataFrame(raw_data)
-                if 'created_at' in df.columns:
-                    df['created_at'] = pd.to_datetime(df['created_at'])
-                    # 按时间倒序排列
-                    df.sort_values(by='created_at', ascending=False, inplace=True)
-
-                # 缓存处理后的数据
-                st.session_state['dashboard_data'] = df
-                return True
-            else:
-                st.session_state['dashboard_data'] = pd.DataFrame() # 空DataFrame
-                st.info("📂 数据库中暂无检测记录。")
-                return False
-        else:
-            st.error(f"❌ 数据加载失败: {result}")
+        success, summary = fetch_history_data("/analytics/summary", params)
+        if not success:
+            st.error(f"❌ 数据加载失败: {summary}")
             st.session_state['dashboard_data'] = None
             return False
 
+        ok, page = fetch_history_data("/history", _history_params(params))
+        recent_df = pd.DataFrame(page["items"] if ok else [])
+        if 'created_at' in recent_df.columns:
+            recent_df['created_at'] = pd.to_datetime(recent_df['created_at'])
+
+        sync = summary.pop("sync")
+        st.session_state['dashboard_data'] = {
+            "params": params,
+            "summary": summary,
+            "version": new_version(),
+            "recent": recent_df,
+            "history_cursor": page["next_cursor"] if ok else None,
+            "cursor": sync["cursor"],
+            "lookback": sync["lookback"],
+            "seen_ids": set(sync["seen_ids"]),
+        }
+        return True
+
+def _history_params(params, cursor=None):
+    query = dict(params or {}, limit=HISTORY_PAGE_SIZE, fields=HISTORY_FIELDS)
+    if cursor is not None:
+        query["cursor"] = cursor
+    return query
+
+def load_older_records():
+    """原始记录表翻页：按游标加载更早的一页，追加到缓存末尾"""
+    data = st.session_state['dashboard_data']
+    success, page = fetch_history_data("/history", _history_params(data["params"], data["history_cursor"]))
+    if not success:
+        st.error(f"❌ 加载失败: {page}")
+        return
+    if page["items"]:
+        older = pd.DataFrame(page["items"])
+        older['created_at'] = pd.to_datetime(older['created_at'])
+        data["recent"] = pd.concat([data["recent"], older], ignore_index=True)
+    data["history_cursor"] = page["next_cursor"]
+
+def sync_new_records():
+    """增量刷新：只拉取游标之后的新记录，追加到缓存并累加到聚合结果"""
+    data = st.session_state['dashboard_data']
+    # 回看游标前的一小段 id，补上统计时尚未提交的记录，已计入的按 id 去重
+    since_id = max(data["cursor"] - data["lookback"], 0)
+    new_rows = []
+    while True:
+        params = dict(data["params"] or {}, since_id=since_id, limit=DASHBOARD_SYNC_PAGE_SIZE)
+        success, page = fetch_history_data("/analytics/records", params)
+        if not success:
+            st.error(f"❌ 增量刷新失败: {page}")
+            return False
+        new_rows.extend(r for r in page["items"] if r["id"] not in data["seen_ids"])
+        since_id = page["next_cursor"]
+        if not page["has_more"]:
+            break
+
+    if new_rows:
+        fold_rows(data["summary"], new_rows)
+        data["version"] = new_version()
+        new_df = pd.DataFrame(new_rows)
+        new_df['created_at'] = pd.to_datetime(new_df['created_at'])
+        frame = pd.concat([new_df, data["recent"]], ignore_index=True)
+        frame.sort_values(by='created_at', ascending=False, inplace=True)
+        data["recent"] = frame.head(DASHBOARD_MAX_ROWS)
+        data["seen_ids"].update(r["id"] for r in new_rows)
+
+    data["cursor"] = max(data["cursor"], since_id)
+    # 只需保留回看窗口内的 id
+    floor = data["cursor"] - data["lookback"]
+    data["seen_ids"] = {i for i in data["seen_ids"] if i > floor}
+    if new_rows:
+        st.toast(f"新增 {len(new_rows)} 条记录")
+    return True
+
 # --- 主渲染函数 ---
 def render_dashboard_tab():
     st.markdown("## 📊 历史数据分析大屏")
 
+    # --- 0. 过滤条件 ---
+    f_col1, f_col2, f_col3 = st.columns([2, 1, 1])
+    with f_col1:
+        # 默认不限日期，统计全部历史
+        date_range = st.date_input("日期范围 (可选)", value=(), key="dash_date_range")
+    with f_col2:
+        scene = st.selectbox(
+            "检测场景",
+            ["all", "aerial", "sar"],
+            format_func=lambda x: {"all": "全部", "aerial": "✈️ 航拍", "sar": "📡 SAR"}[x],
+            key="dash_scene_select"
+        )
+
+    params = {}
+    if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
+        params["start_date"] = date_range[0].isoformat()
+        params["end_date"] = date_range[1].isoformat()
+    if scene != "all":
+        params["category"] = scene
+
     # --- 1. 数据加载与刷新 ---
-    if st.session_state['dashboard_data'] is None:
-        # 首次加载
-        load_data()
+    cached = st.session_state['dashboard_data']
+    if cached is None or cached["params"] != params:
+        # 首次加载或过滤条件变化
+        load_data(params)
 
     # 刷新按钮 (放在更显眼的位置)
-    if st.button("🔄 立即刷新数据"):
-        load_data()
-        st.rerun() # 触发重绘以显示新数据
+    with f_col3:
+        st.markdown("<div style='height: 1.7rem'></div>", unsafe_allow_html=True)
+        if st.button("🔄 立即刷新数据", use_container_width=True):
+            if st.session_state['dashboard_data'] is None:
+                load_data(params)
+            else:
+                # 只同步新增记录，耗时与新增量成正比
+                sync_new_records()
+            st.rerun() # 触发重绘以显示新数据
 
-    df = st.session_state['dashboard_data']
+    data = st.session_state['dashboard_data']
 
-    if df is None:
+    if data is None:
         # 错误或加载中
         return
 
-    if df.empty:
-        st.info("请先前往【图片检测】或【视频检测】页面生成数据。")
+    summary = data["summary"]
+    kpis = summary["kpis"]
+
+    if kpis["total_tasks"] == 0:
+        st.info("📂 所选范围内暂无检测记录。请先前往【图片检测】或【视频检测】页面生成数据。")
         return
 
     # ----------------------------------------------------
@@ -67,19 +156,16 @@ def render_dashboard_tab():
         kpi1, kpi2, kpi3, kpi4 = st.columns(4)
 
         # 1. 累计任务数
-        total_tasks = len(df)
-        kpi1.metric("累计检测任务", f"{total_tasks} 次", delta_color="off")
+        kpi1.metric("累计检测任务", f"{kpis['total_tasks']} 次", delta_color="off")
 
         # 2. 累计目标数
-        total_objects = df['object_count'].sum() if 'object_count' in df.columns else 0
-        kpi2.metric("累计发现目标", f"{total_objects} 个", delta_color="off")
+        kpi2.metric("累计发现目标", f"{kpis['total_objects']} 个", delta_color="off")
 
         # 3. 平均目标密度 (每张图/视频帧的平均目标数)
-        avg_objects = total_objects / total_tasks if total_tasks > 0 else 0
-        kpi3.metric("平均目标密度", f"{avg_objects:.2f} 个/任务", delta_color="off")
+        kpi3.metric("平均目标密度", f"{kpis['avg_objects']:.2f} 个/任务", delta_color="off")
 
         # 4. 最近检测时间
-        latest_time = df['created_at'].iloc[0].strftime('%Y-%m-%d %H:%M')
+        latest_time = pd.to_datetime(kpis['latest_time']).strftime('%Y-%m-%d %H:%M')
         kpi4.metric("最近活动时间", latest_time, delta_color="off")
 
     st.divider()
@@ -94,20 +180,8 @@ def render_dashboard_tab():
     with st.container(border=True):
         st.subheader("📈 目标数量趋势分析")
 
-        if 'created_at' in df.columns and 'object_count' in df.columns:
-            # 按天聚合，显示每日总目标数量
-            df_daily = df.set_index('created_at').resample('D')['object_count'].sum().reset_index()
-            df_daily.columns = ['日期', '目标总量']
-
-            fig_line = px.line(
-                df_daily, 
-                x='日期', 
-                y='目标总量', 
-                markers=True, 
-                title='每日目标数量变化趋势',
-                labels={'日期': '检测日期', '目标总量': '目标总数'}
-            )
-            fig_line.update_layout(hovermode="x unified")
+        if summary["daily"]:
+            fig_line = daily_trend_figure(data["version"], summary["daily"])
             st.plotly_chart(fig_line, use_container_width=True, config={'displayModeBar': False})
         else:
             st.warning("数据中缺少时间或数量信息，无法绘制趋势图。")
@@ -121,15 +195,8 @@ def render_dashboard_tab():
         with st.container(border=True):
             st.subheader("🤖 算法模式分布")
 
-            if 'model_type' in df.columns:
-                fig_pie = px.pie(
-                    df, 
-                    names='model_type', 
-                    title='不同检测模式的使用占比', 
-                    hole=0.5,
-                    color_discrete_sequence=px.colors.sequential.Teal
-                )
-                fig_pie.update_traces(textposition='inside', textinfo='percent+label', marker=dict(line=dict(color='#000000', width=1)))
+            if summary["modes"]:
+                fig_pie = mode_pie_figure(data["version"], summary["modes"])
                 st.plotly_chart(fig_pie, use_container_width=True, config={'displayModeBar': False})
             else:
                 st.info("数据中缺少模型类型信息。")
@@ -139,28 +206,8 @@ def render_dashboard_tab():
         with st.container(border=True):
             st.subheader("🏆 全库各类目标检出总量")
 
-            # 解析 JSON details 字段并累加 (与原逻辑相同)
-            total_cls_counts = {}
-            for index, row in df.iterrows():
-                details = row.get('details')
-                if details and isinstance(details, dict):
-                    for k, v in details.items():
-                        total_cls_counts[k] = total_cls_counts.get(k, 0) + v
-
-            if total_cls_counts:
-                df_counts = pd.DataFrame(list(total_cls_counts.items()), columns=['类别', '数量'])
-                df_counts.sort_values(by='数量', ascending=True, inplace=True) # 升序用于条形图
-
-                fig_bar = px.bar(
-                    df_counts, 
-                    x='数量', 
-                    y='类别', # 转换为条形图 (Bar Chart) 视觉效果更好
-                    color='类别', 
-                    orientation='h',
-                    text_auto=True,
-                    title='各类目标累计检测数量统计'
-                )
-                fig_bar.update_layout(showlegend=False, hovermode="y unified")
+            if summary["classes"]:
+                fig_bar = class_bar_figure(data["version"], summary["classes"])
                 st.plotly_chart(fig_bar, use_container_width=True, config={'displayModeBar': False})
             else:
                 st.info("暂无具体的类别统计数据。")
@@ -169,6 +216,15 @@ def render_dashboard_tab():
     st.divider()
     with st.expander("📝 展开查看原始数据库记录"):
         # 隐藏 ID 和 Details 字段，只显示关键信息
-        cols_to_display = ['created_at', 'model_name', 'category', 'object_count', 'user_id']
+        df = data["recent"]
+        cols_to_display = ['created_at', 'filename', 'model_type', 'object_count']
         display_df = df[[col for col in cols_to_display if col in df.columns]]
-        st.dataframe(display_df, use_container_width=True, hide_index=True)
\ No newline at end of file
+        st.dataframe(display_df, use_container_width=True, hide_index=True)
+
+        # 按需向后翻页，不一次性拉取全部历史
+        if data["history_cursor"] is not None:
+            if st.button(f"⬇️ 加载更早的 {HISTORY_PAGE_SIZE} 条", key="dash_history_more"):
+                load_older_records()
+                st.rerun()
+        else:
+            st.caption(f"已加载全部 {len(df)} 条记录")
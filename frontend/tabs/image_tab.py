@@ -1,7 +1,84 @@
+import io
+
 import streamlit as st
 import pandas as pd
+from PIL import Image, ImageDraw
 # 引入解码函数，防止 Base64 图片报错
-from utils.api_client import send_detect_request, decode_base64_image
+from utils.api_client import send_detect_request, stream_detect_request, decode_base64_image
+
+# 渐进式检测过程中预览图的最大宽度 (大图缩小后再画框，避免每次刷新都传输整张原图)
+PREVIEW_MAX_WIDTH = 1600
+
+
+def draw_detections(base_image, scale, layers):
+    """
+    在缩小后的原图上画检测框
+    :param layers: [(检测框列表, 颜色, 线宽), ...]，检测框坐标为原图像素坐标
+    """
+    canvas = base_image.copy()
+    draw = ImageDraw.Draw(canvas)
+    for detections, color, width in layers:
+        for det in detections:
+            x0, y0, x1, y1 = (v * scale for v in det["bbox"])
+            draw.rectangle([x0, y0, x1, y1], outline=color, width=width)
+    return canvas
+
+
+def render_result(result):
+    """展示最终检测结果 (结果图 + 统计表)"""
+    col_img, col_stat = st.columns([2, 1])
+
+    with col_img:
+        img_obj = decode_base64_image(result["image_base64"])
+        if img_obj:
+            st.image(img_obj, caption=f"检测结果 ({result['mode']})", use_container_width=True)
+        else:
+            st.error("图片数据解析失败")
+
+    with col_stat:
+        st.success(f"检测到 {result['total_objects']} 个目标")
+
+        # 渲染统计表格
+        if result["details"]:
+            df = pd.DataFrame(list(result["details"].items()), columns=["类别", "数量"])
+            st.dataframe(df, use_container_width=True, hide_index=True)
+        else:
+            st.info("未检测到目标")
+
+
+def run_progressive_detection(uploaded_file, model_choice, category_choice, conf_thres, enhance_choice):
+    """SAHI 大图：先显示整图快速预览的检测框，再随切片完成逐步补充，最后显示合并结果"""
+    file_bytes = uploaded_file.getvalue()
+    original = Image.open(io.BytesIO(file_bytes)).convert("RGB")
+    scale = min(1.0, PREVIEW_MAX_WIDTH / original.width)
+    base = original.resize((int(original.width * scale), int(original.height * scale))) if scale < 1 else original
+
+    live = st.container()
+    img_slot = live.empty()
+    progress = live.progress(0.0, text="⚡ 整图快速预览中...")
+    preview, refined = [], []
+
+    for event, data in stream_detect_request(
+        file_bytes, uploaded_file.name, uploaded_file.type,
+        model_choice, category_choice, conf_thres, enhance_choice
+    ):
+        if event == "job":
+            progress.progress(0.0, text=f"🕒 图片较大，已转为后台任务 ({data})，完成后显示结果...")
+        elif event == "preview":
+            preview = data["detections"]
+            img_slot.image(draw_detections(base, scale, [(preview, "#FFD400", 1)]),
+                           caption=f"快速预览：{len(preview)} 个目标 (切片精细检测进行中)", use_container_width=True)
+        elif event == "tile":
+            refined.extend(data["detections"])
+            progress.progress(data["done"] / data["total"], text=f"🧩 切片精细检测 {data['done']}/{data['total']}")
+            img_slot.image(draw_detections(base, scale, [(preview, "#FFD400", 1), (refined, "#FF3B30", 2)]),
+                           caption="黄色：快速预览；红色：切片检测 (合并前)", use_container_width=True)
+        elif event == "result":
+            live.empty()
+            render_result(data)
+        elif event == "error":
+            live.empty()
+            st.error(f"检测失败: {data}")
 
 
 def render_image_tab(model_dict: dict):
@@ -58,6 +135,11 @@ def render_image_tab(model_dict: dict):
         # 2. 触发检测按钮
         if st.button("🚀 开始检测", type="primary"):
 
+            # SAHI 大图耗时较长，使用渐进式检测边算边显示
+            if use_sahi:
+                run_progressive_detection(uploaded_file, model_choice, category_choice, conf_thres, enhance_choice)
+                return
+
             with st.spinner("正在请求后端推理..."):
                 file_bytes = uploaded_file.getvalue()
 
@@ -75,23 +157,6 @@ def render_image_tab(model_dict: dict):
 
             # 3. 结果展示
             if success:
-                col_img, col_stat = st.columns([2, 1])
-
-                with col_img:
-                    img_obj = decode_base64_image(result["image_base64"])
-                    if img_obj:
-                        st.image(img_obj, caption=f"检测结果 ({result['mode']})", use_container_width=True)
-                    else:
-                        st.error("图片数据解析失败")
-
-                with col_stat:
-                    st.success(f"检测到 {result['total_objects']} 个目标")
-
-                    # 渲染统计表格
-                    if result["details"]:
-                        df = pd.DataFrame(list(result["details"].items()), columns=["类别", "数量"])
-                        st.dataframe(df, use_container_width=True, hide_index=True)
-                    else:
-                        st.info("未检测到目标")
+                render_result(result)
             else:
                 st.error(f"检测失败: {result}")
\ No newline at end of file
@@ -3,13 +3,15 @@ import cv2
 import numpy as np
 import tempfile
 import time
-from utils.api_client import send_detect_request, decode_base64_image
+import uuid
+from utils.api_client import send_detect_request, decode_base64_image, end_video_session
 
 from utils.config import VIDEO_FRAME_SKIP #
 
-def process_frame(frame_bgr, model_name, category, conf):
+def process_frame(frame_bgr, model_name, category, conf, session_id=None, source_name="video_frame.jpg", frame_time=None):
     """
     处理单帧：输入 BGR，输出 RGB
+    同一次推流的帧共用 session_id，后端按会话聚合后只写一行汇总
     """
     # 1. 编码图片 (OpenCV 需要 BGR 输入)
     success, img_encoded = cv2.imencode('.jpg', frame_bgr)
@@ -23,13 +25,16 @@ def process_frame(frame_bgr, model_name, category, conf):
 
     success, result = send_detect_request(
         file_bytes=img_bytes,
-        file_name="video_frame.jpg",
+        file_name=source_name,
         file_type="image/jpeg",
         model_name=model_name,
         category=category,
         conf=conf,
         use_sahi=False,
-        enhance_type="None"
+        enhance_type="None",
+        async_mode="false",  # 视频帧必须同步返回
+        session_id=session_id,
+        frame_time=frame_time
     )
 
     if success:
@@ -92,6 +97,7 @@ def render_video_tab(model_dict: dict):
     stop_button = st.button("🔴 停止推流", type="secondary")
 
     cap = None
+    source_name = "webcam"
 
     # 初始化视频源
     if video_source == "本地视频文件":
@@ -100,6 +106,7 @@ def render_video_tab(model_dict: dict):
             tfile = tempfile.NamedTemporaryFile(delete=False)
             tfile.write(video_file.read())
             cap = cv2.VideoCapture(tfile.name)
+            source_name = video_file.name
     elif video_source == "实时摄像头 (Webcam)":
         if st.checkbox("启动摄像头", key="start_webcam_checkbox"):
             cap = cv2.VideoCapture(0)
@@ -116,6 +123,9 @@ def render_video_tab(model_dict: dict):
 
         frame_count = 0
         start_time = time.time()
+        # 本地视频按帧号换算时间戳，摄像头按实际经过的时间
+        video_fps = cap.get(cv2.CAP_PROP_FPS) if source_name != "webcam" else 0
+        session_id = uuid.uuid4().hex
 
         # ⚠️ 启动循环，直到用户点击停止或视频结束
         while cap.isOpened() and not st.session_state['stop_video_stream']:
@@ -129,12 +139,17 @@ def render_video_tab(model_dict: dict):
             if frame_count % VIDEO_FRAME_SKIP != 0:
                 continue
 
+            frame_time = frame_count / video_fps if video_fps > 0 else time.time() - start_time
+
             # === 核心处理：使用局部变量 ===
             processed_frame, obj_count = process_frame(
                 frame, 
                 model_choice,    # ✅ 局部变量
                 category_choice, # ✅ 局部变量
-                conf_thres       # ✅ 局部变量
+                conf_thres,      # ✅ 局部变量
+                session_id=session_id,
+                source_name=source_name,
+                frame_time=frame_time
             )
 
 
@@ -159,6 +174,14 @@ def render_video_tab(model_dict: dict):
         cap.release()
         st.session_state['stop_video_stream'] = False # 重置停止标志
 
+        # 结束会话，后端写入一行汇总记录
+        summary = end_video_session(session_id)
+        if summary:
+            st.success(
+                f"本次推流共 {summary['frame_count']} 帧，单帧最多 {summary['max_objects']} 个目标，"
+                f"平均 {summary['avg_objects']:.1f} 个/帧"
+            )
+
     elif cap is not None:
          # 确保 cap 释放
          cap.release()
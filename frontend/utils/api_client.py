@@ -1,11 +1,13 @@
 import requests
 import base64
+import json
+import time
 from PIL import Image
 import io
 import numpy as np
 import cv2
 import streamlit as st
-from .config import BACKEND_URL
+from .config import BACKEND_URL, JOB_POLL_INTERVAL, JOB_WAIT_TIMEOUT, MODEL_LIST_TTL
 
 def check_backend_health():
     """检查后端是否存活"""
@@ -35,6 +37,7 @@ def delete_remote_model(filename: str, category: str):
         )
 
         if response.status_code == 200:
+            invalidate_model_list()
             return True, f"✅ 模型 {filename} (场景: {category}) 删除成功。"
 
         # 处理 400/404/500 等错误
@@ -45,9 +48,13 @@ def delete_remote_model(filename: str, category: str):
         return False, f"❌ 网络请求错误: {e}"
 
 
-def send_detect_request(file_bytes, file_name, file_type, model_name, category, conf, use_sahi, enhance_type):
+def send_detect_request(file_bytes, file_name, file_type, model_name, category, conf, use_sahi, enhance_type,
+                        async_mode="auto", session_id=None, frame_time=None):
     """
     统一发送检测请求
+    :param async_mode: auto 由后端判断是否转为后台任务; false 强制同步 (视频帧)
+    :param session_id: 视频会话 ID，带上后后端只做会话聚合，不逐帧写库
+    :param frame_time: 帧在视频中的时间戳 (秒)
     """
     try:
         files = {"file": (file_name, file_bytes, file_type)}
@@ -56,13 +63,31 @@ def send_detect_request(file_bytes, file_name, file_type, model_name, category,
             "category": category,    # <--- 新增：必须把这个参数传给后端
             "conf": conf,
             "use_sahi": str(use_sahi).lower(),
-            "enhance_type": enhance_type
+            "enhance_type": enhance_type,
+            "async_mode": async_mode
         }
+        if session_id:
+            data["session_id"] = session_id
+            if frame_time is not None:
+                data["frame_time"] = frame_time
 
-        response = requests.post(f"{BACKEND_URL}/detect/", files=files, data=data, timeout=30)
+        # 带上登录 Token，后端按用户分配推理配额并统计用量
+        headers = {}
+        token = st.session_state.get("token")
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+
+        response = requests.post(f"{BACKEND_URL}/detect/", files=files, data=data, headers=headers, timeout=30)
         
         if response.status_code == 200:
             return True, response.json()
+        elif response.status_code == 202:
+            # 后端判断耗时过长，已转为后台任务
+            return wait_for_job(response.json()["job_id"])
+        elif response.status_code == 429:
+            # 后端推理队列已满 (或视频帧排队过久被丢弃)
+            retry_after = response.headers.get("Retry-After", "1")
+            return False, f"服务繁忙，请 {retry_after} 秒后重试"
         else:
             return False, f"后端错误 ({response.status_code}): {response.text}"
 
@@ -73,12 +98,96 @@ def send_detect_request(file_bytes, file_name, file_type, model_name, category,
     except Exception as e:
         return False, f"未知错误: {e}"
 
-def fetch_history_data(endpoint="/analytics"):
-    """获取历史数据"""
+def stream_detect_request(file_bytes, file_name, file_type, model_name, category, conf, enhance_type):
+    """
+    渐进式 SAHI 检测 (Server-Sent Events)，逐条产出 (事件名, 数据)
+    事件: start / preview / tile / result，失败时产出 ("error", 错误信息)
+    后端把大图转为后台任务时先产出 ("job", job_id)，任务完成后产出 result
+    """
+    files = {"file": (file_name, file_bytes, file_type)}
+    data = {"model_name": model_name, "category": category, "conf": conf, "enhance_type": enhance_type}
+    headers = {"Accept": "text/event-stream"}
+    token = st.session_state.get("token")
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+
     try:
-        response = requests.get(f"{BACKEND_URL}{endpoint}", timeout=10)
+        # 读超时针对相邻两条事件之间的间隔，而不是整个请求
+        with requests.post(f"{BACKEND_URL}/detect/stream", files=files, data=data, headers=headers,
+                           stream=True, timeout=(5, 120)) as response:
+            if response.status_code == 429:
+                yield "error", f"服务繁忙，请 {response.headers.get('Retry-After', '1')} 秒后重试"
+                return
+            if response.status_code == 202:
+                job_id = response.json()["job_id"]
+                yield "job", job_id
+                success, result = wait_for_job(job_id)
+                yield ("result", result) if success else ("error", result)
+                return
+            if response.status_code != 200:
+                yield "error", f"后端错误 ({response.status_code}): {response.text}"
+                return
+
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[7:]
+                elif line.startswith("data: ") and event:
+                    payload = json.loads(line[6:])
+                    if event == "error":
+                        yield "error", payload.get("detail", "未知错误")
+                        return
+                    yield event, payload
+                    event = None
+
+    except requests.exceptions.ConnectionError:
+        yield "error", "无法连接到后端服务器，请检查后端是否启动。"
+    except requests.exceptions.Timeout:
+        yield "error", "请求超时，可能是图片过大或算法耗时太久。"
+
+def end_video_session(session_id):
+    """通知后端结束视频会话，返回会话汇总 (失败返回 None)"""
+    try:
+        response = requests.post(f"{BACKEND_URL}/video/sessions/{session_id}/end", timeout=10)
+        if response.status_code == 200:
+            return response.json()
+        return None
+    except requests.exceptions.RequestException:
+        return None
+
+def wait_for_job(job_id, timeout=JOB_WAIT_TIMEOUT):
+    """轮询后台任务直到完成，返回 (success, result)"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = requests.get(f"{BACKEND_URL}/jobs/{job_id}/result", timeout=30)
         if response.status_code == 200:
             return True, response.json()
+        if response.status_code != 202:
+            detail = response.json().get('detail', response.text)
+            return False, f"后台任务失败 ({response.status_code}): {detail}"
+        time.sleep(JOB_POLL_INTERVAL)
+    return False, f"后台任务 {job_id} 仍在执行，请稍后通过 /jobs/{job_id}/result 查看结果。"
+
+def fetch_history_data(endpoint="/analytics", params=None):
+    """
+    获取历史数据 / 聚合统计
+    按 (接口, 参数) 在 session_state 中保存上次的 ETag 与响应正文，
+    重复请求时带 If-None-Match，数据未变化时后端返回 304，直接复用本地结果
+    """
+    http_cache = st.session_state.setdefault("http_cache", {})
+    cache_key = (endpoint, tuple(sorted((params or {}).items())))
+    cached = http_cache.get(cache_key)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    try:
+        response = requests.get(f"{BACKEND_URL}{endpoint}", params=params, headers=headers, timeout=10)
+        if response.status_code == 304 and cached:
+            # 每次重新解析，调用方可以放心修改返回的数据
+            return True, json.loads(cached[1])
+        if response.status_code == 200:
+            etag = response.headers.get("ETag")
+            if etag:
+                http_cache[cache_key] = (etag, response.text)
+            return True, response.json()
         else:
             return False, f"获取数据失败: {response.status_code}"
     except Exception as e:
@@ -92,20 +201,32 @@ def decode_base64_image(base64_str):
     except Exception:
         return None
 
+@st.cache_data(ttl=MODEL_LIST_TTL, show_spinner=False)
+def _fetch_model_listing():
+    """后端模型注册表 (公开接口，所有会话共用缓存；请求失败时抛出异常，不会被缓存)"""
+    response = requests.get(f"{BACKEND_URL}/models", timeout=2)
+    response.raise_for_status()
+    return response.json()
+
+
+def invalidate_model_list():
+    """上传 / 删除模型后清空缓存，下次读取时重新请求"""
+    _fetch_model_listing.clear()
+
+
 def get_remote_model_list():
-    """从后端获取最新的模型列表 (支持带 Token)"""
+    """获取模型列表 {"aerial": [文件名], "sar": [文件名]} (带缓存)"""
     try:
-        headers = {}
-        token = st.session_state.get("token")
-        if token:
-            headers["Authorization"] = f"Bearer {token}"
-
-        response = requests.get(f"{BACKEND_URL}/admin/models", headers=headers, timeout=2)
-        if response.status_code == 200:
-            # 返回字典 {"aerial": [], "sar": []}
-            return response.json().get("models", {}) 
+        return _fetch_model_listing().get("models", {})
+    except Exception:
         return {}
-    except:
+
+
+def get_remote_model_details():
+    """获取模型元数据 {"aerial": [{name, classes, imgsz, params, latency_ms, ...}], ...} (带缓存)"""
+    try:
+        return _fetch_model_listing().get("details", {})
+    except Exception:
         return {}
 
 def upload_new_model(file_bytes, filename, category):
@@ -131,6 +252,7 @@ def upload_new_model(file_bytes, filename, category):
         )
 
         if response.status_code == 200:
+            invalidate_model_list()
             return True, response.json().get("message", "上传成功")
         elif response.status_code == 401:
             return False, "身份验证失败 (401)"
@@ -13,4 +13,14 @@ ENHANCE_OPTIONS = ["None", "CLAHE (自适应直方图均衡)", "Gamma Correction
 PAGE_TITLE = "多源遥感目标检测系统"
 
 # 视频处理配置
-VIDEO_FRAME_SKIP = 2  # 视频跳帧处理 (每隔几帧处理一次，提高流畅度)
\ No newline at end of file
+VIDEO_FRAME_SKIP = 2  # 视频跳帧处理 (每隔几帧处理一次，提高流畅度)
+# 异步任务轮询配置 (大图 SAHI 请求会被后端转为后台任务)
+JOB_POLL_INTERVAL = 1.0   # 轮询间隔 (秒)
+JOB_WAIT_TIMEOUT = 900    # 最长等待时间 (秒)
+# 模型列表缓存时间 (秒)：所有会话共用，上传 / 删除模型后立即失效
+MODEL_LIST_TTL = 60
+
+# 数据大屏配置
+DASHBOARD_SYNC_PAGE_SIZE = 1000   # 增量同步每页条数
+DASHBOARD_MAX_ROWS = 5000         # 本地缓存的明细行上限
+HISTORY_PAGE_SIZE = 50            # 原始记录表每页条数
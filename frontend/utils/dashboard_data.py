@@ -0,0 +1,122 @@
+"""
+大屏数据层
+- 增量记录用向量化方式累加到聚合结果 (details 经 json_normalize 展开为稀疏类别列)
+- 图表所需的 DataFrame / Plotly 图按数据版本号用 st.cache_data 缓存，
+  与数据无关的控件点击触发的重绘直接命中缓存，不再重新计算
+"""
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import streamlit as st
+
+# 同时缓存的数据版本数 (每个会话、每组过滤条件各占一个)
+CACHE_MAX_ENTRIES = 64
+
+
+def new_version() -> str:
+    """聚合结果每次变化 (全量加载 / 增量同步到新记录) 都生成新的版本号"""
+    return str(time.time_ns())
+
+
+def flatten_details(rows) -> pd.DataFrame:
+    """把 details JSON 展开为类别列；各记录只包含少数类别，使用稀疏存储"""
+    details = pd.json_normalize([r.get("details") or {} for r in rows])
+    if details.empty:
+        return details
+    return details.astype(pd.SparseDtype("float64", np.nan))
+
+
+def fold_rows(summary, rows):
+    """把新记录累加到已缓存的聚合结果中 (原地修改 summary)"""
+    frame = pd.DataFrame(rows, columns=["created_at", "model_type", "object_count"])
+    frame["object_count"] = frame["object_count"].fillna(0).astype("int64")
+
+    kpis = summary["kpis"]
+    kpis["total_tasks"] += len(frame)
+    kpis["total_objects"] += int(frame["object_count"].sum())
+    # ISO 格式的时间字符串可以直接比较大小
+    latest = frame["created_at"].max()
+    if not kpis["latest_time"] or latest > kpis["latest_time"]:
+        kpis["latest_time"] = latest
+    kpis["avg_objects"] = round(kpis["total_objects"] / kpis["total_tasks"], 2) if kpis["total_tasks"] else 0
+
+    daily = {d["date"]: d for d in summary["daily"]}
+    per_day = frame.groupby(frame["created_at"].str[:10])["object_count"].agg(["size", "sum"])
+    for day, tasks, objects in per_day.itertuples():
+        d = daily.setdefault(day, {"date": day, "tasks": 0, "objects": 0})
+        d["tasks"] += int(tasks)
+        d["objects"] += int(objects)
+
+    modes = {m["model_type"]: m for m in summary["modes"]}
+    for mode, count in frame["model_type"].value_counts(dropna=False).items():
+        mode = None if pd.isna(mode) else mode
+        m = modes.setdefault(mode, {"model_type": mode, "count": 0})
+        m["count"] += int(count)
+
+    classes = {c["class_name"]: c for c in summary["classes"]}
+    for name, count in flatten_details(rows).sum().items():
+        c = classes.setdefault(name, {"class_name": name, "count": 0})
+        c["count"] += int(count)
+
+    summary["daily"] = sorted(daily.values(), key=lambda d: d["date"])
+    summary["modes"] = list(modes.values())
+    summary["classes"] = sorted(classes.values(), key=lambda c: -c["count"])
+
+
+# 以下函数以下划线开头的参数不参与缓存键计算，缓存只按 version 区分
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def daily_trend_figure(version, _daily):
+    """每日目标数量趋势图 (补齐没有记录的日期)"""
+    df_daily = pd.DataFrame(_daily)
+    df_daily['date'] = pd.to_datetime(df_daily['date'])
+    df_daily = df_daily.set_index('date').resample('D')['objects'].sum().reset_index()
+    df_daily.columns = ['日期', '目标总量']
+
+    fig_line = px.line(
+        df_daily,
+        x='日期',
+        y='目标总量',
+        markers=True,
+        title='每日目标数量变化趋势',
+        labels={'日期': '检测日期', '目标总量': '目标总数'}
+    )
+    fig_line.update_layout(hovermode="x unified")
+    return fig_line
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def mode_pie_figure(version, _modes):
+    """检测模式占比饼图"""
+    fig_pie = px.pie(
+        pd.DataFrame(_modes),
+        names='model_type',
+        values='count',
+        title='不同检测模式的使用占比',
+        hole=0.5,
+        color_discrete_sequence=px.colors.sequential.Teal
+    )
+    fig_pie.update_traces(textposition='inside', textinfo='percent+label', marker=dict(line=dict(color='#000000', width=1)))
+    return fig_pie
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def class_bar_figure(version, _classes):
+    """各类别累计数量条形图"""
+    df_counts = pd.DataFrame(_classes)
+    df_counts.columns = ['类别', '数量']
+    df_counts.sort_values(by='数量', ascending=True, inplace=True) # 升序用于条形图
+
+    fig_bar = px.bar(
+        df_counts,
+        x='数量',
+        y='类别', # 转换为条形图 (Bar Chart) 视觉效果更好
+        color='类别',
+        orientation='h',
+        text_auto=True,
+        title='各类目标累计检测数量统计'
+    )
+    fig_bar.update_layout(showlegend=False, hovermode="y unified")
+    return fig_bar